@@ -0,0 +1,190 @@
+import os
+import glob
+import json
+import threading
+from datetime import datetime, timedelta
+import kd_timers
+from kd_app_thread import AppThread
+
+
+class ActivityLog:
+    """ The ActivityLog class records the application's activity as plain text, one line per entry - stored as a
+        separate append-only file for each day, named <log_prefix>-YYYYMMDD.log.
+
+        Entries are buffered in memory and written in batches by the ActivityLogThread (or as soon as max_buffered
+        entries are waiting), so adding an entry never waits for the disk.  Writing only ever appends to the current
+        day's file, and retention only ever removes whole days' files, so neither gets slower as history builds up -
+        unlike a single log file, which has to be read and re-written to remove old entries.
+        Each line is a 26 character timestamp, then ' - ', then the entry, e.g. '2019-01-01 12:00:00.000000 - Text'.
+        Entries may also add to named counters (e.g. total processing time) which are kept as running totals for each
+        day, and saved to <log_prefix>-counters.json with each flush - so reading a total never re-reads the log.
+        ActivityLog has no project-specific dependencies.
+    """
+
+    #
+    # ##### CLASS ATTRIBUTES
+    #
+    _is_setup = False
+    _log_prefix = None
+    _print_also = False
+    _max_buffered = 100
+    _buffer = []
+    _counters = {}          # Keyed by day (as YYYYMMDD), with the value being a dict of {counter name: total}
+    _counters_changed = False
+    _lock = threading.Lock()
+    _write_lock = threading.Lock()
+
+    #
+    # ##### SETUP METHODS
+    #
+    @staticmethod
+    def setup(log_prefix, print_also=False, max_buffered=100):
+        """ ActivityLog.setup() must be called before any entries are added.
+            :param log_prefix: A fully qualified path, to which -YYYYMMDD.log is added for each day's file - any file
+                               extension (e.g. .json, from a single file log) is ignored.
+            :param print_also: Boolean; if true, each entry is also printed as it is added.
+            :param max_buffered: Maximum number of entries held in memory, before they are written immediately.
+        """
+        ActivityLog._log_prefix = os.path.splitext(log_prefix)[0]
+        ActivityLog._print_also = print_also
+        ActivityLog._max_buffered = max_buffered
+        os.makedirs(os.path.dirname(ActivityLog._log_prefix), exist_ok=True)
+        try:
+            with open(ActivityLog._counters_fullpath(), 'r') as counters_handle:
+                ActivityLog._counters = json.load(counters_handle)
+        except (OSError, ValueError):
+            ActivityLog._counters = {}
+        ActivityLog._is_setup = True
+
+    #
+    # ##### PUBLIC METHODS
+    #
+    @staticmethod
+    def add_entry(entry, counters=None):
+        """ Adds an entry to the log - written by the ActivityLogThread, or on the next flush().
+            :param entry: The text of the entry.
+            :param counters: Optional dict of {counter name: amount}, each added to today's total for that counter.
+        """
+        if not ActivityLog._is_setup:
+            raise Exception('Must call ActivityLog.setup() before adding entries')
+        now = datetime.now()
+        line = '%s - %s' % (now.strftime('%Y-%m-%d %H:%M:%S.%f'), entry)
+        if ActivityLog._print_also:
+            print(line)
+        with ActivityLog._lock:
+            ActivityLog._buffer.append((now.strftime('%Y%m%d'), line))
+            if counters:
+                day_counters = ActivityLog._counters.setdefault(now.strftime('%Y%m%d'), {})
+                for name, amount in counters.items():
+                    day_counters[name] = day_counters.get(name, 0) + amount
+                ActivityLog._counters_changed = True
+            is_full = len(ActivityLog._buffer) >= ActivityLog._max_buffered
+        if is_full:
+            ActivityLog.flush()
+
+    @staticmethod
+    def flush():
+        """ Writes every buffered entry, appending each to the file for the day it was added - and saves the counters,
+            if any have changed.
+        """
+        with ActivityLog._write_lock:
+            with ActivityLog._lock:
+                buffered = ActivityLog._buffer
+                ActivityLog._buffer = []
+                counters = json.dumps(ActivityLog._counters) if ActivityLog._counters_changed else None
+                ActivityLog._counters_changed = False
+            lines_by_day = {}
+            for day, line in buffered:
+                lines_by_day.setdefault(day, []).append(line)
+            for day, lines in sorted(lines_by_day.items()):
+                try:
+                    with open(ActivityLog._day_fullpath(day), 'a') as log_handle:
+                        log_handle.write('%s\n' % '\n'.join(lines))
+                except OSError:
+                    # If e.g. disk full or unable to write, continue running anyway - the log is lost, but not the app
+                    pass
+            if counters is not None:
+                # Write to a temporary file and then rename, so a crash part way through never leaves corrupt counters
+                temp_fullpath = '%s.tmp' % ActivityLog._counters_fullpath()
+                try:
+                    with open(temp_fullpath, 'w') as counters_handle:
+                        counters_handle.write(counters)
+                    os.replace(temp_fullpath, ActivityLog._counters_fullpath())
+                except OSError:
+                    pass
+
+    @staticmethod
+    def get_counter(name):
+        """ Returns the total of a counter, over every day still held (i.e. not yet removed by cleanup_by_date). """
+        with ActivityLog._lock:
+            return sum(day_counters.get(name, 0) for day_counters in ActivityLog._counters.values())
+
+    @staticmethod
+    def get_entire_log():
+        """ Returns a list of every entry still held, oldest first - each as a line including its timestamp. """
+        ActivityLog.flush()
+        lines = []
+        for day_fullpath in ActivityLog._day_fullpaths():
+            with open(day_fullpath, 'r') as log_handle:
+                lines.extend(line.rstrip('\n') for line in log_handle)
+        return lines
+
+    @staticmethod
+    def cleanup_by_date(num_days_to_keep):
+        """ Removes the files and counters for any days more than num_days_to_keep ago - including today, i.e. 1 keeps
+            only today.
+            :return: Returns a list of the files removed.
+        """
+        oldest_day = (datetime.now() - timedelta(days=num_days_to_keep - 1)).strftime('%Y%m%d')
+        with ActivityLog._lock:
+            for day in [day for day in ActivityLog._counters if day < oldest_day]:
+                del ActivityLog._counters[day]
+                ActivityLog._counters_changed = True
+        removed = []
+        for day_fullpath in ActivityLog._day_fullpaths():
+            if ActivityLog._day_of(day_fullpath) < oldest_day:
+                os.remove(day_fullpath)
+                removed.append(day_fullpath)
+        return removed
+
+    #
+    # ##### PRIVATE METHODS
+    #
+    @staticmethod
+    def _day_fullpath(day):
+        """ PRIVATE: Returns the path of the file for the specified day, as YYYYMMDD. """
+        return '%s-%s.log' % (ActivityLog._log_prefix, day)
+
+    @staticmethod
+    def _counters_fullpath():
+        """ PRIVATE: Returns the path of the file in which every day's counters are saved. """
+        return '%s-counters.json' % ActivityLog._log_prefix
+
+    @staticmethod
+    def _day_of(day_fullpath):
+        """ PRIVATE: Returns the day (as YYYYMMDD) of a day's file. """
+        return day_fullpath[len(ActivityLog._log_prefix) + 1:-len('.log')]
+
+    @staticmethod
+    def _day_fullpaths():
+        """ PRIVATE: Returns the paths of every day's file, oldest first. """
+        return sorted(day_fullpath for day_fullpath in glob.glob('%s-*.log' % glob.escape(ActivityLog._log_prefix))
+                      if len(ActivityLog._day_of(day_fullpath)) == 8 and ActivityLog._day_of(day_fullpath).isdigit())
+
+
+#
+# ##### ACTIVITY LOG THREAD
+#
+class ActivityLogThread(AppThread):
+
+    def threaded_function(self, flush_secs=5):
+        while True:
+            if self.should_abort():
+                # Write anything still buffered before stopping
+                ActivityLog.flush()
+                return
+
+            if kd_timers.secs_elapsed_since_last(secs=flush_secs, timer_id='activity_log_flush'):
+                ActivityLog.flush()
+            else:
+                kd_timers.sleep(secs=0.25)
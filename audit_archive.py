@@ -0,0 +1,96 @@
+import os
+import queue
+import numpy
+import zipfile
+import kd_timers
+from kd_app_thread import AppThread
+from thread_budget import ThreadBudget
+
+
+class AuditArchive:
+    """ The AuditArchive class collects audit data (interim images, values, etc) from Frames and Subjects within a
+        single clip, and saves it into a compressed debug archive rather than keeping it in memory.
+
+        Audits are queued via add(), and written asynchronously by the AuditWriter thread.  The archive is a standard
+        compressed .npz file, so can be opened with numpy.load() - each entry is named by frame time, optionally the
+        subject number within that frame, and the audit key, e.g. 'frame3000-subject1-prev_absolute'.
+        AuditArchive has no project-specific dependencies.
+    """
+
+    def __init__(self, archive_fullpath, max_queued=32):
+        """ Create a new AuditArchive - the archive file itself is only created once the first audit is written.
+            :param archive_fullpath: A fully qualified path for the archive, which should end .npz
+            :param max_queued: Maximum number of frames waiting to be written, before add() blocks the caller.
+        """
+        self.archive_fullpath = archive_fullpath
+        self.queue = queue.Queue(maxsize=max_queued)
+        self.writer_stopped = False     # Set by the AuditWriter once it stops, for whatever reason
+        self._zip = None
+
+    def add(self, time, frame_audit, subject_audits):
+        """ Queues the audit for a single frame (and its subjects) to be written to the archive - waiting while the
+            queue is full, unless the AuditWriter has stopped (e.g. aborted, or failed), when the audit is dropped.
+            :param time: The time of the frame, in milliseconds.
+            :param frame_audit: The frame's audit dict.
+            :param subject_audits: A list of the audit dicts for each subject within the frame.
+            :return: Returns True if queued, or False if dropped as the AuditWriter has stopped.
+        """
+        while not self.writer_stopped:
+            try:
+                self.queue.put((time, frame_audit, subject_audits), timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def write_next(self, timeout):
+        """ Writes the next queued audit to the archive, waiting up to timeout seconds for one to be available.
+            :return: Returns True if an audit was written, or False if none were queued.
+        """
+        try:
+            time, frame_audit, subject_audits = self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return False
+        if self._zip is None:
+            os.makedirs(os.path.dirname(self.archive_fullpath), exist_ok=True)
+            self._zip = zipfile.ZipFile(self.archive_fullpath, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=1)
+        for key, value in frame_audit.items():
+            self._write_entry('frame%d-%s' % (time, key), value)
+        for subject_num, subject_audit in enumerate(subject_audits):
+            for key, value in subject_audit.items():
+                self._write_entry('frame%d-subject%d-%s' % (time, subject_num, key), value)
+        return True
+
+    def _write_entry(self, name, value):
+        """ PRIVATE: Writes a single value to the archive, in numpy .npy format. """
+        with self._zip.open('%s.npy' % name, 'w', force_zip64=True) as entry_handle:
+            numpy.lib.format.write_array(entry_handle, numpy.asanyarray(value), allow_pickle=False)
+
+    def close(self):
+        if self._zip is not None:
+            self._zip.close()
+            self._zip = None
+
+
+#
+# AUDIT WRITER THREAD
+#
+class AuditWriter(AppThread):
+
+    def threaded_function(self, clip):
+        ThreadBudget.pin_current_thread('output')
+        try:
+            while True:
+
+                if self.should_abort():
+                    return
+
+                if not clip.audit_archive.write_next(timeout=0.1):
+                    # Once all segments are created there can be no more audits, so finish once the queue is empty
+                    if clip.created_all_segments and clip.audit_archive.queue.empty():
+                        break
+                    kd_timers.sleep(0.05)
+        finally:
+            # However the writer stops, never leave CreateSegments waiting to add to a queue which won't be emptied
+            clip.audit_archive.writer_stopped = True
+            clip.audit_archive.close()
@@ -0,0 +1,101 @@
+import file_handling
+
+
+class CameraProfiles:
+    """ The CameraProfiles class holds the settings which may differ between cameras, for when several cameras upload
+        into the same video_pending folder.
+
+        Each profile is a dict containing the source video dimensions (source_size_x, source_size_y), masks and
+        trigger_zones.  Profiles are keyed on the camera prefix of each video filename (as found by
+        file_handling.get_file_metadata), and only need to include values which differ from the default profile - any
+        camera without its own profile, or whose filename has no recognisable prefix, just uses the default.
+        CameraProfiles has no project-specific dependencies.
+    """
+
+    #
+    # ##### CLASS ATTRIBUTES
+    #
+    _is_setup = False
+    _default = {}
+    _profiles = {}
+
+    #
+    # ##### SETUP METHODS
+    #
+    @staticmethod
+    def setup(default_profile, camera_profiles):
+        """ CameraProfiles.setup() must be called before any profiles are requested.
+            :param default_profile: A complete profile, used for any camera without a profile of its own.
+            :param camera_profiles: A dict keyed on camera prefix, each a (partial) profile overriding the default.
+        """
+        CameraProfiles._default = default_profile
+        CameraProfiles._profiles = camera_profiles
+        CameraProfiles._is_setup = True
+
+    #
+    # ##### PUBLIC METHODS
+    #
+    @staticmethod
+    def get(camera):
+        """ Returns the profile for the specified camera, with any values not in its own profile taken from the default.
+            :param camera: The camera prefix, as returned in the 'camera' key of file_handling.get_file_metadata.
+            :return: Returns a complete profile dict.
+        """
+        if not CameraProfiles._is_setup:
+            raise Exception('Must call CameraProfiles.setup() before requesting a camera profile')
+        profile = dict(CameraProfiles._default)
+        profile.update(CameraProfiles._profiles.get(camera, {}))
+        return profile
+
+
+class FairScheduler:
+    """ The FairScheduler class orders pending videos so that every camera gets its turn, rather than processing in
+        filename order - where one busy camera (e.g. pointing at a tree on a windy day) could starve all the others.
+
+        Cameras are served round-robin, each giving its oldest pending video in turn, starting with the camera after
+        whichever was served last.  Within each camera, videos stay in filename (i.e. time) order.
+        FairScheduler has no project-specific dependencies, other than file_handling to parse camera prefixes.
+    """
+
+    def __init__(self):
+        self._last_served = None
+        self._has_served = False
+
+    def order(self, video_list):
+        """ Re-orders a list of pending videos, interleaving cameras round-robin.
+            :param video_list: A list of video paths, relative to video_pending, as from get_pending_video_list.
+            :return: Returns a new list, of the same videos in the order they should be processed.
+        """
+        by_camera = {}
+        for video in video_list:
+            camera = file_handling.get_file_metadata('', video)['camera']
+            by_camera.setdefault(camera, []).append(video)
+
+        cameras = self.camera_order(by_camera)
+        ordered = []
+        for position in range(max((len(videos) for videos in by_camera.values()), default=0)):
+            for camera in cameras:
+                if position < len(by_camera[camera]):
+                    ordered.append(by_camera[camera][position])
+        return ordered
+
+    def camera_order(self, cameras):
+        """ Returns the cameras in the order they should take their turn - starting with the first camera after the one
+            last served, so each camera takes its turn at the front.
+            :param cameras: An iterable of camera prefixes (or None, for videos with no recognisable prefix).
+        """
+        cameras = sorted(cameras, key=self._sort_key)
+        if self._has_served:
+            start = len([camera for camera in cameras if self._sort_key(camera) <= self._sort_key(self._last_served)])
+            cameras = cameras[start:] + cameras[:start]
+        return cameras
+
+    @staticmethod
+    def _sort_key(camera):
+        """ PRIVATE: Sorts cameras by prefix, with videos that have no recognisable prefix (camera None) first. """
+        return '' if camera is None else camera
+
+    def mark_served(self, camera):
+        """ Records that a video from this camera has just been processed, so the next camera goes first next time. """
+        self._last_served = camera
+        self._has_served = True
@@ -0,0 +1,98 @@
+import os
+import json
+import kd_timers
+from frame import Frame
+
+
+class ClipCheckpoint:
+    """ The ClipCheckpoint class records progress through a single clip, so that if the application is restarted part
+        way through (e.g. after a crash, or the 12 minute timeout), processing resumes from the last segment that was
+        completely output, rather than starting again from the beginning.
+
+        After each segment's composites are saved, the segment (its times, trigger zones and composite paths) is added
+        to a small .json file saved next to the video - so like the frame cache, it is removed along with the video.
+        On resume, only segments which are contiguous from the first segment, and whose composites all still exist,
+        are trusted.  The time of the next frame after the last of these is then used as the base frame for the
+        resumed clip, which is exactly where the following segment would have started had it not been interrupted.
+        The checkpoint is only valid for the same video (by size and modified time) and the same Frame dimensions.
+        ClipCheckpoint is dependent on Frame, as a project-specific dependency.
+    """
+
+    def __init__(self, video_fullpath):
+        """ Create a new ClipCheckpoint for the specified video - does not read or write anything until requested.
+            :param video_fullpath: A fully qualified path to the video file being processed.
+        """
+        self._video_fullpath = video_fullpath
+        self._fullpath = '%s.checkpoint.json' % video_fullpath
+        self._segments = []
+        self.time_increment = None
+
+    def _signature(self):
+        """ PRIVATE: Returns a dict of all values which must match for the checkpoint to be valid. """
+        video_stat = os.stat(self._video_fullpath)
+        return {'video_size': video_stat.st_size,
+                'video_mtime': video_stat.st_mtime,
+                'dimensions_large': list(Frame.dimensions.large)}
+
+    def load(self, basename):
+        """ Loads any existing checkpoint for this video, keeping only the segments which can be trusted.
+            :param basename: The basename used for the clip's outputs - used to find composites renamed with an 'A'
+                             suffix, after the checkpoint was saved.
+            :return: Returns a list of segment dicts, in index order - an empty list if there is nothing to resume.
+        """
+        try:
+            with open(self._fullpath, 'r') as checkpoint_handle:
+                checkpoint = json.load(checkpoint_handle)
+        except (OSError, ValueError):
+            return []
+        if checkpoint.get('signature') != self._signature():
+            return []
+
+        self.time_increment = checkpoint['time_increment']
+        segments_by_index = {segment['index']: segment for segment in checkpoint['segments']}
+        self._segments = []
+        while len(self._segments) in segments_by_index:
+            segment = segments_by_index[len(self._segments)]
+            if not all(self._composite_exists(composite_path, basename) for composite_path in segment['composites']):
+                break
+            self._segments.append(segment)
+        return list(self._segments)
+
+    @staticmethod
+    def _composite_exists(composite_path, basename):
+        """ PRIVATE: Checks a composite still exists - either where saved, or renamed with 'A' when a second segment
+            was output (see file_handling.rename_basename_append).
+        """
+        if os.path.isfile(composite_path):
+            return True
+        folder, filename = os.path.split(composite_path)
+        return (filename.startswith('%s-' % basename)
+                and os.path.isfile(os.path.join(folder, '%sA%s' % (basename, filename[len(basename):]))))
+
+    def add_segment(self, segment, time_increment, composite_paths):
+        """ Records that a segment has been completely output, and saves the checkpoint.
+            :param segment: The Segment, once all its composites have been saved.
+            :param time_increment: The Clip's time_increment, which must be the same if resumed.
+            :param composite_paths: A list of the fully qualified paths of every composite saved for the segment.
+        """
+        self.time_increment = time_increment
+        self._segments.append({'index': segment.index,
+                               'start_time': segment.start_time,
+                               'end_time': segment.end_time,
+                               'trigger_zones': segment.trigger_zones,
+                               'composites': composite_paths})
+        checkpoint = {'signature': self._signature(),
+                      'time_increment': self.time_increment,
+                      'segments': self._segments,
+                      'timestamp': kd_timers.timestamp()}
+        # Write to a temporary file and then rename, so a crash part way through never leaves a corrupt checkpoint
+        temp_fullpath = '%s.tmp' % self._fullpath
+        with open(temp_fullpath, 'w') as checkpoint_handle:
+            json.dump(checkpoint, checkpoint_handle)
+        os.replace(temp_fullpath, self._fullpath)
+
+    def remove(self):
+        """ Removes the checkpoint, once the clip is complete (or if it is not to be resumed). """
+        for fullpath in [self._fullpath, '%s.tmp' % self._fullpath]:
+            if os.path.isfile(fullpath):
+                os.remove(fullpath)
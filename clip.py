@@ -1,11 +1,20 @@
 import cv2
 import numpy
+import concurrent.futures
 import random
 import subprocess
+from time import monotonic
+from datetime import datetime
 import kd_diskmemory
+import file_handling
 import kd_timers
 from frame import Frame
+from frame_cache import FrameCache
+from parallel_decode import ParallelDecoder
 from kd_app_thread import AppThread
+from subject_table import SubjectTable
+from thread_budget import ThreadBudget
+from track import Tracker
 
 
 class Clip:
@@ -27,7 +36,15 @@ class Clip:
     _annotate_line_colour = None
     _required_for = []
     _mp4box_path = None
-    _video_fullpath_fixed = None
+    _fixed_folder = None
+    _frame_cache = False
+    _frame_cache_greyblur = False
+    _greyscale_night = False
+    _parallel_decode_workers = 0
+    _parallel_decode_chunk_secs = 10
+    # Frame rate assumed for streams which don't report one (or report an implausible one)
+    _stream_default_fps = 25
+    _stream_max_fps = 120
 
     # findContours returns (image, contours, hierarchy) in OpenCV 3, but (contours, hierarchy) in OpenCV 2 and OpenCV 4
     _contours_return_index = 1 if cv2.__version__.startswith('3.') else 0
@@ -36,30 +53,51 @@ class Clip:
     # ##### SETUP METHODS
     #
     @staticmethod
-    def setup(time_increment, annotate_line_colour, mp4box_path=False, video_fullpath_fixed=None):
+    def setup(time_increment, annotate_line_colour, mp4box_path=False, fixed_folder=None,
+              frame_cache=False, frame_cache_greyblur=False, greyscale_night=False, parallel_decode_workers=0,
+              parallel_decode_chunk_secs=10):
         """ Clip.setup() must be called prior to creating a Clip instance.
             Typically this would be at the top of the main file.  Clip.setup() in turn calls
             Frame.setup_time_increment to pass on that parameter - just to save passing multiple times elsewhere.
             :param time_increment: This is the time, in milliseconds, between subsequent frames.
             :param annotate_line_colour: A tuple in BGR format i.e. (b, g, r), with each value 0-255, for annotations
+            :param mp4box_path: Path to the MP4Box executable, used to repair videos which can't be opened - or False.
+            :param fixed_folder: Folder for temporary repaired videos - if None, uses tmpfs or the system temp folder.
+            :param frame_cache: Boolean; if true, decoded frames are cached next to the video (see FrameCache), and
+                                any valid cache is used instead of decoding the video.
+            :param frame_cache_greyblur: Boolean; if true, the cache also holds 'greyblur' images for each frame.
+            :param greyscale_night: Boolean; if true, night-time clips are processed as single-channel greyscale.
+            :param parallel_decode_workers: If more than 1, each video is decoded by this many worker processes at once
+                                            (see ParallelDecoder), rather than sequentially by the FrameGetter alone.
+            :param parallel_decode_chunk_secs: Length of video, in seconds, decoded by each worker at a time.
         """
         Clip._is_setup = True
         Clip._time_increment_default = time_increment
         Clip._annotate_line_colour = annotate_line_colour
         Clip._mp4box_path = mp4box_path
-        Clip._video_fullpath_fixed = video_fullpath_fixed
+        Clip._fixed_folder = fixed_folder
+        Clip._frame_cache = frame_cache
+        Clip._frame_cache_greyblur = frame_cache_greyblur
+        Clip._greyscale_night = greyscale_night
+        Clip._parallel_decode_workers = parallel_decode_workers
+        Clip._parallel_decode_chunk_secs = parallel_decode_chunk_secs
         # Pass on the time_increment, for neater code / to make it more readily available within multiple Frame methods
         Frame.setup_time_increment(time_increment)
 
     #
     # ##### INIT METHODS
     #
-    def __init__(self, video_fullpath, base_frame_time, frames_required_for, time_increment=-1):
+    def __init__(self, video_fullpath, base_frame_time, frames_required_for, time_increment=-1, stream=False,
+                 stream_realtime=False):
         """ Create a new instance of a Clip.  Should be passed a fully-qualified path to the video file, and the time
             in milliseconds at which the base_frame should be set (usually 0).
             :param video_fullpath: A fully qualified path to a video file (which can be loaded by cv2.VideoCapture).
             :param base_frame_time: The time at which to take the first (base) frame, in milliseconds.
             :param time_increment: TODO: Documentation!
+            :param stream: Boolean; if true, video_fullpath is a live stream (e.g. an RTSP / HTTP URL, or a growing
+                           file or pipe) of unknown length, which is processed until it ends - see _init_stream_capture
+            :param stream_realtime: Boolean; if true, a stream is read no faster than real-time - so that replaying a
+                                    video file behaves like a live stream, e.g. for testing.
         """
 
         # Check here that Clip class properties are set
@@ -74,6 +112,8 @@ class Clip:
         self.composites = []
         self.segments = []
         self.num_segments = 0
+        # Index of the first segment to be processed - greater than 0 only if resuming (see restore_segments)
+        self.first_segment_index = 0
         # self.active_segments = 0
         self.created_all_segments = False
 
@@ -85,17 +125,104 @@ class Clip:
         # Re-set the Frame time_increment, to ensure it matches that for the Clip
         Frame.setup_time_increment(self.time_increment)
 
-        # Load the video stream, and get the first frame - saved to both frames[base_frame_time] and base_frame, for
-        #  more convenient accessibility
-        self._video_capture = cv2.VideoCapture(video_fullpath)
-        if not self._video_capture.isOpened():
-            # If video fails to open at the first try, and if mp4box is available, try re-saving the video to new file
-            #  then try VideoCapture again
-            if Clip._mp4box_path and Clip._video_fullpath_fixed:
-                subprocess.run([Clip._mp4box_path, '-add', video_fullpath, '-new', Clip._video_fullpath_fixed])
-                self._video_capture = cv2.VideoCapture(Clip._video_fullpath_fixed)
+        # If using a frame cache and a valid one already exists, then load frames from that and skip the decoder.
+        #  Streams are never cached, as they can't be re-processed.
+        self._frame_cache = None
+        self._parallel_decoder = None
+        self._video_capture = None
+        self._video_fullpath_fixed = None
+        self.is_stream = stream
+        if Clip._frame_cache and not stream:
+            self._frame_cache = FrameCache(video_fullpath, self.time_increment, inc_greyblur=Clip._frame_cache_greyblur,
+                                           greyscale_night=Clip._greyscale_night)
+            if self._frame_cache.is_valid():
+                self._frame_cache.open_for_read()
+        if stream:
+            self._init_stream_capture(video_fullpath, base_frame_time, frames_required_for, stream_realtime)
+        elif self._frame_cache is not None and self._frame_cache.is_reading:
+            self._frames_per_second = self._frame_cache.frames_per_second
+            self._frame_count = self._frame_cache.frame_count
+            self.video_duration_secs = self._frame_count / self._frames_per_second
+            self.frames[base_frame_time] = self._frame_cache.get_frame(base_frame_time, frames_required_for)
+        else:
+            self._init_video_capture(video_fullpath, base_frame_time, frames_required_for)
+        self.base_frame = self.frames[base_frame_time]
+        # Create an empty _retain_mask.  Note that this mask is used to exclude areas of the
+        #  frame from processing, but masks are used such that non-zero values mark the areas we want to keep, i.e.
+        #  anything non-zero will be retained.  The default therefore is that the entire frame is 255 values by
+        #  default, and any areas to exclude will be added by setting those values to zero.
+        #  A variety of methods within Clip are used to modify this mask, i.e. to mark areas to exclude.
+        # retain_mask_contours stores an array of contours, reflecting everything added to the mask
+        self._retain_mask = numpy.ones(self.base_frame.dimensions_numpy.large, numpy.uint8) * 255
+        self.retain_mask_contours = []
+
+        # Keep track of clip-level properties for easy access
+        self._is_night = None
+
+        # Night-time clips are greyscale, but encoded as BGR - so if enabled, store every frame as single-channel from
+        #  here onwards, saving memory and processing.  The base frame is already decoded, so convert that in-place.
+        #  Not used for streams, which may run from day into night or vice-versa.
+        self.is_greyscale = False
+        if Clip._greyscale_night and not self.is_stream and self.is_night():
+            self.base_frame.convert_to_greyscale()
+            self.is_greyscale = True
+
+        # Only now that we know the format of frames, if needed open the frame cache for writing - but not if resuming
+        #  part way through, as the cache would then be missing all the earlier frames
+        if self._frame_cache is not None and not self._frame_cache.is_reading and base_frame_time > 0:
+            self._frame_cache = None
+        if self._frame_cache is not None and not self._frame_cache.is_reading:
+            self._frame_cache.open_for_write(self._frame_count, self._frames_per_second,
+                                             self.base_frame.get_img('large').shape)
+            self._frame_cache.add_frame(self.base_frame)
+
+        # If enabled, decode the rest of the video in parallel - only when actually decoding, and not for streams
+        if (Clip._parallel_decode_workers > 1 and self._video_capture is not None and not self.is_stream
+                and (self._frame_cache is None or not self._frame_cache.is_reading)):
+            self._parallel_decoder = ParallelDecoder(self._video_fullpath_fixed or video_fullpath,
+                                                     start_time=base_frame_time + self.time_increment,
+                                                     end_time=self.video_duration_secs * 1000,
+                                                     time_increment=self.time_increment,
+                                                     large_shape=self.base_frame.get_img('large').shape,
+                                                     greyscale=self.is_greyscale,
+                                                     num_workers=Clip._parallel_decode_workers,
+                                                     chunk_secs=Clip._parallel_decode_chunk_secs,
+                                                     temp_folder=Clip._fixed_folder)
+
+        # Thread placeholders
+        self.threads = {}
+
+        # Optionally, an AuditArchive into which any captured audit data is saved (see Frame.setup_audit)
+        self.audit_archive = None
+
+        # Links subjects across consecutive frames into Tracks, which are then stored against each Segment
+        self.tracker = Tracker(self.time_increment)
+        # Details of every subject found since the start of the current segment - passed to the Segment once complete
+        self._subject_table = SubjectTable()
+
+    def _init_video_capture(self, video_fullpath, base_frame_time, frames_required_for):
+        """ PRIVATE: Opens the video for decoding, and gets the first frame - saved to frames[base_frame_time].
+            :param video_fullpath: A fully qualified path to a video file (which can be loaded by cv2.VideoCapture).
+            :param base_frame_time: The time at which to take the first (base) frame, in milliseconds.
+            :param frames_required_for: A list of requirements, passed on to the base frame.
+        """
+        # Check the structure of the video first, which is far cheaper than trying (and failing) to open it
+        video_probe = file_handling.probe_mp4(video_fullpath)
+        if video_probe == 'unrecoverable':
+            print('DEBUG: Unrecoverable')
+            raise EOFError
+        if video_probe == 'ok' or not Clip._mp4box_path:
+            self._video_capture = Clip._open_video_capture(video_fullpath)
+        if self._video_capture is None or not self._video_capture.isOpened():
+            # If video fails the probe or fails to open, and if mp4box is available, try re-saving the video to a new
+            #  temporary file (unique to this clip) then try VideoCapture again
+            if Clip._mp4box_path:
+                self._video_fullpath_fixed = file_handling.get_fixed_video_fullpath(Clip._fixed_folder)
+                subprocess.run([Clip._mp4box_path, '-add', video_fullpath, '-new', self._video_fullpath_fixed])
+                self._video_capture = Clip._open_video_capture(self._video_fullpath_fixed)
                 if not self._video_capture.isOpened():
                     print('DEBUG: NotOpened After Fixed')
+                    self.remove_fixed_video()
                     raise EOFError
             else:
                 # Handle any error opening the video as EOF, as that is handled as all errors and will skip this clip.
@@ -106,27 +233,107 @@ class Clip:
 
         if self._frame_count == 0:
             print('DEBUG: ZeroFrameCount')
+            self.remove_fixed_video()
             raise EOFError
 
         self.video_duration_secs = self._frame_count / self._frames_per_second
         self.frames[base_frame_time] = Frame.init_from_video_sequential(self._video_capture, base_frame_time,
                                                                         frames_required_for)
-        self.base_frame = self.frames[base_frame_time]
-        # Create an empty _retain_mask.  Note that this mask is used to exclude areas of the
-        #  frame from processing, but masks are used such that non-zero values mark the areas we want to keep, i.e.
-        #  anything non-zero will be retained.  The default therefore is that the entire frame is 255 values by
-        #  default, and any areas to exclude will be added by setting those values to zero.
-        #  A variety of methods within Clip are used to modify this mask, i.e. to mark areas to exclude.
-        # retain_mask_contours stores an array of contours, reflecting everything added to the mask
-        self._retain_mask = numpy.ones(self.base_frame.dimensions_numpy.large, numpy.uint8) * 255
-        self.retain_mask_contours = []
 
-        # Keep track of clip-level properties for easy access
-        self._is_night = None
-
-        # Thread placeholders
-        self.threads = {}
+    def _init_stream_capture(self, stream_url, base_frame_time, frames_required_for, realtime):
+        """ PRIVATE: Opens a live stream for decoding, and gets the first frame - saved to frames[base_frame_time].
+            A stream has no known length, so video_duration_secs is None, and frames are read until the stream ends.
+            Timestamps from live streams are often unreliable (or reset on reconnect), so frame times are instead
+            calculated from the number of frames read and the frame rate.
+            :param stream_url: Anything which can be opened by cv2.VideoCapture, e.g. an RTSP / HTTP URL, a pipe, or
+                               (for testing) a video file.
+            :param base_frame_time: The time at which to take the first (base) frame, in milliseconds.
+            :param frames_required_for: A list of requirements, passed on to the base frame.
+            :param realtime: Boolean; if true, frames are read no faster than real-time.
+        """
+        self.stream_url = stream_url
+        self._video_capture = Clip._open_video_capture(stream_url)
+        if not self._video_capture.isOpened():
+            raise EOFError
+        self._frames_per_second = self._video_capture.get(cv2.CAP_PROP_FPS)
+        if not 0 < self._frames_per_second <= Clip._stream_max_fps:
+            # Some streams don't report a frame rate, or report the timebase instead (e.g. 90000 for RTSP)
+            self._frames_per_second = Clip._stream_default_fps
+        self._frame_count = None
+        self.video_duration_secs = None
+        self.stream_start_datetime = datetime.now()
+        self._stream_start_monotonic = monotonic()
+        self._stream_realtime = realtime
+        self._stream_frames_grabbed = 0
+        self.frames[base_frame_time] = self._get_stream_frame(base_frame_time, frames_required_for)
+
+    def _get_stream_frame(self, time, frames_required_for):
+        """ PRIVATE: Reads from the stream up to the first frame at or after the specified time, and returns it.
+            :return: Returns a new Frame object; raises EOFError if the stream has ended.
+        """
+        # The most recently grabbed frame is at (frames grabbed - 1) / fps - only decode once we reach the time needed
+        while (self._stream_frames_grabbed == 0
+               or (self._stream_frames_grabbed - 1) * 1000 / self._frames_per_second < time):
+            if self._stream_realtime:
+                delay_secs = (self._stream_start_monotonic + self._stream_frames_grabbed / self._frames_per_second
+                              - monotonic())
+                if delay_secs > 0:
+                    kd_timers.sleep(delay_secs)
+            if not self._video_capture.grab():
+                raise EOFError
+            self._stream_frames_grabbed += 1
+        return Frame.init_from_video_grabbed(self._video_capture, time, frames_required_for)
 
+    @staticmethod
+    def _open_video_capture(video_fullpath):
+        """ PRIVATE: Opens a cv2.VideoCapture, limiting the decoder to the decode thread budget (if set, and if
+            supported by this version of OpenCV) - otherwise the decoder may use a thread for every core.
+        """
+        decode_threads = ThreadBudget.get('decode')
+        if decode_threads is not None and hasattr(cv2, 'CAP_PROP_N_THREADS'):
+            return cv2.VideoCapture(video_fullpath, cv2.CAP_ANY, [cv2.CAP_PROP_N_THREADS, decode_threads])
+        return cv2.VideoCapture(video_fullpath)
+
+    def remove_fixed_video(self):
+        """ Removes the temporary repaired copy of the video, if one was created - the original is left untouched. """
+        if self._video_capture is not None:
+            self._video_capture.release()
+        file_handling.remove_fixed_video(self._video_fullpath_fixed)
+        self._video_fullpath_fixed = None
+
+    def restore_segments(self, segments):
+        """ When resuming a clip part way through, adds the segments which were already output before it stopped - these
+            have no requirements, so are not processed again, but are included in the clip's details once complete.
+            Must be called before any threads are started, with the Clip's base_frame_time as the last segment's end.
+            :param segments: A list of dicts, each with index, start_time, end_time and trigger_zones - in index order.
+        """
+        for segment_details in segments:
+            segment = Segment(segment_details['index'], segment_details['start_time'], segment_details['end_time'], [])
+            segment.trigger_zones = segment_details['trigger_zones']
+            self.segments.append(segment)
+        self.num_segments = len(self.segments)
+        self.first_segment_index = len(self.segments)
+
+    def get_frame(self, time, frames_required_for):
+        """ Gets a new Frame at the specified time - from the frame cache if valid, otherwise by decoding the video
+            (in parallel, if a ParallelDecoder is in use).
+            Frames must be requested in time order, and any decoded frames are also added to the frame cache if in use.
+            :param time: The time (in milliseconds) of the frame to get.
+            :param frames_required_for: A list of requirements, passed on to the new Frame.
+            :return: Returns a new Frame object; raises EOFError if the video ends prematurely.
+        """
+        if self.is_stream:
+            return self._get_stream_frame(time, frames_required_for)
+        if self._frame_cache is not None and self._frame_cache.is_reading:
+            return self._frame_cache.get_frame(time, frames_required_for, greyscale=self.is_greyscale)
+        if self._parallel_decoder is not None:
+            frame = self._parallel_decoder.get_frame(time, frames_required_for)
+        else:
+            frame = Frame.init_from_video_sequential(self._video_capture, time, frames_required_for,
+                                                     greyscale=self.is_greyscale)
+        if self._frame_cache is not None and self._frame_cache.is_writing:
+            self._frame_cache.add_frame(frame)
+        return frame
 
     def remove_redundant_frame(self, time, expired_requirement=None):
         """
@@ -144,6 +351,8 @@ class Clip:
         # print(self.frames[time].required_for)
         if not self.frames[time].is_required() and not time == self.base_frame.time:
             # print('   Redundant frame %d... deleted!' % time)
+            # Hand the frame's images back to the ImagePool before deleting, so they can be re-used by later frames
+            self.frames[time].release_imgs()
             del self.frames[time]
 
     def remove_redundant_frames_before(self, time, expired_requirement=None):
@@ -192,10 +401,24 @@ class Clip:
     class FrameGetter(AppThread):
 
         def threaded_function(self, clip, max_mem_usage_mb, required_for):
+            ThreadBudget.pin_current_thread('decode')
+            try:
+                self._get_frames(clip, max_mem_usage_mb, required_for)
+            finally:
+                # However this thread ends, stop any decode workers and remove their shared arrays
+                if clip._parallel_decoder is not None:
+                    clip._parallel_decoder.close()
+
+        def _get_frames(self, clip, max_mem_usage_mb, required_for):
+            """ PRIVATE: Gets every frame of the clip, until the end of the video or aborted. """
             time = clip.base_frame.time
-            while time <= clip.video_duration_secs * 1000:
+            # Streams have no known duration, so continue until the stream ends (EOFError) or is stopped
+            while clip.video_duration_secs is None or time <= clip.video_duration_secs * 1000:
 
                 if self.should_abort():
+                    # A partially written frame cache would be incomplete, so remove it rather than leave it behind
+                    if clip._frame_cache is not None and clip._frame_cache.is_writing:
+                        clip._frame_cache.remove()
                     return
 
                 if kd_diskmemory.memory_usage() > max_mem_usage_mb:
@@ -204,13 +427,16 @@ class Clip:
 
                 if time not in clip.frames:
                     try:
-                        clip.frames[time] = Frame.init_from_video_sequential(clip._video_capture, time, required_for)
+                        clip.frames[time] = clip.get_frame(time, required_for)
                     except EOFError:
                         # An alternative way to break out of the while loop, in case video ends prematurely
                         break
                 time += clip.time_increment
 
-            # If we get to the end, means we've got all frames - any errors use 'return' so won't get here
+            # If we get to the end, means we've got all frames - any errors use 'return' so won't get here.  Only at
+            #  this point can a frame cache be marked as complete, as it now holds every frame.
+            if clip._frame_cache is not None:
+                clip._frame_cache.close()
             clip.retrieved_all_frames = True
 
 
@@ -220,7 +446,8 @@ class Clip:
     class CreateSegments(AppThread):
 
         def threaded_function(self, clip, max_mem_usage_mb, required_for, frames_required_for):
-            segment_start_time = 0
+            ThreadBudget.pin_current_thread('detect')
+            segment_start_time = clip.base_frame.time
             mem_low = False
 
             # Outer while loop ensures we get all segments
@@ -262,7 +489,9 @@ class Clip:
 
                     if frame1_time in clip.frames and frame2_time in clip.frames:
                         clip.frames[frame2_time].get_subjects_and_activity(clip.base_frame, clip.frames[frame1_time],
-                                                                           clip._retain_mask)
+                                                                           clip._retain_mask, clip.audit_archive)
+                        clip.tracker.update(frame2_time, clip.frames[frame2_time].subjects)
+                        clip._subject_table.add_frame(frame2_time, clip.frames[frame2_time].subjects)
                         if clip.frames[frame2_time].num_subjects() == 0:
                             if frame1_time == clip.base_frame.time:
                                 # If no subjects, and follows the base_frame, then make this the new base frame
@@ -287,9 +516,19 @@ class Clip:
                     return
 
                 # When we've got the frames for each segment, save the details as a finished segment
+                tracks = clip.tracker.close_segment()
+                subject_table = clip._subject_table
+                clip._subject_table = SubjectTable()
                 if segment_end_time > segment_start_time:
                     # print('Creating segment index %d' % clip.num_segments)
                     this_segment = Segment(clip.num_segments, segment_start_time, segment_end_time, required_for)
+                    # Only the representative subjects from each track are used within composites - see Track
+                    this_segment.tracks = tracks
+                    for track in this_segment.tracks:
+                        track.select_representatives()
+                    subject_table.restrict_to(segment_start_time, segment_end_time)
+                    subject_table.add_tracks(tracks)
+                    this_segment.subjects = subject_table
                     frames_in_segments.extend(range(segment_start_time, segment_end_time, clip.time_increment))
                     clip.segments.append(this_segment)
                     clip.num_segments += 1
@@ -321,61 +560,81 @@ class Clip:
     #
     class CreateComposites(AppThread):
 
-        def threaded_function(self, clip):
-            segment_index = 0
+        # Order of composites within each segment, regardless of which finished rendering first
+        _style_order = {'Complete': 0, 'Primary': 1, 'Fallback': 2}
+
+        def threaded_function(self, clip, max_workers=1):
+            """ Renders composites for up to max_workers segments at a time, using a pool of worker threads.
+                Each segment is a single task, rendering its Complete, Primary and then Fallback composites in turn -
+                as they all read (and Primary / Fallback update) the segment's SubjectTable and composites, so must not
+                run concurrently with each other.  Segments are always finished in index order, so the COMPOSITE
+                requirement is released deterministically.
+                Rendering only reads frames' 'large' images, which already exist from finding subjects.
+            """
+            ThreadBudget.pin_current_thread('composite')
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+            in_progress = {}        # Keyed by segment index, with value a tuple (segment, future)
+            submit_index = clip.first_segment_index
+            finish_index = clip.first_segment_index
             while True:
 
                 if self.should_abort():
+                    # Cancel anything not yet started, then wait for any segment already rendering to finish
+                    for _, future in in_progress.values():
+                        future.cancel()
+                    executor.shutdown(wait=True)
                     return
 
-                segment = None
-                for seg in clip.segments:
-                    if seg.index == segment_index:
-                        segment = seg
-                        break
-
-                if segment is not None:
-                # for segment in [seg for seg in clip.segments if seg.index == segment_index]:
-
-                    # print('Creating Composites for segment %d (starting %d)' % (segment.index, segment.start_time))
-
-                    # Generate a single composite encompassing all activity, overlapping subjects if necessary
-                    clip.get_complete_composite(segment=segment,
-                                                style='Complete')
-
-                    # Generate a primary composite, which includes the largest subject nearest the centre of the frame,
-                    # plus any other non-overlapping subjects which fit
-                    center_frame = [pt / 2 for pt in clip.base_frame.dimensions.large]
-                    clip.get_composite_primary(segment=segment,
-                                               target_point=center_frame,
-                                               min_fraction_of_max_area=0.75,
-                                               inc_fallback=True)
+                # Check created_all_segments first, so a segment created immediately after can't be missed
+                created_all_segments = clip.created_all_segments
+                segment_exists, segment = Segment.segment_with_index(clip.segments, submit_index)
+
+                # Submit the next segment, limiting how many are in progress as each holds its frames in memory - and
+                #  fewer if the composite thread budget is currently throttled
+                if segment_exists and len(in_progress) < min(max_workers, ThreadBudget.get('composite') or max_workers):
+                    in_progress[submit_index] = (segment, executor.submit(self._render_segment,
+                                                                          clip=clip,
+                                                                          segment=segment))
+                    submit_index += 1
+                    continue
 
-                    # Generate non-overlapping composites covering all remaining subjects
-                    while True:
-                        try:
-                            clip.get_composite_fallback(segment=segment)
-                        except EOFError:
-                            break
+                # Finish segments strictly in index order, even if a later one completed first
+                if finish_index in in_progress and in_progress[finish_index][1].done():
+                    segment, future = in_progress.pop(finish_index)
+                    # Re-raises any exception from within the worker thread
+                    future.result()
+                    segment.composites.sort(key=lambda composite: self._style_order[composite['style']])
 
                     # Remove required_for flag on frames so far
                     clip.remove_redundant_frames_before(segment.end_time, 'COMPOSITE')
-                    # clip.remove_redundant_frame(segment.end_time, 'COMPOSITE')              # MOVED FROM BELOW...
                     segment.remove_requirement('COMPOSITE')
-                    # print('Removed Seg %d requirement for COMPOSITE' % segment.index)
+                    finish_index += 1
+                    continue
 
-                    # if segment.last_segment:
-                    #     print('Composite - reached last segment, about to break!')
-                    #     clip.remove_redundant_frame(segment.end_time, 'COMPOSITE')
-                    #     # break
-                    # else:
-                    segment_index += 1
+                if created_all_segments and not segment_exists and not in_progress:
+                    break
+                kd_timers.sleep(secs=0.05)
 
-                else:
-                    if clip.created_all_segments:
-                        # clip.remove_redundant_frames_before(max(list(clip.frames)) + 1, 'COMPOSITE')
-                        break
-                    kd_timers.sleep(secs=0.05)
+            executor.shutdown(wait=True)
+
+        @staticmethod
+        def _render_segment(clip, segment):
+            """ PRIVATE: Creates the Complete, Primary and then Fallback composites for a segment - run as a single task
+                because Fallback composites only include subjects not already used by the Primary composite.
+            """
+            # The Complete composite includes every subject, regardless of whether used elsewhere
+            clip.get_complete_composite(segment=segment, style='Complete')
+
+            # Generate a primary composite, which includes the largest subject nearest the centre of the frame,
+            # plus any other non-overlapping subjects which fit
+            center_frame = [pt / 2 for pt in clip.base_frame.dimensions.large]
+            clip.get_composite_primary(segment=segment,
+                                       target_point=center_frame,
+                                       min_fraction_of_max_area=0.75,
+                                       inc_fallback=True)
+
+            # Generate non-overlapping composites covering all remaining subjects
+            clip.get_composite_layers(segment=segment)
 
 
     #
@@ -389,8 +648,12 @@ class Clip:
             :return: Returns boolean true if it is a night-time image.
         """
         if self._is_night is None:
-            # Test the original source image
-            test_img = self.base_frame.get_img('source')
+            # Test the large image - resizing preserves greyscale, and unlike source it is available from a frame cache
+            test_img = self.base_frame.get_img('large')
+            if test_img.ndim == 2:
+                # Already stored as single-channel greyscale, e.g. when loaded from a frame cache
+                self._is_night = True
+                return self._is_night
             for _ in range(25):
                 x = random.randint(0, test_img.shape[1] - 1)
                 y = random.randint(0, test_img.shape[0] - 1)
@@ -491,14 +754,15 @@ class Clip:
         # TODO:  aren't tracked, aren't already used, etc...
         # TODO: Update docs for segment!
 
-        composite = self.base_frame.get_img('large')
+        # Composites are modified in-place, so take a copy of the base_frame image rather than over-write it
+        composite = self.base_frame.get_img('large').copy()
         composite_mask = numpy.zeros(self.base_frame.dimensions_numpy.large, numpy.uint8)
         try:
-            frame, subject = self._get_primary_subject(target_point, min_fraction_of_max_area)
+            row = segment.subjects.primary_row(target_point, min_fraction_of_max_area)
         except EOFError:
             return False
-        composite_added, composite, composite_mask = self._add_to_composite(frame=frame,
-                                                                            subject=subject,
+        composite_added, composite, composite_mask = self._add_to_composite(segment=segment,
+                                                                            row=row,
                                                                             composite=composite,
                                                                             composite_mask=composite_mask,
                                                                             allow_overlap=False,
@@ -530,8 +794,8 @@ class Clip:
             are not already used elsewhere, or captured within a track.  Optionally, an existing composite and
             composite_mask can be provided, which this will use as its basis (but still avoid any overlap).
             Optionally, this can avoid placing any subjects which would overlap with another - if not allowing overlap,
-            then this method should be called repeatedly until it returns an EOFError exception, i.e. there are no more
-            subjects to handle.
+            then this method could be called repeatedly until it returns an EOFError exception, i.e. there are no more
+            subjects to handle; although get_composite_layers will produce the same composites in a single pass.
             :param composite: Optionally, an existing composite
             :param composite_mask: An existing composite_mask, covering all subjects in the composite to be preserved
             :param interim: Flag that this is contributing to a different style of composite, so don't save output.
@@ -545,27 +809,22 @@ class Clip:
             # If we've supplied both a composite and composite_mask, then use those and therefore already have composite
             composite_any_added = True
         else:
-            # Otherwise, create blank composite and composite_mask
-            composite = self.base_frame.get_img('large')
+            # Otherwise, create blank composite and composite_mask - composites are modified in-place, so take a copy
+            composite = self.base_frame.get_img('large').copy()
             composite_mask = numpy.zeros(self.base_frame.dimensions_numpy.large, numpy.uint8)
             composite_any_added = False
 
-        # Look through all frames and subjects for valid subjects, and try adding to the composite
-        # for frame in self.frames.values():
-        # UPDATE: Changed to using times to avoid errors if frames is modified by another thread whilst iterating
-        for frame_time in range(segment.start_time + self.time_increment, segment.end_time, self.time_increment):
-            frame = self.frames[frame_time]
-            for subject in frame.subjects:
-                if not subject.is_tracked and (not subject.is_used or skip_is_used) and subject.is_active:
-                    # Note that _add_to_composite only TRIES to add this subject - however it will not do so if it
-                    #  would overlap with a previous subject, and in that case just returns the input values
-                    composite_added, composite, composite_mask = self._add_to_composite(frame=frame,
-                                                                                        subject=subject,
-                                                                                        composite=composite,
-                                                                                        composite_mask=composite_mask,
-                                                                                        allow_overlap=allow_overlap,
-                                                                                        skip_is_used=skip_is_used)
-                    composite_any_added = composite_any_added or composite_added
+        # Look through the segment's valid subjects (active, untracked, maybe unused), and try adding to the composite
+        for row in segment.subjects.available_rows(skip_is_used=skip_is_used):
+            # Note that _add_to_composite only TRIES to add this subject - however it will not do so if it
+            #  would overlap with a previous subject, and in that case just returns the input values
+            composite_added, composite, composite_mask = self._add_to_composite(segment=segment,
+                                                                                row=row,
+                                                                                composite=composite,
+                                                                                composite_mask=composite_mask,
+                                                                                allow_overlap=allow_overlap,
+                                                                                skip_is_used=skip_is_used)
+            composite_any_added = composite_any_added or composite_added
         if not composite_any_added:
             # Use EOFError Exception to highlight that there are no valid subjects remaining
             raise EOFError
@@ -573,81 +832,100 @@ class Clip:
             segment.composites.append({'style': style, 'composite': composite, 'mask': composite_mask})
         return composite, composite_mask
 
-    def _add_to_composite(self, frame, subject, composite, composite_mask, allow_overlap, skip_is_used):
+    def get_composite_layers(self, segment, style='Fallback'):
+        """ Creates a set of non-overlapping composites, covering every active subject not already used elsewhere.
+            Subjects are assigned to layers in a single pass - each goes into the first layer in which it doesn't
+            overlap any subject already there, or else starts a new layer - and then each layer is rendered as one
+            composite.
+            This gives the same composites as calling get_composite_fallback until it raises EOFError, but without
+            re-scanning every subject and re-testing against a full-frame mask for each composite.
+            :param style: Optionally specify an alternative style label to describe the type of composite.
+            :return: Returns the number of composites created, which are saved within segment.composites
+        """
+        layers = []
+        for row in segment.subjects.available_rows():
+            subject = segment.subjects.get_subject(row)
+            for layer in layers:
+                if not any(self._subjects_overlap(subject, segment.subjects.get_subject(other_row))
+                           for other_row in layer):
+                    layer.append(row)
+                    break
+            else:
+                layers.append([row])
+
+        for layer in layers:
+            composite = self.base_frame.get_img('large').copy()
+            composite_mask = numpy.zeros(self.base_frame.dimensions_numpy.large, numpy.uint8)
+            for row in layer:
+                # Overlap has already been ruled out when packing the layer, so no need to test it again here
+                self._add_to_composite(segment=segment,
+                                       row=row,
+                                       composite=composite,
+                                       composite_mask=composite_mask,
+                                       allow_overlap=True,
+                                       skip_is_used=False)
+            segment.composites.append({'style': style, 'composite': composite, 'mask': composite_mask})
+        return len(layers)
+
+    @staticmethod
+    def _subjects_overlap(subject1, subject2):
+        """ PRIVATE: Tests whether the dilated masks of two subjects overlap, by even a single pixel.
+            Only the area where their dilated bounds intersect is compared, so most pairs are ruled out immediately.
+        """
+        params1 = subject1.dilated_params
+        params2 = subject2.dilated_params
+        y1, y2 = max(params1[0], params2[0]), min(params1[1], params2[1])
+        x1, x2 = max(params1[2], params2[2]), min(params1[3], params2[3])
+        if y1 >= y2 or x1 >= x2:
+            return False
+        mask1 = subject1.dilated_mask[y1 - params1[0]: y2 - params1[0], x1 - params1[2]: x2 - params1[2]]
+        mask2 = subject2.dilated_mask[y1 - params2[0]: y2 - params2[0], x1 - params2[2]: x2 - params2[2]]
+        return bool(numpy.logical_and(mask1, mask2).any())
+
+    def _add_to_composite(self, segment, row, composite, composite_mask, allow_overlap, skip_is_used):
         """ PRIVATE: Checks validity / overlap before then adding a subject to a composite, and updating its mask.
-            :param frame: A valid frame object, containing the subject to add.
-            :param subject: A valid subject object, which is the subject to add.
+            The composite and composite_mask are updated in-place, and only within the area around the subject.
+            :param segment: The segment containing the subject to add.
+            :param row: The row number of the subject to add, within the segment's SubjectTable.
             :param composite: The existing composite, to which the subject will be added.
             :param composite_mask: A mask covering all subjects so-far added to the composite, to prevent overlap.
             :param allow_overlap: Boolean, allow subjects to overlap?
             :param skip_is_used: Optionally, ignore is_used flags, and also don't set is_used flag here
             :return: Returns a tuple (True/False is_added, composite, composite_mask)
         """
-        subject_mask = subject.get_subject_mask(dilated=True, crop=False)
+        subject = segment.subjects.get_subject(row)
+        frame = self.frames[int(segment.subjects.rows['time'][row])]
+        y1, y2, x1, x2 = subject.dilated_params
+        subject_mask = subject.dilated_mask
         # Check for overlap with previously added subjects, if necessary
         if not allow_overlap:
-            overlap_with_added = numpy.bitwise_and(composite_mask, subject_mask)
+            overlap_with_added = cv2.bitwise_and(composite_mask[y1: y2, x1: x2], subject_mask)
             # This takes a very strict approach to checking for overlap, with zero pixels allowed
-            if numpy.count_nonzero(overlap_with_added) > 0:
+            if cv2.countNonZero(overlap_with_added) > 0:
                 # If there would be overlap, return False with the original unmodified composite / composite_mask
                 return False, composite, composite_mask
         # Otherwise, mark the subject as used to prevent re-use later, and add the subject to the composite
         if not skip_is_used:
-            subject.is_used = True
-        composite = self._overlay_imgs(composite, frame.get_img('large'), subject_mask)
-        composite_mask = numpy.bitwise_or(composite_mask, subject_mask)
+            segment.subjects.mark_used(row)
+        self._overlay_imgs(composite[y1: y2, x1: x2], frame.get_img('large')[y1: y2, x1: x2], subject_mask)
+        composite_mask[y1: y2, x1: x2] = cv2.bitwise_or(composite_mask[y1: y2, x1: x2], subject_mask)
         return True, composite, composite_mask
 
     @staticmethod
     def _overlay_imgs(base_img, subject_img, subject_mask):
-        """ PRIVATE: Overlays a subject, with a specified mask, onto another (typically composite) image
-            :param base_img: A colour image onto which we want to copy the subject
-            :param subject_img: A colour image which contains the subject; should be the same size as the base_img
+        """ PRIVATE: Overlays a subject, with a specified mask, onto another (typically composite) image, in-place
+            :param base_img: A colour (or greyscale) image onto which we want to copy the subject - will be modified
+            :param subject_img: An image which contains the subject; should be the same size and type as the base_img
             :param subject_mask: A greyscale mask in which the subject is white (255) on a black (0) background
-            :return: Returns an updated copy of the base_img, with the subject now overlaid
+            :return: Returns the base_img, with the subject now overlaid
         """
-        # The _retain_mask (used for the base_img background) is the inverse of the subject_mask, such that when they
-        #  are combined via bitwise_or then each pixel will be non-zero for only one of the two sources.
-        retain_mask = numpy.invert(subject_mask)
-        base_retain = numpy.bitwise_and(base_img,
-                                        cv2.cvtColor(retain_mask, cv2.COLOR_GRAY2BGR))
-        subject_add = numpy.bitwise_and(subject_img,
-                                        cv2.cvtColor(subject_mask, cv2.COLOR_GRAY2BGR))
-        base_img = numpy.bitwise_or(base_retain, subject_add)
+        subject_pixels = subject_mask > 0
+        if base_img.ndim == 3:
+            # Colour images need the mask to cover each of the B, G and R channels
+            subject_pixels = subject_pixels[:, :, numpy.newaxis]
+        numpy.copyto(base_img, subject_img, where=subject_pixels)
         return base_img
 
-    #
-    # ##### SEARCH FOR SUBJECTS
-    #
-    def _get_primary_subject(self, target_point, min_fraction_of_max_area):
-        """ Searches all frames and subjects to find the nearest subject to the target_point, meeting minimum size.
-            The primary subject is typically the nearest large subject to the target_point.
-            :param target_point: An (x, y) tuple specifying the target point where we want the subject to be closest to.
-            :param min_fraction_of_max_area: Proportion of the largest subject in the clip, as a minimum size for the
-                                             closest subject to target_point.  A very small value will effectively
-                                             disregard the size.  A value of 1 will effectively disregard target_point.
-                                             This should be in the range 0-1.
-            :return: Returns a tuple containing (frame, subject) for the primary subject
-        """
-
-        # Loop through all frames and subjects, and add a range of parameters to an array - ready for processing
-        subject_params = []
-        for frame in self.frames.values():
-            for subject in frame.subjects:
-                if not subject.is_tracked and not subject.is_used and subject.is_active:
-                    subject_params.append({'area': subject.contour_area,
-                                           'distance': subject.dist_from_point(target_point),
-                                           'subject': subject,
-                                           'frame': frame})
-        # Filter the list of subjects to only include those at least specified fraction of the max sized subject
-        if len(subject_params) == 0:
-            raise EOFError
-        min_area = max(s_param['area'] for s_param in subject_params) * min_fraction_of_max_area
-        subject_params = [s_param for s_param in subject_params if s_param['area'] >= min_area]
-        # Of the remaining, get the subject with the smallest distance from the target_point
-        primary_subject_param = min(subject_params, key=lambda s_param: s_param['distance'])
-        return primary_subject_param['frame'], primary_subject_param['subject']
-
     #
 
     #
@@ -663,6 +941,8 @@ class Segment:
         self.required_for = required_for.copy()
         self.last_segment = False
         self.trigger_zones = []
+        self.tracks = []
+        self.subjects = SubjectTable()
         self.plugins_complete = False
 
     def remove_requirement(self, requirement):
@@ -0,0 +1,74 @@
+import os
+import json
+import hashlib
+import threading
+
+
+class ContentIndex:
+    """ The ContentIndex class remembers the results of every clip processed, keyed by a hash of the video's content
+        rather than its filename - so a clip which is re-uploaded under a new name, or moved back from video_error,
+        can re-use the earlier results rather than being decoded and processed again.
+
+        Hashing the whole of every video would itself be slow, so the hash only covers the file size plus the first and
+        last sample_mb of the file - any genuinely different clip will differ within these, as the start of an mp4
+        holds its index and timestamps.  Entries are appended to a file of JSON lines, which is read into memory once.
+        The content of each entry is up to the caller, e.g. the clip_data entry and paths of every output.
+        ContentIndex has no project-specific dependencies.
+    """
+
+    def __init__(self, index_fullpath, sample_mb=4):
+        """ Create a new ContentIndex.
+            :param index_fullpath: A fully qualified path to the index file - created if it doesn't already exist.
+            :param sample_mb: Size of the samples from the start and end of each video which are hashed, in MB.
+        """
+        self._index_fullpath = index_fullpath
+        self._sample_bytes = int(sample_mb * 1024 * 1024)
+        self._entries = None
+        self._lock = threading.Lock()
+
+    def content_hash(self, video_fullpath):
+        """ Returns a hash of the video's size and the start and end of its content, as a hex string. """
+        video_size = os.path.getsize(video_fullpath)
+        content_hash = hashlib.sha1(str(video_size).encode())
+        with open(video_fullpath, 'rb') as video_handle:
+            content_hash.update(video_handle.read(self._sample_bytes))
+            if video_size > self._sample_bytes:
+                video_handle.seek(max(video_size - self._sample_bytes, self._sample_bytes))
+                content_hash.update(video_handle.read())
+        return content_hash.hexdigest()
+
+    def _load(self):
+        """ PRIVATE: Reads every entry from the index file, the first time the index is used. """
+        self._entries = {}
+        try:
+            with open(self._index_fullpath, 'r') as index_handle:
+                for line in index_handle:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Ignore a partially written final line, e.g. if the application stopped while writing
+                        continue
+                    self._entries[entry['hash']] = entry
+        except FileNotFoundError:
+            pass
+
+    def get(self, content_hash):
+        """ Returns the entry for a previously processed video with the same content hash, or None if there isn't one.
+        """
+        with self._lock:
+            if self._entries is None:
+                self._load()
+            return self._entries.get(content_hash)
+
+    def add(self, content_hash, entry):
+        """ Records the results of processing a video - replacing any earlier entry with the same hash.
+            :param content_hash: The hash of the video, as from content_hash().
+            :param entry: A dict of anything needed to re-use the results, which must be JSON serialisable.
+        """
+        entry = dict(entry, hash=content_hash)
+        with self._lock:
+            if self._entries is None:
+                self._load()
+            self._entries[content_hash] = entry
+            with open(self._index_fullpath, 'a') as index_handle:
+                index_handle.write('%s\n' % json.dumps(entry))
@@ -0,0 +1,51 @@
+import time
+
+
+class IngestRateModel:
+    """ The IngestRateModel class estimates how quickly new data is being written to disk (videos uploaded and moved to
+        video_done, plus composites and debug images), so that space can be freed ahead of time - a little at a time
+        whilst the CPU is otherwise idle - rather than all at once when free space runs low, often mid-processing.
+
+        Rather than repeatedly walking every folder to total up file sizes, the rate is taken from the fall in free
+        space between checks, adding back anything freed by cleanup in the meantime (see record_freed).  This is then
+        smoothed as an exponential moving average, as uploads arrive in bursts.
+        IngestRateModel has no project-specific dependencies.
+    """
+
+    def __init__(self, smoothing=0.2, min_interval_secs=60):
+        """ Create a new IngestRateModel - it has no estimate until two updates at least min_interval_secs apart.
+            :param smoothing: Weight given to the most recent measurement in the moving average, between 0 and 1.
+            :param min_interval_secs: Minimum time between measurements, as over shorter periods it is mostly noise.
+        """
+        self.gb_per_hour = None
+        self._smoothing = smoothing
+        self._min_interval_secs = min_interval_secs
+        self._last_free_gb = None
+        self._last_time = None
+        self._freed_gb = 0
+
+    def update(self, free_gb):
+        """ Updates the estimate with the current free space - can be called as often as needed. """
+        now = time.monotonic()
+        if self._last_time is None:
+            self._last_free_gb, self._last_time = free_gb, now
+            return
+        elapsed_secs = now - self._last_time
+        if elapsed_secs < self._min_interval_secs:
+            return
+        written_gb = max(self._last_free_gb - free_gb + self._freed_gb, 0)
+        rate = written_gb / (elapsed_secs / 3600)
+        if self.gb_per_hour is None:
+            self.gb_per_hour = rate
+        else:
+            self.gb_per_hour = self._smoothing * rate + (1 - self._smoothing) * self.gb_per_hour
+        self._last_free_gb, self._last_time = free_gb, now
+        self._freed_gb = 0
+
+    def record_freed(self, freed_gb):
+        """ Records space freed by cleanup, so that it isn't mistaken for a drop in the rate of new data. """
+        self._freed_gb += freed_gb
+
+    def projected_free_gb(self, free_gb, hours):
+        """ Returns the free space expected after the specified number of hours, if nothing is cleaned up. """
+        return free_gb - (self.gb_per_hour or 0) * hours
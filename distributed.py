@@ -0,0 +1,210 @@
+import os
+import json
+import time
+import threading
+import kd_timers
+from kd_app_thread import AppThread
+
+
+class LeaseManager:
+    """ The LeaseManager class allows several KDCam nodes to share a single video_pending folder (e.g. over NFS), by
+        each node claiming a video before processing it, so that no two nodes process the same video.
+
+        A claim is a lease file, created atomically (O_CREAT | O_EXCL) so only one node can succeed.  While a node holds
+        a lease it regularly updates the file's modified time as a heartbeat - much like the safe_start lock file.  If
+        a node crashes, its leases stop being updated, and once older than expiry_secs any other node may reclaim them.
+        Reclaiming first renames the stale lease to a name unique to the reclaiming node, which is atomic, so only one
+        node can win even if several notice the stale lease at the same time.
+        LeaseManager has no project-specific dependencies.
+    """
+
+    def __init__(self, lease_folder, node_name, expiry_secs):
+        """ Create a new LeaseManager - one per node.
+            :param lease_folder: Folder shared between all nodes, in which lease files are created.
+            :param node_name: A name unique to this node, e.g. its hostname.
+            :param expiry_secs: Age after which a lease without a heartbeat is considered stale, and may be reclaimed.
+        """
+        self.lease_folder = lease_folder
+        self.node_name = node_name
+        self.expiry_secs = expiry_secs
+        self._held = {}     # Keyed by lease path, with the value being the unique token written into the lease
+        self._lock = threading.Lock()
+        os.makedirs(lease_folder, exist_ok=True)
+
+    def _lease_fullpath(self, video_relative_path):
+        """ PRIVATE: Returns the lease file path for a video - sub-folders are flattened into the filename. """
+        return os.path.join(self.lease_folder, '%s.lease' % video_relative_path.replace(os.sep, '__'))
+
+    def claim(self, video_relative_path):
+        """ Tries to claim a video for this node, reclaiming the lease if another node's lease on it has expired.
+            :param video_relative_path: The video's path relative to video_pending, as from get_pending_video_list.
+            :return: Returns True if this node now holds the lease, otherwise False.
+        """
+        lease_fullpath = self._lease_fullpath(video_relative_path)
+        if self._create_lease(lease_fullpath):
+            return True
+        try:
+            lease_age = time.time() - os.path.getmtime(lease_fullpath)
+        except OSError:
+            # Lease was released between trying to create it and checking its age, so just try again
+            return self._create_lease(lease_fullpath)
+        if lease_age < self.expiry_secs:
+            return False
+        stale_fullpath = '%s.stale-%s-%d' % (lease_fullpath, self.node_name, os.getpid())
+        try:
+            os.rename(lease_fullpath, stale_fullpath)
+        except OSError:
+            # Another node reclaimed it first
+            return False
+        if time.time() - os.path.getmtime(stale_fullpath) < self.expiry_secs:
+            # Another node reclaimed it and created a fresh lease just before the rename - so put that lease back
+            try:
+                os.link(stale_fullpath, lease_fullpath)
+            except OSError:
+                pass
+            os.remove(stale_fullpath)
+            return False
+        os.remove(stale_fullpath)
+        return self._create_lease(lease_fullpath)
+
+    def _create_lease(self, lease_fullpath):
+        """ PRIVATE: Atomically creates a lease file, failing if it already exists.
+            :return: Returns True if created, otherwise False.
+        """
+        try:
+            lease_fd = os.open(lease_fullpath, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        token = '%s-%d-%f' % (self.node_name, os.getpid(), time.time())
+        with os.fdopen(lease_fd, 'w') as lease_handle:
+            json.dump({'node': self.node_name, 'token': token, 'claimed': kd_timers.timestamp()}, lease_handle)
+        with self._lock:
+            self._held[lease_fullpath] = token
+        return True
+
+    @staticmethod
+    def _is_own_lease(lease_fullpath, token):
+        """ PRIVATE: Checks the lease file still holds this node's token, i.e. it hasn't been reclaimed by another. """
+        try:
+            with open(lease_fullpath, 'r') as lease_handle:
+                return json.load(lease_handle).get('token') == token
+        except (OSError, ValueError):
+            return False
+
+    def heartbeat(self):
+        """ Updates the modified time of every lease held by this node, so other nodes know they are still live. """
+        with self._lock:
+            held = list(self._held.items())
+        for lease_fullpath, token in held:
+            try:
+                if not self._is_own_lease(lease_fullpath, token):
+                    raise FileNotFoundError
+                os.utime(lease_fullpath)
+            except OSError:
+                # Lease has been lost, e.g. reclaimed after this node stalled for longer than expiry_secs
+                with self._lock:
+                    self._held.pop(lease_fullpath, None)
+
+    def release(self, video_relative_path):
+        """ Releases this node's lease on a video, once processing is complete (whether successful or not). """
+        lease_fullpath = self._lease_fullpath(video_relative_path)
+        with self._lock:
+            token = self._held.pop(lease_fullpath, None)
+        # Never remove a lease which another node has since reclaimed
+        if token is None or not self._is_own_lease(lease_fullpath, token):
+            return
+        try:
+            os.remove(lease_fullpath)
+        except OSError:
+            pass
+
+
+class SharedClipData:
+    """ The SharedClipData class merges clip_data entries from every node into one store, within a shared folder.
+
+        Each node only ever appends to its own file (clip_data-<node_name>.jsonl, one JSON entry per line), so no
+        locking is needed between nodes.  get_all() then reads every node's file, keeping only the latest entry for each
+        basename - e.g. if a clip was reclaimed and re-processed after a node crashed.
+        As the files are only ever appended to, the entries read so far are kept in memory along with how far through
+        each file has been read - so each call only reads lines added since the last, rather than every file in full.
+        SharedClipData has no project-specific dependencies.
+    """
+
+    def __init__(self, shared_folder, node_name):
+        self.shared_folder = shared_folder
+        self._node_fullpath = os.path.join(shared_folder, 'clip_data-%s.jsonl' % node_name)
+        self._lock = threading.Lock()
+        self._entries = {}      # Keyed by basename, with the value being the latest entry for that basename
+        self._read_to = {}      # Keyed by node filename, with the value being (offset read to, size, mtime)
+        os.makedirs(shared_folder, exist_ok=True)
+
+    def add(self, entry):
+        """ Appends a single clip_data entry to this node's file. """
+        with self._lock:
+            with open(self._node_fullpath, 'a') as data_handle:
+                data_handle.write('%s\n' % json.dumps(entry))
+
+    def get_all(self):
+        """ Returns a list of clip_data entries from all nodes, with only the latest entry for each basename. """
+        with self._lock:
+            self._read_new_entries()
+            return sorted(self._entries.values(), key=lambda entry: entry.get('timestamp', ''))
+
+    def contains(self, basename):
+        """ Checks whether any node has already recorded a clip_data entry for this basename. """
+        with self._lock:
+            self._read_new_entries()
+            return basename in self._entries
+
+    def _read_new_entries(self):
+        """ PRIVATE: Reads any lines added to each node's file since the last call.  If any file has shrunk or gone
+            (i.e. it wasn't just appended to), everything is re-read from the start.
+        """
+        node_files = {}
+        for filename in os.listdir(self.shared_folder):
+            if filename.startswith('clip_data-') and filename.endswith('.jsonl'):
+                try:
+                    file_stat = os.stat(os.path.join(self.shared_folder, filename))
+                except OSError:
+                    continue
+                node_files[filename] = (file_stat.st_size, file_stat.st_mtime)
+        if any(filename not in node_files or node_files[filename][0] < read_to[0]
+               for filename, read_to in self._read_to.items()):
+            self._entries = {}
+            self._read_to = {}
+
+        for filename, (size, mtime) in sorted(node_files.items()):
+            offset, prev_size, prev_mtime = self._read_to.get(filename, (0, None, None))
+            if (size, mtime) == (prev_size, prev_mtime):
+                continue
+            with open(os.path.join(self.shared_folder, filename), 'rb') as data_handle:
+                data_handle.seek(offset)
+                new_data = data_handle.read()
+            # Only read complete lines - a partially written final line (e.g. if that node is writing right now) is
+            #  left to be read next time, once complete
+            complete_length = new_data.rfind(b'\n') + 1
+            for line in new_data[:complete_length].splitlines():
+                try:
+                    entry = json.loads(line.decode('utf-8'))
+                except ValueError:
+                    continue
+                previous = self._entries.get(entry['basename'])
+                if previous is None or entry.get('timestamp', '') >= previous.get('timestamp', ''):
+                    self._entries[entry['basename']] = entry
+            self._read_to[filename] = (offset + complete_length, size, mtime)
+
+
+#
+# ##### LEASE HEARTBEAT THREAD
+#
+class LeaseHeartbeat(AppThread):
+
+    def threaded_function(self, lease_manager, interval_secs):
+        while True:
+            if self.should_abort():
+                return
+
+            if kd_timers.secs_elapsed_since_last(secs=interval_secs, timer_id='lease_heartbeat'):
+                lease_manager.heartbeat()
+            else:
+                kd_timers.sleep(secs=1)
@@ -1,7 +1,10 @@
 import os
 import glob
+import shutil
 import cv2
 import time
+import struct
+import tempfile
 from datetime import datetime
 
 
@@ -38,25 +41,31 @@ def get_file_metadata(folder, video_relative_path):
         file_time1 = filename_parts_u[2][8:12]
         file_time2 = filename_parts_u[2][12:17]
         basename_new = '%s-%s-%s-%s' % (filename_parts_u[0], file_date, file_time1, file_time2)
+        camera = filename_parts_u[0]
     elif len(filename_parts_u) == 3 and filename_parts_u[2].isdigit() and len(filename_parts_u[2]) == 14:
         # July2019 firmware update on Reolink camera changed filename format, therefore simplify mine!
         file_date = filename_parts_u[2][0:8]
         file_time1 = filename_parts_u[2][8:14]
         # file_time2 = filename_parts_u[2][12:14]
         basename_new = '%s-%s-%s' % (filename_parts_u[0], file_date, file_time1)  # ,file_time2)
+        camera = filename_parts_u[0]
     elif (len(filename_parts_d) == 4 and filename_parts_d[1].isdigit() and len(filename_parts_d[1]) == 8
             and filename_parts_d[2].isdigit() and len(filename_parts_d[2]) == 4
             and filename_parts_d[3].isdigit() and len(filename_parts_d[3]) == 5):
         basename_new = basename
         file_date = filename_parts_d[1]
+        camera = filename_parts_d[0]
     elif (len(filename_parts_d) == 5 and filename_parts_d[2].isdigit() and len(filename_parts_d[2]) == 8
             and filename_parts_d[3].isdigit() and len(filename_parts_d[3]) == 4
             and filename_parts_d[4].isdigit() and len(filename_parts_d[4]) == 5):
         basename_new = basename
         file_date = filename_parts_d[2]
+        # The channel is part of the camera name, as each channel is a separate camera
+        camera = '-'.join(filename_parts_d[:2])
     else:
         basename_new = basename
         file_date = 'NO_DATE'
+        camera = None
 
     return {'original': video_filename,
             'sub_folder': sub_folder,
@@ -64,7 +73,8 @@ def get_file_metadata(folder, video_relative_path):
             'filename_new': '%s%s' % (basename_new, extension),
             'basename_new': basename_new,
             'basename_original': basename,
-            'file_date': file_date
+            'file_date': file_date,
+            'camera': camera
             }
 
 
@@ -128,10 +138,25 @@ def save_image(image, path, basename, descriptor='', date_subfolder=None, group_
 
 
 def rename_basename_append(folder, subfolder, basename, append, conditional_suffix=''):
+    """ Renames every file with the basename, appending to the basename - returns a dict of {old path: new path}. """
     prefix = os.path.join(folder, subfolder, basename)
+    renamed = {}
     for base_file in glob.glob('%s-%s*' % (prefix, conditional_suffix)):
         suffix = base_file[len(prefix):]
-        os.rename(base_file, '%s%s%s' % (prefix, append, suffix))
+        renamed[base_file] = '%s%s%s' % (prefix, append, suffix)
+        os.rename(base_file, renamed[base_file])
+    return renamed
+
+
+def link_or_copy(source_fullpath, dest_fullpath):
+    """ Hard links a file to a new path (which takes no extra space), or if that fails (e.g. if on a different
+        filesystem) then copies it instead.  The destination folder is created if needed.
+    """
+    os.makedirs(os.path.dirname(dest_fullpath), exist_ok=True)
+    try:
+        os.link(source_fullpath, dest_fullpath)
+    except OSError:
+        shutil.copy2(source_fullpath, dest_fullpath)
 
 
 def move_to_done(video_done_folder, source_fullpath, file_date, filename_new):
@@ -158,7 +183,63 @@ def remove_empty_folder(source_folder, sub_folder):
         pass
 
 
+def probe_mp4(video_fullpath):
+    """ Cheaply checks the top-level box (atom) structure of an mp4 file, by reading only the box headers.
+        This is used to decide whether a video needs repairing before it can be decoded, without decoding it.  The
+        'moov' box holds the index of the video, so without it the video cannot be decoded or repaired.  A truncated
+        or corrupt box after the 'moov' box typically means an incomplete upload, which re-saving via mp4box can fix.
+        Files which are not .mp4 (e.g. streams) are not probed, and are always returned as 'ok'.
+        :param video_fullpath: A fully qualified path to the video file.
+        :return: Returns a string - 'ok', 'repairable' or 'unrecoverable'.
+    """
+    if not video_fullpath.lower().endswith('.mp4'):
+        return 'ok'
+    try:
+        file_size = os.path.getsize(video_fullpath)
+        box_types = []
+        with open(video_fullpath, 'rb') as video_handle:
+            position = 0
+            while position < file_size:
+                video_handle.seek(position)
+                header = video_handle.read(8)
+                if len(header) < 8:
+                    break
+                box_size, box_type = struct.unpack('>I4s', header)
+                if box_size == 1:
+                    # A size of 1 means the real size follows, as a 64-bit value
+                    box_size = struct.unpack('>Q', video_handle.read(8))[0]
+                elif box_size == 0:
+                    # A size of 0 means the box extends to the end of the file
+                    box_size = file_size - position
+                if box_size < 8 or not box_type.isalnum():
+                    break
+                box_types.append(box_type)
+                position += box_size
+    except OSError:
+        return 'unrecoverable'
+
+    if b'moov' not in box_types:
+        return 'unrecoverable'
+    if position != file_size or b'mdat' not in box_types:
+        return 'repairable'
+    return 'ok'
+
+
+def get_fixed_video_fullpath(fixed_folder=None):
+    """ Creates a new, empty, uniquely named file to hold a repaired copy of a video, and returns its path.
+        Each clip gets its own file, so that repairs don't overwrite each other if clips are processed concurrently.
+        :param fixed_folder: The folder to use - if not specified, uses tmpfs (/dev/shm) if available, to avoid
+                             writing to disk, otherwise the system temporary folder.
+        :return: Returns the fully qualified path of the new file.
+    """
+    if not fixed_folder:
+        fixed_folder = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    file_handle, video_fullpath_fixed = tempfile.mkstemp(prefix='kdcam-fixed-', suffix='.mp4', dir=fixed_folder)
+    os.close(file_handle)
+    return video_fullpath_fixed
+
+
 def remove_fixed_video(video_fullpath_fixed):
-    if os.path.isfile(video_fullpath_fixed):
+    if video_fullpath_fixed and os.path.isfile(video_fullpath_fixed):
         os.remove(video_fullpath_fixed)
 
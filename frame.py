@@ -1,6 +1,7 @@
 import cv2
 import numpy
 from subject import Subject
+from image_pool import ImagePool
 from collections import namedtuple
 DimensionLabels = namedtuple('DimensionLabels', 'source large medium small greyblur annotated')
 
@@ -23,6 +24,9 @@ class Frame:
     _blur_pixel_width = None
     _absolute_intensity_threshold = None
     _morph_radius = None
+    _morph_kernel = None
+    _morph_scale = 1
+    _morph_kernel_scaled = None
     _subject_size_threshold = None
     # Two dimensions attributes are named tuples, with members accessed via .source, .large, .medium and .small
     dimensions = None           # dimensions is in (x, y) i.e. (width, height) format
@@ -31,6 +35,9 @@ class Frame:
     _is_setup_time_increment = False
     _time_increment = None
 
+    _audit_mode = 'off'
+    _audit_every_n = 1
+
     # findContours returns (image, contours, hierarchy) in OpenCV 3, but (contours, hierarchy) in OpenCV 2 and OpenCV 4
     _contours_return_index = 1 if cv2.__version__.startswith('3.') else 0
 
@@ -39,7 +46,7 @@ class Frame:
     #
     @staticmethod
     def setup(blur_pixel_width, absolute_intensity_threshold, morph_radius, subject_size_threshold,
-              source_size_x, source_size_y, large_size_x, medium_size_x, small_size_x):
+              source_size_x, source_size_y, large_size_x, medium_size_x, small_size_x, morph_scale=1):
         """ Frame.setup() must be called prior to creating a Frame instance.
             Typically this would be at the top of the main file.
             :param blur_pixel_width: Image processing works best on blurred images - this controls the amount of blur
@@ -51,12 +58,30 @@ class Frame:
             :param large_size_x: Desired pixel width for a 'large' version of any image
             :param medium_size_x: Desired pixel width for a 'medium' version of any image
             :param small_size_x: Desired pixel width for a 'small' version of any image
+            :param morph_scale: 1 for the exact morph; otherwise a faster approximation, morphing a mask reduced in size
+                                by this factor (see morph_close) - e.g. 2 for half width and height
         """
         Frame._is_setup = True
         Frame._blur_pixel_width = blur_pixel_width
         Frame._absolute_intensity_threshold = absolute_intensity_threshold
         Frame._morph_radius = morph_radius
+        Frame._morph_kernel = numpy.ones((morph_radius, morph_radius), numpy.uint8)
+        Frame._morph_scale = morph_scale
+        morph_radius_scaled = max(int(round(morph_radius / morph_scale)), 1)
+        Frame._morph_kernel_scaled = numpy.ones((morph_radius_scaled, morph_radius_scaled), numpy.uint8)
         Frame._subject_size_threshold = subject_size_threshold
+        Frame.setup_dimensions(source_size_x, source_size_y, large_size_x, medium_size_x, small_size_x)
+
+    @staticmethod
+    def setup_dimensions(source_size_x, source_size_y, large_size_x, medium_size_x, small_size_x):
+        """ Sets the dimensions of each image type - called by Frame.setup(), but may also be called again before
+            creating a new Clip, e.g. where cameras differ in resolution.  Must not be called whilst a Clip is in use.
+            :param source_size_x: Pixel width of the original source image / video
+            :param source_size_y: Pixel height of the original source image / video
+            :param large_size_x: Desired pixel width for a 'large' version of any image
+            :param medium_size_x: Desired pixel width for a 'medium' version of any image
+            :param small_size_x: Desired pixel width for a 'small' version of any image
+        """
         # Dimensions are saved into a DimensionLabels namedtuple - this is immutable, so must all be set at once and
         #  cannot be changed later.  dimensions_numpy simply reverses the size tuple of dimensions, via [::-1].
         Frame.dimensions = DimensionLabels(source=(source_size_x, source_size_y),
@@ -87,6 +112,19 @@ class Frame:
         Frame._time_increment = time_increment
         Frame._is_setup_time_increment = True
 
+    @staticmethod
+    def setup_audit(audit_mode, audit_every_n=1):
+        """ Frame.setup_audit() is optional - by default, no audit data is captured.
+            Audit data (interim images from finding subjects, and testing their activity) is useful for debugging, but
+            for every frame can exceed the size of the images themselves, so is only captured for selected frames.
+            :param audit_mode: 'off', 'every_n' (every nth frame), or 'subjects' (only frames with subjects).
+            :param audit_every_n: Used with the 'every_n' audit_mode - e.g. 10 to capture audit for every 10th frame.
+        """
+        if audit_mode not in ['off', 'every_n', 'subjects']:
+            raise Exception('Invalid audit_mode for Frame.setup_audit().')
+        Frame._audit_mode = audit_mode
+        Frame._audit_every_n = audit_every_n
+
     #
     # ##### INIT METHODS
     #
@@ -108,12 +146,14 @@ class Frame:
     #     return cls(source_frame_img, time, time_out_of_sync)
 
     @classmethod
-    def init_from_video_sequential(cls, video_capture, time, frames_required_for, time_out_of_sync=False):
+    def init_from_video_sequential(cls, video_capture, time, frames_required_for, time_out_of_sync=False,
+                                   greyscale=False):
         """ Custom initialiser, for when a video stream is used - extracts the frame from the video stream.
             TODO: Update docs, tidy, etc
             :param video_capture: A valid OpenCV VideoCapture object
             :param time: The time (in milliseconds) within the video to extract the frame.
             :param time_out_of_sync: Used to allow frames not a multiple of _time_increment; must be explicit
+            :param greyscale: If True, the frame is stored as single-channel - only valid for greyscale (night) video
             :return: Returns a new Frame object, created by the primary __init__ method.
         """
         prev_time = video_capture.get(cv2.CAP_PROP_POS_MSEC)
@@ -124,38 +164,69 @@ class Frame:
                     raise EOFError
                 this_time = video_capture.get(cv2.CAP_PROP_POS_MSEC)
                 if prev_time <= time <= this_time:
-                    capture_success, source_frame_img = video_capture.retrieve()
-                    if not capture_success:
-                        raise EOFError
+                    source_frame_img = cls._decode_img(video_capture.retrieve, greyscale)
                     return cls(source_frame_img, time, time_out_of_sync, frames_required_for)
                 prev_time = this_time
         else:
             # If for some reason we're getting frames out of sequence, then use the slower seek method to get the frame
             print('*** WARNING *** - GETTING FRAME OUT OF SEQUENCE - SLOW!')
             video_capture.set(cv2.CAP_PROP_POS_MSEC, time)
-            capture_success, source_frame_img = video_capture.read()
-            if not capture_success:
-                # No frames remaining - calling function should handle this as simply having reached end of the video
-                raise EOFError
+            source_frame_img = cls._decode_img(video_capture.read, greyscale)
             return cls(source_frame_img, time, time_out_of_sync, frames_required_for)
 
     @classmethod
-    def init_from_image(cls, source_img, time, frames_required_for, time_out_of_sync=False):
+    def init_from_video_grabbed(cls, video_capture, time, frames_required_for, greyscale=False):
+        """ Custom initialiser, for a frame which has already been grabbed from a video stream - e.g. a live stream,
+            where the caller decides which frames to decode based on its own frame count.
+            :param video_capture: A valid OpenCV VideoCapture object, on which grab() has just succeeded.
+            :param time: The time (in milliseconds) to record for the frame.
+            :param greyscale: If True, the frame is stored as single-channel - only valid for greyscale (night) video
+            :return: Returns a new Frame object, created by the primary __init__ method.
+        """
+        source_frame_img = cls._decode_img(video_capture.retrieve, greyscale)
+        return cls(source_frame_img, time, False, frames_required_for)
+
+    @staticmethod
+    def _decode_img(decode_function, greyscale):
+        """ PRIVATE: Decodes an image from a video, into an image taken from the ImagePool.
+            :param decode_function: Either the retrieve or read method of a valid OpenCV VideoCapture object
+            :param greyscale: If True, returns a single-channel image - only valid for greyscale (night) video
+            :return: Returns the decoded source image; raises EOFError if no image could be decoded.
+        """
+        decode_img = ImagePool.get(Frame.dimensions_numpy.source + (3,))
+        capture_success, source_frame_img = decode_function(decode_img)
+        if not capture_success:
+            # No frames remaining - calling function should handle this as simply having reached end of the video
+            ImagePool.release(decode_img)
+            raise EOFError
+        if greyscale:
+            source_frame_img = cv2.extractChannel(source_frame_img, 0,
+                                                  dst=ImagePool.get(source_frame_img.shape[:2]))
+            ImagePool.release(decode_img)
+        return source_frame_img
+
+    @classmethod
+    def init_from_image(cls, source_img, time, frames_required_for, time_out_of_sync=False, img_type='source',
+                        greyblur_img=None):
         """ Custom initialiser, for when a image is the source of the frame - this is used directly.
-            :param source_img: An image, matching the pre-defined size expected for a source frame.
+            :param source_img: An image, matching the pre-defined size expected for img_type (a source frame by default)
             :param time: Will be recorded as part of the frame, but note this can be set arbitrarily.
             :param time_out_of_sync: Used to allow frames not a multiple of _time_increment; must be explicit
+            :param img_type: Either 'source' or 'large' - a 'large' image is used e.g. when loading from a FrameCache
+            :param greyblur_img: Optionally, a pre-calculated 'greyblur' image to save re-calculating it
             :return: Returns a new Frame object, created by the primary __init__ method.
         """
-        return cls(source_img, time, time_out_of_sync, frames_required_for)
+        return cls(source_img, time, time_out_of_sync, frames_required_for, img_type, greyblur_img)
 
-    def __init__(self, source_img, time, time_out_of_sync, frames_required_for):
+    def __init__(self, source_img, time, time_out_of_sync, frames_required_for, img_type='source', greyblur_img=None):
         """ PRIVATE: Create new instance of Frame - shouldn't be called directly, use init_from_video/image instead!
             This checks that adequate setup has been carried out, and that the frame size is as expected.
             Key variables are then setup and prepared for later use.
             :param source_img: Requires a valid image, of the expected size, representing the source frame
             :param time: The time in milliseconds at which we want to read the frame.
             :param time_out_of_sync: Used to allow frames not a multiple of _time_increment; must be explicit
+            :param img_type: Either 'source' or 'large', to describe which version of the frame source_img is
+            :param greyblur_img: Optionally, a pre-calculated 'greyblur' image (must be 'large' size)
         """
 
         # Check here that Frame class properties are set
@@ -165,8 +236,12 @@ class Frame:
             raise Exception('Must call Frame.setup_time_increment before creating a Frame instance')
 
         # Check that the source_img is of the expected dimensions
-        if not Frame.dimensions_numpy.source == source_img.shape[:2]:
+        if img_type not in ['source', 'large']:
+            raise Exception('New Frame can only be created from a source or large image.')
+        if not getattr(Frame.dimensions_numpy, img_type) == source_img.shape[:2]:
             raise Exception('New Frame source image / video dimensions are not as expected.')
+        if greyblur_img is not None and not Frame.dimensions_numpy.greyblur == greyblur_img.shape[:2]:
+            raise Exception('New Frame greyblur image dimensions are not as expected.')
 
         # Check that the time is a multiple of time_increment - or if not, that the calling function explicitly
         #  recognises that (via setting the time_out_of_sync parameter).  Otherwise would cause issues with previous /
@@ -179,8 +254,9 @@ class Frame:
 
         # Initialise other variables for this instance of frame - most are only set when first required_for
         self.time = time
-        self._img = {'source': source_img, 'large': None, 'medium': None, 'small': None,
-                     'greyblur': None, 'annotated': None}
+        self._img = {'source': None, 'large': None, 'medium': None, 'small': None,
+                     'greyblur': greyblur_img, 'annotated': None}
+        self._img[img_type] = source_img
 
         # _tested_subjects allows us to know if empty subjects means there are no subjects, or just haven't checked yet
         self._tested_subjects = False
@@ -204,25 +280,65 @@ class Frame:
         """
 
         if self._img[img_type] is None:
-            if img_type == 'source':
-                # There should always be a source image already, which can just be returned - if not, something wrong!
+            if img_type in ['source', 'large'] and self._img['source'] is None:
+                # There should always be a source (or, if created from a cache, a large) image already - if not,
+                #  something wrong!  Note a frame created from a large image can never provide the source image.
                 raise Exception('Frame.get_img() called without being properly initiated - source img not set.')
             elif img_type == 'greyblur':
-                # greyblur always uses a 'large' image, with blurring applied after converting to greyscale
-                self._img[img_type] = cv2.GaussianBlur(cv2.cvtColor(self.get_img('large'), cv2.COLOR_BGR2GRAY),
-                                                       (Frame._blur_pixel_width, Frame._blur_pixel_width), 0)
+                # greyblur always uses a 'large' image, with blurring applied after converting to greyscale (unless
+                #  the frame is already single-channel greyscale)
+                large_img = self.get_img('large')
+                grey_img = None
+                if large_img.ndim == 3:
+                    grey_img = cv2.cvtColor(large_img, cv2.COLOR_BGR2GRAY,
+                                            dst=ImagePool.get(Frame.dimensions_numpy.greyblur))
+                self._img[img_type] = cv2.GaussianBlur(grey_img if grey_img is not None else large_img,
+                                                       (Frame._blur_pixel_width, Frame._blur_pixel_width), 0,
+                                                       dst=ImagePool.get(Frame.dimensions_numpy.greyblur))
+                ImagePool.release(grey_img)
             elif img_type == 'annotated':
                 # annotated creates a copy of the 'large' image, used primarily for debugging / understanding the frame
-                self._img[img_type] = self.get_img('large').copy()
+                #  - always in colour, so that annotations are visible even on greyscale frames
+                annotated_img = ImagePool.get(Frame.dimensions_numpy.annotated + (3,))
+                if self.get_img('large').ndim == 2:
+                    self._img[img_type] = cv2.cvtColor(self.get_img('large'), cv2.COLOR_GRAY2BGR, dst=annotated_img)
+                else:
+                    numpy.copyto(annotated_img, self.get_img('large'))
+                    self._img[img_type] = annotated_img
             elif img_type in ['large', 'medium', 'small']:
-                self._img[img_type] = cv2.resize(self._img['source'],
+                # Resize from the source image where possible, but fall back to large (e.g. if created from a cache)
+                resize_from = self._img['source'] if self._img['source'] is not None else self._img['large']
+                self._img[img_type] = cv2.resize(resize_from,
                                                  getattr(Frame.dimensions, img_type),
+                                                 dst=ImagePool.get(getattr(Frame.dimensions_numpy, img_type)
+                                                                   + resize_from.shape[2:]),
                                                  interpolation=cv2.INTER_AREA)
             else:
                 # No other img_type than those listed above is valid - must be typo somewhere!
                 raise Exception('Invalid img_type for Frame.get_img().')
         return self._img[img_type]
 
+    def release_imgs(self):
+        """ Hands all of this frame's images (and full-frame audit images) back to the ImagePool for re-use.
+            Must only be called when the frame is being deleted, as the images will then be over-written.
+        """
+        for img_type in self._img:
+            ImagePool.release(self._img[img_type])
+            self._img[img_type] = None
+        for audit_key in ['base_comparison_basic', 'base_comparison_absolute', 'base_comparison_morph']:
+            ImagePool.release(self.audit.pop(audit_key, None))
+
+    def convert_to_greyscale(self):
+        """ Converts this frame's images to single-channel, in-place - only valid for greyscale (night) frames, where
+            all three BGR channels are equal, so the first channel can simply be kept.  The annotated image (if
+            already created) is left in colour.
+        """
+        for img_type in ['source', 'large', 'medium', 'small']:
+            if self._img[img_type] is not None and self._img[img_type].ndim == 3:
+                colour_img = self._img[img_type]
+                self._img[img_type] = cv2.extractChannel(colour_img, 0, dst=ImagePool.get(colour_img.shape[:2]))
+                ImagePool.release(colour_img)
+
     # def clear_imgs(self):
     #     """
     #         TODO: Full documentation
@@ -277,25 +393,29 @@ class Frame:
         """
 
         # Perform a per-pixel comparisons between the two frames, and basic manipulation to give a cleaner difference.
-        self.audit['base_comparison_basic'] = cv2.absdiff(base_frame.get_img('greyblur'), self.get_img('greyblur'))
-        self.audit['base_comparison_absolute'] = cv2.threshold(self.audit['base_comparison_basic'],
+        #  Each intermediate image is written into an image from the ImagePool, and released once no longer needed.
+        comparison = {}
+        comparison['base_comparison_basic'] = cv2.absdiff(base_frame.get_img('greyblur'), self.get_img('greyblur'),
+                                                          dst=ImagePool.get(Frame.dimensions_numpy.greyblur))
+        comparison['base_comparison_absolute'] = cv2.threshold(comparison['base_comparison_basic'],
                                                                Frame._absolute_intensity_threshold,
                                                                255,
-                                                               cv2.THRESH_BINARY)[1]  # [1] returns just the image
-        self.audit['base_comparison_morph'] = cv2.morphologyEx(self.audit['base_comparison_absolute'],
-                                                               cv2.MORPH_CLOSE,
-                                                               numpy.ones((Frame._morph_radius,
-                                                                           Frame._morph_radius), numpy.uint8))
+                                                               cv2.THRESH_BINARY,
+                                                               dst=ImagePool.get(Frame.dimensions_numpy.greyblur)
+                                                               )[1]  # [1] returns just the image
+        comparison['base_comparison_morph'] = Frame.morph_close(comparison['base_comparison_absolute'])
 
         # Generate contours from the comparison image (numpy array), so we can work on each contour in turn
-        morph_contours = cv2.findContours(self.audit['base_comparison_morph'],
+        morph_contours = cv2.findContours(comparison['base_comparison_morph'],
                                           cv2.RETR_EXTERNAL,
                                           cv2.CHAIN_APPROX_SIMPLE)[self._contours_return_index]
         for morph_contour in morph_contours:
-            # Re-create the contour as an image mask, but only one contour at a time - then apply _retain_mask
-            morph_contour_img = numpy.zeros(Frame.dimensions_numpy.large, numpy.uint8)
-            cv2.drawContours(morph_contour_img, [morph_contour], -1, (255, 255, 255), cv2.FILLED)
-            masked_morph_contour_img = numpy.bitwise_and(morph_contour_img, retain_mask)
+            # Re-create the contour as an image mask, but only one contour at a time - then apply _retain_mask.  This
+            #  is only done within the contour's bounding rect, rather than allocating a full-frame mask per contour.
+            x, y, w, h = cv2.boundingRect(morph_contour)
+            morph_contour_img = numpy.zeros((h, w), numpy.uint8)
+            cv2.drawContours(morph_contour_img, [morph_contour], -1, (255, 255, 255), cv2.FILLED, offset=(-x, -y))
+            masked_morph_contour_img = cv2.bitwise_and(morph_contour_img, retain_mask[y: y + h, x: x + w])
 
             # Once again revert back to contours, so we can loop through in turn and check their sizes (after masking)
             masked_morph_contours = cv2.findContours(masked_morph_contour_img,
@@ -309,12 +429,46 @@ class Frame:
                     self.subjects.append(Subject(morph_contour))
                     break
 
+        # Only keep the interim images as audit data if this frame is selected for capture - otherwise they can be
+        #  re-used straight away
+        if self._is_audit_captured():
+            self.audit.update(comparison)
+        else:
+            for comparison_img in comparison.values():
+                ImagePool.release(comparison_img)
+
         # Note that we've tested for subjects, in order to distinguish 'no subjects' from 'not yet tested for them'.
         # Also mark base frame as tested, as it can't have subjects as nothing to compare to - so not applicable.
         self._tested_subjects = True
         base_frame._tested_subjects = True
         return self.subjects
 
+    @staticmethod
+    def morph_close(threshold_img):
+        """ Morphs a thresholded difference image (i.e. a 'greyblur' sized mask), to fill in small gaps - as used by
+            get_subjects.  With a morph_scale of 1 this is an exact close with a morph_radius square kernel.  Otherwise,
+            the mask is first reduced in size by morph_scale (where any pixel set within each block remains set), then
+            closed with a kernel reduced to match, then enlarged back up - far quicker, but subject edges are blockier
+            and may grow by up to morph_scale pixels.  See sweep.py --morph to compare the two on sample clips.
+            :param threshold_img: A 'greyblur' sized binary mask, as from cv2.threshold.
+            :return: Returns the morphed mask, as a new image from the ImagePool.
+        """
+        if Frame._morph_scale <= 1:
+            return cv2.morphologyEx(threshold_img, cv2.MORPH_CLOSE, Frame._morph_kernel,
+                                    dst=ImagePool.get(Frame.dimensions_numpy.greyblur))
+        scaled_size = (max(Frame.dimensions.greyblur[0] // Frame._morph_scale, 1),
+                       max(Frame.dimensions.greyblur[1] // Frame._morph_scale, 1))
+        scaled_img = cv2.resize(threshold_img, scaled_size, dst=ImagePool.get(scaled_size[::-1]),
+                                interpolation=cv2.INTER_AREA)
+        cv2.threshold(scaled_img, 0, 255, cv2.THRESH_BINARY, dst=scaled_img)
+        scaled_morph = cv2.morphologyEx(scaled_img, cv2.MORPH_CLOSE, Frame._morph_kernel_scaled,
+                                        dst=ImagePool.get(scaled_size[::-1]))
+        morph_img = cv2.resize(scaled_morph, Frame.dimensions.greyblur,
+                               dst=ImagePool.get(Frame.dimensions_numpy.greyblur), interpolation=cv2.INTER_NEAREST)
+        ImagePool.release(scaled_img)
+        ImagePool.release(scaled_morph)
+        return morph_img
+
     def num_subjects(self, only_active=False):
         """ Counts the number of subjects within this frame.  Note get_subjects must be called before this!
             Not saved as a stored value, as it's very quick to calculate, and has variants with only_active.
@@ -330,19 +484,40 @@ class Frame:
                 num_subjects += 1
         return num_subjects
 
-    def get_subjects_and_activity(self, base_frame, prev_frame, retain_mask):
+    def _is_audit_captured(self):
+        """ PRIVATE: Determines whether audit data should be captured for this frame, based on Frame.setup_audit().
+            Note this must only be called once subjects have been found, as that is needed for the 'subjects' mode.
+        """
+        if Frame._audit_mode == 'every_n':
+            return (self.time // Frame._time_increment) % Frame._audit_every_n == 0
+        elif Frame._audit_mode == 'subjects':
+            return len(self.subjects) > 0
+        return False
+
+    def get_subjects_and_activity(self, base_frame, prev_frame, retain_mask, audit_archive=None):
         """
             TODO: Documentation etc
             :param base_frame:
             :param prev_frame:
             :param retain_mask:
+            :param audit_archive: Optionally, an AuditArchive - any captured audit data is passed to this (for saving
+                                  asynchronously) rather than being kept within the frame and its subjects.
             :return:
         """
         self.get_subjects(base_frame, retain_mask)
+        capture_audit = self._is_audit_captured()
         for subject in self.subjects:
             # Checking whether subjects are active are based on comparison to the previous frame
             subject.test_if_active(prev_frame.get_img('greyblur'),
-                                   self.get_img('greyblur'))
+                                   self.get_img('greyblur'),
+                                   capture_audit=capture_audit)
+        if capture_audit and audit_archive is not None:
+            # Hand over the audit data, which is then no longer referenced by the frame or subjects - so the interim
+            #  images are not released back to the ImagePool, and remain untouched until written
+            audit_archive.add(self.time, self.audit, [subject.audit for subject in self.subjects])
+            self.audit = {}
+            for subject in self.subjects:
+                subject.audit = {}
         self._tested_subject_activity = True
         # Base and Prev are also flagged as tested, as tests would either have been done before or are not relevant
         base_frame._tested_subject_activity = True
@@ -0,0 +1,166 @@
+import os
+import json
+import numpy
+from numpy.lib.format import open_memmap
+from frame import Frame
+from image_pool import ImagePool
+
+
+class FrameCache:
+    """ The FrameCache class stores decoded frames for a single clip on disk, so the clip can be re-processed without
+        decoding the video again - primarily intended for parameter sweeps / tuning, which re-process the same clips.
+
+        The 'large' image (and optionally the 'greyblur' image) for each sampled frame time is saved into a single
+        .npy array per image type, saved next to the video, which is then memory-mapped when read back.  A small .json
+        file records the details needed to check that the cache is still valid - i.e. the video's size and modified
+        time, plus the Frame dimensions, time_increment and greyscale_night setting used when the cache was created (as
+        night clips are only cached single-channel if greyscale_night was enabled).  The .json file is only written
+        once all frames have been added, so a partially written cache is never treated as valid.
+        FrameCache is dependent on Frame, as a project-specific dependency.
+    """
+
+    def __init__(self, video_fullpath, time_increment, inc_greyblur=False, greyscale_night=False):
+        """ Create a new FrameCache for the specified video - does not read or write anything until opened.
+            :param video_fullpath: A fully qualified path to the video file being cached.
+            :param time_increment: The time, in milliseconds, between subsequent frames held in the cache.
+            :param inc_greyblur: Boolean; if true, also cache the 'greyblur' image alongside the 'large' image.
+            :param greyscale_night: Boolean; the Clip greyscale_night setting - if true, night clips are single-channel.
+        """
+        self._video_fullpath = video_fullpath
+        self._time_increment = time_increment
+        self._img_types = ['large', 'greyblur'] if inc_greyblur else ['large']
+        self._greyscale_night = greyscale_night
+        self._meta_fullpath = '%s.cache.json' % video_fullpath
+        self._arrays = {}
+        self._times = []
+        self._time_indexes = {}     # Keyed by frame time, with the value being its index within the cached arrays
+        self.is_writing = False
+        self.is_reading = False
+        self.frame_count = None
+        self.frames_per_second = None
+
+    def _img_fullpath(self, img_type):
+        """ PRIVATE: Returns the path of the .npy array holding the cached images of type img_type. """
+        return '%s.%s.npy' % (self._video_fullpath, img_type)
+
+    def _signature(self):
+        """ PRIVATE: Returns a dict of all values which must match for the cache to be valid for the current setup. """
+        video_stat = os.stat(self._video_fullpath)
+        return {'video_size': video_stat.st_size,
+                'video_mtime': video_stat.st_mtime,
+                'dimensions_large': list(Frame.dimensions.large),
+                'blur_pixel_width': Frame._blur_pixel_width if 'greyblur' in self._img_types else None,
+                'time_increment': self._time_increment,
+                'greyscale_night': self._greyscale_night,
+                'img_types': self._img_types}
+
+    #
+    # ##### READING FROM THE CACHE
+    #
+    def is_valid(self):
+        """ Checks whether a complete cache exists for this video, and that it matches the current setup.
+            :return: Returns True if the cache can be used in place of decoding the video.
+        """
+        try:
+            with open(self._meta_fullpath, 'r') as meta_handle:
+                meta = json.load(meta_handle)
+        except (OSError, ValueError):
+            return False
+        try:
+            if meta['signature'] != self._signature():
+                return False
+        except (OSError, KeyError):
+            return False
+        return all(os.path.isfile(self._img_fullpath(img_type)) for img_type in self._img_types)
+
+    def open_for_read(self):
+        """ Memory-maps the cached arrays, ready for frames to be retrieved via get_frame().
+            Should only be called after is_valid() has returned True.
+        """
+        with open(self._meta_fullpath, 'r') as meta_handle:
+            meta = json.load(meta_handle)
+        self._times = meta['times']
+        self._time_indexes = {time: index for index, time in enumerate(self._times)}
+        self.frame_count = meta['frame_count']
+        self.frames_per_second = meta['frames_per_second']
+        for img_type in self._img_types:
+            self._arrays[img_type] = numpy.load(self._img_fullpath(img_type), mmap_mode='r')
+        self.is_reading = True
+
+    def get_frame(self, time, frames_required_for, greyscale=False):
+        """ Creates a new Frame from the cached images at the specified time, via Frame.init_from_image.
+            :param time: The time (in milliseconds) of the frame to retrieve.
+            :param frames_required_for: A list of requirements, as passed to the Frame initialisers.
+            :param greyscale: If True, the frame is converted to single-channel if it was cached in colour.
+            :return: Returns a new Frame object; raises EOFError if the time is beyond the end of the cache.
+        """
+        try:
+            index = self._time_indexes[time]
+        except KeyError:
+            raise EOFError
+        # Copy out of the memory-mapped arrays, so the Frame owns (and can modify, e.g. annotate) its own images
+        imgs = {}
+        for img_type, array in self._arrays.items():
+            imgs[img_type] = ImagePool.get(array.shape[1:])
+            numpy.copyto(imgs[img_type], array[index])
+        frame = Frame.init_from_image(imgs['large'], time, frames_required_for,
+                                      img_type='large', greyblur_img=imgs.get('greyblur'))
+        if greyscale:
+            frame.convert_to_greyscale()
+        return frame
+
+    #
+    # ##### WRITING TO THE CACHE
+    #
+    def open_for_write(self, frame_count, frames_per_second, large_shape):
+        """ Creates the cached arrays, sized to hold every frame time within the video.
+            :param frame_count: Total number of frames in the video, as reported by VideoCapture.
+            :param frames_per_second: Frame rate of the video, as reported by VideoCapture.
+            :param large_shape: The numpy shape of each 'large' image - greyscale clips have no channel dimension.
+        """
+        self.frame_count = frame_count
+        self.frames_per_second = frames_per_second
+        max_frames = int(frame_count / frames_per_second * 1000 / self._time_increment) + 1
+        self._arrays['large'] = open_memmap(self._img_fullpath('large'), mode='w+', dtype=numpy.uint8,
+                                            shape=(max_frames,) + tuple(large_shape))
+        if 'greyblur' in self._img_types:
+            self._arrays['greyblur'] = open_memmap(self._img_fullpath('greyblur'), mode='w+', dtype=numpy.uint8,
+                                                   shape=(max_frames,) + Frame.dimensions_numpy.greyblur)
+        self._times = []
+        self.is_writing = True
+
+    def add_frame(self, frame):
+        """ Adds a single frame to the cache - frames must be added in time order.
+            :param frame: A Frame object, which will have its 'large' (and maybe 'greyblur') image generated if needed.
+        """
+        index = len(self._times)
+        if index >= self._arrays['large'].shape[0]:
+            # Frame count reported by the video was too low - stop adding, the cache will just be shorter than the clip
+            return
+        for img_type in self._img_types:
+            self._arrays[img_type][index] = frame.get_img(img_type)
+        self._times.append(frame.time)
+
+    def close(self):
+        """ Flushes any cached arrays, and if writing then saves the .json file to mark the cache as complete. """
+        if self.is_writing:
+            for array in self._arrays.values():
+                array.flush()
+            meta = {'signature': self._signature(),
+                    'times': self._times,
+                    'frame_count': self.frame_count,
+                    'frames_per_second': self.frames_per_second}
+            with open(self._meta_fullpath, 'w') as meta_handle:
+                json.dump(meta, meta_handle)
+        self._arrays.clear()
+        self.is_writing = False
+        self.is_reading = False
+
+    def remove(self):
+        """ Removes any cache files for this video, e.g. if writing the cache failed part-way through. """
+        self._arrays.clear()
+        self.is_writing = False
+        self.is_reading = False
+        for fullpath in [self._meta_fullpath] + [self._img_fullpath(img_type) for img_type in self._img_types]:
+            if os.path.isfile(fullpath):
+                os.remove(fullpath)
@@ -0,0 +1,195 @@
+import os
+import cv2
+import html
+import json
+import shutil
+import kd_timers
+import file_handling
+from kd_app_thread import AppThread
+
+
+class Gallery:
+    """ The Gallery class builds a static HTML gallery of every composite in images_output - one page per day, plus an
+        index page listing the days - which can be served by any web server, or just opened from disk.
+
+        Each day's page lists the clips from clip_data, with their composites shown as thumbnails linking to the full
+        size images.  Thumbnails are saved once (at the 'small' Frame size) and loaded lazily by the browser, so even
+        a day with hundreds of clips opens quickly on a Pi.  Building is incremental: each day's page is only rebuilt
+        if its images or clip_data entries have changed since the last build, as recorded in a small state file.
+        Gallery has no project-specific dependencies, other than file_handling to parse dates from basenames.
+    """
+
+    def __init__(self, gallery_folder, images_folder, thumb_width):
+        """ Create a new Gallery.
+            :param gallery_folder: Folder in which to save the HTML pages and thumbnails.
+            :param images_folder: The images_output folder, i.e. with a sub-folder of composites for each day.
+            :param thumb_width: Width of each thumbnail, in pixels.
+        """
+        self.gallery_folder = gallery_folder
+        self.images_folder = images_folder
+        self.thumb_width = thumb_width
+        self._state_fullpath = os.path.join(gallery_folder, 'gallery_state.json')
+        try:
+            with open(self._state_fullpath, 'r') as state_handle:
+                self._state = json.load(state_handle)
+        except (OSError, ValueError):
+            self._state = {}
+
+    def update(self, clip_data):
+        """ Rebuilds the pages for any days which have changed since the last update, and the index if needed.
+            :param clip_data: A list of every clip_data entry.
+            :return: Returns a list of the days (as YYYYMMDD) which were rebuilt.
+        """
+        clips_by_day = {}
+        for entry in clip_data:
+            file_datetime = file_handling.get_file_datetime(entry['basename'])
+            if file_datetime is not None:
+                clips_by_day.setdefault(file_datetime.strftime('%Y%m%d'), []).append(entry)
+        days = set(clips_by_day)
+        if os.path.isdir(self.images_folder):
+            days.update(day for day in os.listdir(self.images_folder)
+                        if len(day) == 8 and day.isdigit() and os.path.isdir(os.path.join(self.images_folder, day)))
+
+        rebuilt = []
+        for day in sorted(days):
+            signature = self._day_signature(day, clips_by_day.get(day, []))
+            if self._state.get(day) != signature:
+                self._build_day(day, clips_by_day.get(day, []))
+                self._state[day] = signature
+                rebuilt.append(day)
+        # Forget (and remove pages for) any days which have been cleaned up completely
+        for day in [day for day in self._state if day not in days]:
+            del self._state[day]
+            self._remove_if_exists(os.path.join(self.gallery_folder, '%s.html' % day))
+            shutil.rmtree(os.path.join(self.gallery_folder, 'thumbs', day), ignore_errors=True)
+            rebuilt.append(day)
+
+        if rebuilt or not os.path.isfile(os.path.join(self.gallery_folder, 'index.html')):
+            self._build_index(clips_by_day)
+            self._save_state()
+        return rebuilt
+
+    #
+    # ##### PRIVATE METHODS
+    #
+    def _day_signature(self, day, clips):
+        """ PRIVATE: Returns a value which changes whenever a day's images or clips change - from the modified time of
+            the day's folder and its sub-folders (which change whenever a file within is added or removed), rather than
+            listing every file.
+        """
+        day_folder = os.path.join(self.images_folder, day)
+        folder_mtimes = []
+        if os.path.isdir(day_folder):
+            folder_mtimes.append(os.stat(day_folder).st_mtime)
+            folder_mtimes.extend(sorted(entry.stat().st_mtime for entry in os.scandir(day_folder) if entry.is_dir()))
+        return [folder_mtimes, len(clips), max((clip.get('timestamp', '') for clip in clips), default='')]
+
+    def _get_day_images(self, day):
+        """ PRIVATE: Returns a list of paths (relative to images_folder) of every image for a day, sorted by name. """
+        day_folder = os.path.join(self.images_folder, day)
+        images = []
+        for root_folder, folders, files in os.walk(day_folder):
+            for file_name in files:
+                if file_name.endswith('.jpg'):
+                    images.append(os.path.relpath(os.path.join(root_folder, file_name), self.images_folder))
+        return sorted(images, key=lambda image: (os.path.basename(image), image))
+
+    def _get_thumbnail(self, image):
+        """ PRIVATE: Returns the path of an image's thumbnail (relative to gallery_folder), creating it if needed. """
+        thumb = os.path.join('thumbs', image)
+        thumb_fullpath = os.path.join(self.gallery_folder, thumb)
+        if not os.path.isfile(thumb_fullpath):
+            img = cv2.imread(os.path.join(self.images_folder, image))
+            if img is None:
+                return None
+            thumb_height = int(img.shape[0] * self.thumb_width / img.shape[1])
+            os.makedirs(os.path.dirname(thumb_fullpath), exist_ok=True)
+            cv2.imwrite(thumb_fullpath, cv2.resize(img, (self.thumb_width, thumb_height), interpolation=cv2.INTER_AREA))
+        return thumb
+
+    def _build_day(self, day, clips):
+        """ PRIVATE: Builds the page for a single day, creating any thumbnails not already created. """
+        # Match each image to its clip by basename - images from the second segment onwards have a letter appended
+        clips_by_basename = {clip['basename']: clip for clip in clips}
+        images_by_basename = {}
+        for image in self._get_day_images(day):
+            image_basename = os.path.basename(image).split('-Composite')[0]
+            if image_basename not in clips_by_basename and image_basename[:-1] in clips_by_basename:
+                image_basename = image_basename[:-1]
+            images_by_basename.setdefault(image_basename, []).append(image)
+
+        sections = []
+        for basename in sorted(set(clips_by_basename) | set(images_by_basename), reverse=True):
+            clip = clips_by_basename.get(basename, {})
+            details = [html.escape(basename)]
+            if clip:
+                details.append('%d segments' % len(clip.get('segments') or []))
+                trigger_zones = sorted(set(zone for segment in clip.get('segments') or []
+                                           for zone in segment.get('trigger_zones', [])))
+                if trigger_zones:
+                    details.append(html.escape(', '.join(trigger_zones)))
+                if clip.get('is_night'):
+                    details.append('night')
+            thumbs = []
+            for image in images_by_basename.get(basename, []):
+                thumb = self._get_thumbnail(image)
+                if thumb is None:
+                    continue
+                image_href = os.path.relpath(os.path.join(self.images_folder, image), self.gallery_folder)
+                thumbs.append('<a href="%s"><img src="%s" loading="lazy" width="%d" alt="%s"></a>'
+                              % (html.escape(image_href), html.escape(thumb), self.thumb_width,
+                                 html.escape(os.path.basename(image))))
+            sections.append('<div class="clip"><p>%s</p>%s</div>' % (' - '.join(details), ''.join(thumbs)))
+
+        self._write_page('%s.html' % day, 'KDCam - %s' % day,
+                         '<p><a href="index.html">All days</a></p>\n%s' % '\n'.join(sections))
+
+    def _build_index(self, clips_by_day):
+        """ PRIVATE: Builds the index page, listing every day newest first. """
+        rows = []
+        for day in sorted(self._state, reverse=True):
+            clips = clips_by_day.get(day, [])
+            rows.append('<li><a href="%s.html">%s</a> - %d clips, %d segments</li>'
+                        % (day, day, len(clips), sum(len(clip.get('segments') or []) for clip in clips)))
+        self._write_page('index.html', 'KDCam', '<ul>\n%s\n</ul>' % '\n'.join(rows))
+
+    def _write_page(self, filename, title, body):
+        """ PRIVATE: Saves an HTML page - written to a temporary file and then renamed, so never seen part-written. """
+        page = ('<!DOCTYPE html>\n<html>\n<head>\n<meta charset="utf-8">\n<title>%s</title>\n'
+                '<style>body {font-family: sans-serif} .clip img {margin: 2px}</style>\n'
+                '</head>\n<body>\n<h1>%s</h1>\n%s\n<p>Updated %s</p>\n</body>\n</html>\n'
+                % (html.escape(title), html.escape(title), body, kd_timers.timestamp()))
+        os.makedirs(self.gallery_folder, exist_ok=True)
+        page_fullpath = os.path.join(self.gallery_folder, filename)
+        with open('%s.tmp' % page_fullpath, 'w') as page_handle:
+            page_handle.write(page)
+        os.replace('%s.tmp' % page_fullpath, page_fullpath)
+
+    def _save_state(self):
+        """ PRIVATE: Saves the signature of every day built, so unchanged days are skipped next time. """
+        with open('%s.tmp' % self._state_fullpath, 'w') as state_handle:
+            json.dump(self._state, state_handle)
+        os.replace('%s.tmp' % self._state_fullpath, self._state_fullpath)
+
+    @staticmethod
+    def _remove_if_exists(fullpath):
+        if os.path.isfile(fullpath):
+            os.remove(fullpath)
+
+
+#
+# ##### GALLERY THREAD
+#
+class GalleryBuilder(AppThread):
+
+    def threaded_function(self, gallery, get_clip_data, interval_secs):
+        first_run = True
+        while True:
+            if self.should_abort():
+                return
+
+            if kd_timers.secs_elapsed_since_last(secs=interval_secs, timer_id='gallery') or first_run:
+                first_run = False
+                gallery.update(get_clip_data())
+            else:
+                kd_timers.sleep(secs=5)
@@ -1,5 +1,5 @@
 # import sys
-# import os
+import os
 import cv2
 import numpy
 # from datetime import datetime, timedelta
@@ -319,9 +319,28 @@ def hostname():
 #         return False
 
 
-def get_temp_str():
+def get_temp_c():
+    """ Returns the SoC temperature in degrees C, or None if not available (e.g. when not running on a Pi). """
     try:
         with open('/sys/class/thermal/thermal_zone0/temp', 'r') as f:
-            return '%dC' % (int(f.read(5)) / 1000)
+            return int(f.read(5)) / 1000
     except (OSError, ValueError):
+        return None
+
+
+def get_temp_str():
+    temp_c = get_temp_c()
+    if temp_c is None:
         return 'N/A'
+    return '%dC' % temp_c
+
+
+def is_cpu_idle(max_load_per_cpu):
+    """ Checks whether the CPU is currently idle, by the 1 minute load average per CPU core.
+        :param max_load_per_cpu: Load average per core below which the CPU is considered idle, e.g. 0.5
+        :return: Returns True if idle - or if the load average isn't available on this platform.
+    """
+    try:
+        return os.getloadavg()[0] / (os.cpu_count() or 1) < max_load_per_cpu
+    except (OSError, AttributeError):
+        return True
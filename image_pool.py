@@ -0,0 +1,69 @@
+import numpy
+import threading
+
+
+class ImagePool:
+    """ The ImagePool class recycles fixed-shape numpy arrays, to avoid allocating new images for every frame.
+
+        Frames repeatedly need images of the same few shapes (source, large, greyblur, etc) - rather than allocating
+        new arrays each time, which over long runs causes allocator churn and memory fragmentation, arrays are taken
+        from the pool via get(), written into directly (typically via the dst= argument of OpenCV functions), and
+        then handed back via release() once no longer needed, e.g. when a frame is deleted.
+        The pool must only be given arrays which are no longer referenced anywhere else, as they will be over-written.
+        ImagePool.setup() is optional - until it is called, get() simply allocates and release() does nothing.
+        ImagePool has no project-specific dependencies.
+    """
+
+    #
+    # ##### CLASS ATTRIBUTES
+    #
+    _is_setup = False
+    _max_per_shape = 0
+    _pool = {}
+    _lock = threading.Lock()
+
+    #
+    # ##### SETUP METHODS
+    #
+    @staticmethod
+    def setup(max_per_shape):
+        """ Enables the pool - typically this would be at the top of the main file.
+            :param max_per_shape: Maximum number of spare arrays held for each shape, to cap the memory held by the pool
+        """
+        ImagePool._max_per_shape = max_per_shape
+        ImagePool._is_setup = True
+
+    #
+    # ##### PUBLIC METHODS
+    #
+    @staticmethod
+    def get(shape, dtype=numpy.uint8):
+        """ Returns an array of the requested shape and type - note that its contents are undefined, not zeros.
+            :param shape: A tuple, in numpy (y, x) or (y, x, channels) format.
+            :param dtype: The numpy dtype of the array.
+            :return: Returns a numpy array, either recycled from the pool or newly allocated.
+        """
+        key = (tuple(shape), numpy.dtype(dtype).str)
+        with ImagePool._lock:
+            if ImagePool._pool.get(key):
+                return ImagePool._pool[key].pop()
+        return numpy.empty(shape, dtype)
+
+    @staticmethod
+    def release(img):
+        """ Hands an array back to the pool for re-use.  Views of other arrays (and None) are ignored.
+            :param img: A numpy array which is no longer referenced anywhere else.
+        """
+        if not ImagePool._is_setup or img is None or img.base is not None:
+            return
+        key = (img.shape, img.dtype.str)
+        with ImagePool._lock:
+            spare = ImagePool._pool.setdefault(key, [])
+            if len(spare) < ImagePool._max_per_shape:
+                spare.append(img)
+
+    @staticmethod
+    def clear():
+        """ Empties the pool, so that any spare arrays can be freed. """
+        with ImagePool._lock:
+            ImagePool._pool.clear()
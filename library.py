@@ -2,7 +2,7 @@ import os
 import errno
 from datetime import datetime
 import file_handling
-from kd_log import Log
+from activity_log import ActivityLog
 import re
 
 
@@ -118,7 +118,7 @@ class Library:
     def do_cleanup(self, min_gb_to_remove, min_remaining_gb, gb_free_space):
 
         gb_to_remove = max(min_gb_to_remove, min_remaining_gb-gb_free_space)
-        Log.add_entry('activity_log', 'Removing %.2fGB of files!' % gb_to_remove)
+        ActivityLog.add_entry('Removing %.2fGB of files!' % gb_to_remove)
 
         self.library[self.cleanup_folder].sort(key=lambda k: k['file_age'])
         total_size_removed = 0
@@ -135,7 +135,7 @@ class Library:
                 os.remove(file_to_delete['fullpath'])
             except OSError:
                 print('ERROR CANNOT REMOVE FILE - CHECK REASON, MAYBE PERMISSIONS??')
-                Log.add_entry('activity_log', 'ERROR - Cannot remove file (OSError).')
+                ActivityLog.add_entry('ERROR - Cannot remove file (OSError).')
             self.deleted_files.append(file_to_delete)
 
             # Try removing the folder - this will only work if the folder is empty (used for cleaning up), else ignored
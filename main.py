@@ -8,12 +8,26 @@ from clip import Clip
 from frame import Frame
 from subject import Subject
 from library import Library
+from image_pool import ImagePool
+from camera import CameraProfiles
+from pending_queue import PendingQueue
+from thread_budget import ThreadBudget
+from audit_archive import AuditArchive, AuditWriter
+from checkpoint import ClipCheckpoint
+from content_index import ContentIndex
+from disk_usage import IngestRateModel
+import video_archive
+from gallery import Gallery, GalleryBuilder
+from video_archive import VideoArchiveIndex, TieredStorage
+from distributed import LeaseManager, SharedClipData, LeaseHeartbeat
 from kd_log import Log, LogThread
+from activity_log import ActivityLog, ActivityLogThread
 from settings import Settings
 from kd_app_thread import AppThread
 import plugins
 import traceback
 import os
+from datetime import timedelta
 
 
 #
@@ -26,34 +40,72 @@ settings = Settings(os.path.join(os.path.dirname(__file__), 'settings_%s.json' %
 Clip.setup(time_increment=1000,
            annotate_line_colour=(0, 255, 255),
            mp4box_path=(settings.get['processing']['mp4box_path'] if settings.get['processing']['mp4box_path'] else None),
-           video_fullpath_fixed=settings.get['processing']['fixed_fullpath'])
+           fixed_folder=settings.get['processing']['fixed_folder'],
+           frame_cache=settings.get['processing']['frame_cache'],
+           frame_cache_greyblur=settings.get['processing']['frame_cache_greyblur'],
+           greyscale_night=settings.get['processing']['greyscale_night'],
+           parallel_decode_workers=settings.get['processing']['parallel_decode_workers'],
+           parallel_decode_chunk_secs=settings.get['processing']['parallel_decode_chunk_secs'])
 
 main_threads = {}
 main_abort = False
+# When sharing video_pending between several nodes, these are set up in main()
+lease_manager = None
+shared_clip_data = None
+# Names of any live streams currently being processed - see process_stream()
+streams_running = set()
+# Set by Cleanup while disk space is critical, pausing all processing - assume critical until it has first checked
+disk_space_critical = True
+# If enabled, set up in main() - to re-use results for videos with the same content as one already processed
+content_index = None
+
+# Settings which can differ between cameras - the top-level masks and trigger_zones are the default for every camera,
+#  with any camera-specific overrides keyed on the camera's filename prefix
+CameraProfiles.setup(default_profile={'source_size_x': 3072,
+                                      'source_size_y': 1728,
+                                      'masks': settings.get['masks'],
+                                      'trigger_zones': settings.get['trigger_zones']},
+                     camera_profiles=settings.get['cameras'])
+default_camera_profile = CameraProfiles.get(None)
 
 Frame.setup(blur_pixel_width=7,
             absolute_intensity_threshold=40,
             morph_radius=15,
             subject_size_threshold=1500,
-            source_size_x=3072,
-            source_size_y=1728,
+            source_size_x=default_camera_profile['source_size_x'],
+            source_size_y=default_camera_profile['source_size_y'],
             large_size_x=1024,
             medium_size_x=640,
-            small_size_x=160)
+            small_size_x=160,
+            morph_scale=settings.get['processing']['morph_scale'])
 Subject.setup(bounds_padding=10,
               annotate_line_colour=(0, 255, 255),
               absolute_intensity_threshold=40,
               min_difference_area_percent=0.05,
               min_difference_area_pixels=1500,
-              dilate_pixels=25)
+              dilate_pixels=25,
+              dilate_scale=settings.get['processing']['dilate_scale'])
+ImagePool.setup(max_per_shape=settings.get['processing']['image_pool_size'])
+ThreadBudget.setup(stage_budgets=settings.get['processing']['thread_budget'],
+                   pin_stages=settings.get['processing']['pin_stages'],
+                   throttle_temp_c=settings.get['processing']['throttle_temp_c'])
+Frame.setup_audit(audit_mode=settings.get['debug']['audit_mode'],
+                  audit_every_n=settings.get['debug']['audit_every_n'])
 
 
 #
 # ##### WORK THROUGH PENDING VIDEOS
 #
+def add_clip_data(entry, wait_until_added=False):
+    """ Adds an entry to this node's clip_data log, and if sharing between nodes, to the shared store too. """
+    Log.add_entry('clip_data', entry, wait_until_added=wait_until_added)
+    if shared_clip_data is not None:
+        shared_clip_data.add(entry)
+
+
 def process_video_error(clip, error_msg, video_metadata, error_detail):
-    Log.add_entry('activity_log', 'ERROR - %s %s: %s'
-                  % (error_msg, video_metadata['filename_new'], error_detail))
+    ActivityLog.add_entry('ERROR - %s %s: %s'
+                          % (error_msg, video_metadata['filename_new'], error_detail))
     if settings.get['debug']['move_complete_videos']:
         video_path = file_handling.move_to_done(settings.get['folders']['video_error'],
                                                 source_fullpath=video_metadata['source_fullpath'],
@@ -67,12 +119,8 @@ def process_video_error(clip, error_msg, video_metadata, error_detail):
     else:
         video_path = video_metadata['source_fullpath']
 
-    # In all cases, remove any fixed versions of the video if they were created
-    file_handling.remove_fixed_video(settings.get['processing']['fixed_fullpath'])
-
     kd_timers.clear_timer('vid')
-    Log.add_entry('clip_data',
-                  {'basename': video_metadata['basename_new'],
+    add_clip_data({'basename': video_metadata['basename_new'],
                    'video': video_path,
                    'status': 'ERROR - %s' % error_msg,
                    'timestamp': kd_timers.timestamp()
@@ -82,9 +130,163 @@ def process_video_error(clip, error_msg, video_metadata, error_detail):
         for thread_name in sorted(list(clip.threads), reverse=True):
             clip.threads[thread_name].stop(wait_until_stopped=True)
         print('Stopped all sub-threads within video processing!')
+        # Remove any fixed version of the video if it was created (Clip removes its own if it fails to initialise)
+        clip.remove_fixed_video()
         del clip
 
 
+def move_video_to_done(video_metadata, segments):
+    """ Moves a successfully processed video to the 'done' folder (if enabled), removing anything else with the same
+        basename from video_pending - e.g. a frame cache or checkpoint.  Depending on the archive settings, the video
+        may instead be trimmed to just its segments - or if it has none, not kept, or marked 'to_transcode' so that
+        TieredStorage re-encodes it to a smaller size straight away (rather than delaying the pending queue here).
+        :param segments: A list of the clip's segments, as in clip_data - i.e. each with time_begin and time_end.
+        :return: Returns a tuple (video_path, archived) - video_path is wherever the video now is (or None if it wasn't
+                 kept), and archived is one of 'full', 'trimmed', 'to_transcode' or 'dropped'.
+    """
+    if not settings.get['debug']['move_complete_videos']:
+        return video_metadata['source_fullpath'], 'full'
+
+    archive = settings.get['archive']
+    video_path = os.path.join(settings.get['folders']['video_done'], video_metadata['file_date'],
+                              video_metadata['filename_new'])
+    os.makedirs(os.path.dirname(video_path), exist_ok=True)
+    if (segments and archive['mode'] == 'trim'
+            and video_archive.trim_video_to_segments(video_metadata['source_fullpath'], video_path, segments,
+                                                     padding_secs=archive['padding_secs'],
+                                                     ffmpeg_path=archive['ffmpeg_path'])):
+        archived = 'trimmed'
+    elif not segments and archive['no_segments'] == 'drop':
+        video_path, archived = None, 'dropped'
+    else:
+        # Keep the whole video - also used if trimming fails.  Transcoding is left to TieredStorage, at idle priority.
+        video_path = file_handling.move_to_done(settings.get['folders']['video_done'],
+                                                source_fullpath=video_metadata['source_fullpath'],
+                                                file_date=video_metadata['file_date'],
+                                                filename_new=video_metadata['filename_new'])
+        archived = 'to_transcode' if not segments and archive['no_segments'] == 'transcode' else 'full'
+
+    # Unless it was moved, this also removes the original video
+    file_handling.remove_with_basename(settings.get['folders']['video_pending'],
+                                       video_metadata['sub_folder'],
+                                       video_metadata['basename_original'])
+    file_handling.remove_empty_folder(settings.get['folders']['video_pending'],
+                                      video_metadata['sub_folder'])
+    return video_path, archived
+
+
+def index_video_results(content_hash, video_metadata, clip_data_entry, output_paths):
+    """ Records the results of processing a video in the content_index, so they can be re-used for any duplicate.
+        Outputs are stored relative to their images folder, so can be re-linked for a different basename and date.
+    """
+    composites = []
+    for output_path in output_paths:
+        for folder in ['images_output', 'images_debug']:
+            relative_path = os.path.relpath(output_path, settings.get['folders'][folder])
+            if not relative_path.startswith(os.pardir):
+                composites.append({'folder': folder, 'path': relative_path})
+                break
+    content_index.add(content_hash, {'file_date': video_metadata['file_date'],
+                                     'clip_data': clip_data_entry,
+                                     'composites': composites})
+
+
+def process_duplicate_video(video_metadata, previous):
+    """ Re-uses the results of a previously processed video with identical content, instead of processing it again -
+        linking each of its composites under the new basename and date, and adding a copy of its clip_data entry.
+        :param previous: The entry from content_index for the earlier video.
+        :return: Returns True if successful, or False if the earlier results no longer exist (e.g. removed by Cleanup).
+    """
+    previous_basename = previous['clip_data']['basename']
+    links = []
+    for composite in previous['composites']:
+        source_fullpath = os.path.join(settings.get['folders'][composite['folder']], composite['path'])
+        if not os.path.isfile(source_fullpath):
+            return False
+        sub_folders, filename = os.path.split(composite['path'])
+        sub_folders = sub_folders.split(os.sep)
+        if sub_folders[0] == previous['file_date']:
+            sub_folders[0] = video_metadata['file_date']
+        if filename.startswith(previous_basename):
+            filename = video_metadata['basename_new'] + filename[len(previous_basename):]
+        dest_fullpath = os.path.join(settings.get['folders'][composite['folder']], *sub_folders, filename)
+        if dest_fullpath != source_fullpath and not os.path.exists(dest_fullpath):
+            links.append((source_fullpath, dest_fullpath))
+
+    for source_fullpath, dest_fullpath in links:
+        file_handling.link_or_copy(source_fullpath, dest_fullpath)
+    video_path, archived = move_video_to_done(video_metadata, previous['clip_data'].get('segments', []))
+    kd_timers.clear_timer('vid')
+    ActivityLog.add_entry('Skipped processing %s, as identical to %s'
+                          % (video_metadata['basename_new'], previous_basename))
+    add_clip_data(dict(previous['clip_data'],
+                       basename=video_metadata['basename_new'],
+                       video=video_path,
+                       archived=archived,
+                       camera=video_metadata['camera'],
+                       duplicate_of=previous_basename,
+                       timestamp=kd_timers.timestamp()),
+                  wait_until_added=True)
+    Log.update_aggregate_log('daily_stats')
+    return True
+
+
+def start_clip_threads(clip, camera_profile, basename, file_date, frames_required_for, audit_archive_fullpath=None,
+                       checkpoint=None, output_paths=None):
+    """ Starts every thread needed to process a clip - from getting frames, through to saving the outputs.
+        :param camera_profile: The CameraProfiles profile for the camera the clip is from.
+        :param basename: Basename for all outputs - for a stream, each segment's outputs add their own start time.
+        :param file_date: Date sub-folder for outputs.
+        :param frames_required_for: A list of requirements for each frame, as passed to the Clip.
+        :param audit_archive_fullpath: Optionally, a path to save any captured audit data (see Frame.setup_audit).
+        :param checkpoint: Optionally, a ClipCheckpoint to record each segment once output, so it can be resumed.
+        :param output_paths: Optionally, a list to which the path of every composite is added, once saved.
+    """
+    # Start thread which gets all frames, up to a maximum number - breaks at end of clip
+    clip.threads['1_frame_getter'] = Clip.FrameGetter(clip=clip,
+                                                      max_mem_usage_mb=settings.get['processing']['max_mem_usage_mb'],
+                                                      required_for=frames_required_for)
+
+    # Setup the Clip's exclude_mask, adding to the mask in the appropriate format
+    clip.setup_exclude_mask(mask_exclusions=camera_profile['masks'])
+
+    # Audit data is saved by its own thread, rather than kept in memory - named to sort before CreateSegments, so that
+    #  when threads are stopped (in reverse order) it is stopped after CreateSegments, which adds to its queue
+    if audit_archive_fullpath is not None:
+        clip.audit_archive = AuditArchive(audit_archive_fullpath)
+        clip.threads['1b_audit_writer'] = AuditWriter(clip=clip)
+
+    # Start a second thread which works through the frames and creates segments, inc getting activity in frames
+    clip.threads['2_create_segments'] = Clip.CreateSegments(clip=clip,
+                                                            max_mem_usage_mb=
+                                                            settings.get['processing']['max_mem_usage_mb'],
+                                                            required_for=['OUTPUT', 'COMPOSITE', 'TRIGGER_ZONE'],
+                                                            frames_required_for=['COMPOSITE', 'TRIGGER_ZONE'])
+
+    # Use a third thread to create composites, itself using a pool of workers to render segments concurrently
+    clip.threads['3_create_composites'] = Clip.CreateComposites(clip=clip,
+                                                                max_workers=ThreadBudget.get('composite'))
+
+    # Another thread to check for trigger zone activity
+    clip.threads['4_trigger_zones'] = plugins.TriggerZones(clip=clip,
+                                                           trigger_zones=camera_profile['trigger_zones'])
+
+    # Add annotation of trigger zones
+    helper.annotate_contour(annotate_img=clip.base_frame.get_img('annotated'),
+                            contour_points_dict=camera_profile['trigger_zones'])
+
+    clip.threads['5_output_frames'] = OutputFrames(clip=clip,
+                                                   basename=basename,
+                                                   file_date=file_date)
+    # helper.sleep(20)
+    clip.threads['6_output_segments'] = OutputSegments(clip=clip,
+                                                       basename=basename,
+                                                       file_date=file_date,
+                                                       pre_requisites=['COMPOSITE', 'TRIGGER_ZONE'],
+                                                       checkpoint=checkpoint,
+                                                       output_paths=output_paths)
+
+
 def process_video(video_filename):
 
     kd_timers.start_timer('vid')
@@ -101,16 +303,66 @@ def process_video(video_filename):
         kd_timers.clear_timer('vid')
         return False
 
-    Log.add_entry('activity_log', 'Processing %s...' % video_metadata['basename_new'])
+    # Also skip if another node has already processed this video
+    if shared_clip_data is not None and shared_clip_data.contains(video_metadata['basename_new']):
+        kd_timers.clear_timer('vid')
+        return False
 
+    # If a video with identical content has already been processed (e.g. re-uploaded under a new name), re-use the
+    #  results of that rather than decoding and processing it all over again
+    content_hash = None
+    if content_index is not None:
+        content_hash = content_index.content_hash(video_metadata['source_fullpath'])
+        previous = content_index.get(content_hash)
+        if previous is not None and process_duplicate_video(video_metadata, previous):
+            return True
+
+    ActivityLog.add_entry('Processing %s...' % video_metadata['basename_new'])
+
+    # Cameras may differ in resolution, so re-size every Frame image type if this camera differs from the last clip
+    camera_profile = CameraProfiles.get(video_metadata['camera'])
+    if Frame.dimensions.source != (camera_profile['source_size_x'], camera_profile['source_size_y']):
+        # Frame dimensions are shared by every Clip, so can't be changed while a live stream is being processed
+        if streams_running:
+            ActivityLog.add_entry('Waiting for streams to stop before processing %s, as it is a different size'
+                                  % video_metadata['basename_new'])
+            kd_timers.clear_timer('vid')
+            return False
+        Frame.setup_dimensions(source_size_x=camera_profile['source_size_x'],
+                               source_size_y=camera_profile['source_size_y'],
+                               large_size_x=Frame.dimensions.large[0],
+                               medium_size_x=Frame.dimensions.medium[0],
+                               small_size_x=Frame.dimensions.small[0])
+        # Any spare images in the pool are now the wrong size, so free them rather than hold onto them
+        ImagePool.clear()
+
+    # If this clip was interrupted part way through (e.g. by a crash), resume after the last segment that was output
+    checkpoint = ClipCheckpoint(video_metadata['source_fullpath'])
+    resume_segments = checkpoint.load(video_metadata['basename_new'])
     base_time = 0
+    time_increment = -1
+    if resume_segments:
+        base_time = resume_segments[-1]['end_time']
+        time_increment = checkpoint.time_increment
+        ActivityLog.add_entry('Resuming %s from %ds, after %d segments'
+                              % (video_metadata['basename_new'], base_time / 1000, len(resume_segments)))
 
     frames_required_for = ['SEGMENT', 'OUTPUT']
 
     # Initialise the Clip and get the first frame
     try:
-        clip = Clip(video_fullpath=video_metadata['source_fullpath'], base_frame_time=base_time,
-                    frames_required_for=frames_required_for)
+        try:
+            clip = Clip(video_fullpath=video_metadata['source_fullpath'], base_frame_time=base_time,
+                        frames_required_for=frames_required_for, time_increment=time_increment)
+        except EOFError:
+            if not resume_segments:
+                raise
+            # The last segment output may have run to the very end of the video - so just start again from the beginning
+            checkpoint.remove()
+            checkpoint = ClipCheckpoint(video_metadata['source_fullpath'])
+            resume_segments = []
+            clip = Clip(video_fullpath=video_metadata['source_fullpath'], base_frame_time=0,
+                        frames_required_for=frames_required_for)
     except EOFError:
         # Handle errors if the video file can't be opened, or is corrupt, zero size, etc
         process_video_error(None, 'Unable to process', video_metadata, 'Failed to Initialise!')
@@ -120,41 +372,23 @@ def process_video(video_filename):
         # PRIMARY VIDEO PROCESSING CODE
         #
 
-        # Start thread which gets all frames, up to a maximum number - breaks at end of clip
-        clip.threads['1_frame_getter'] = Clip.FrameGetter(clip=clip,
-                                                          max_mem_usage_mb=
-                                                          settings.get['processing']['max_mem_usage_mb'],
-                                                          required_for=frames_required_for)
-
-        # Setup the Clip's exclude_mask, adding to the mask in the appropriate format
-        clip.setup_exclude_mask(mask_exclusions=settings.get['masks'])
-
-        # Start a second thread which works through the frames and creates segments, inc getting activity in frames
-        clip.threads['2_create_segments'] = Clip.CreateSegments(clip=clip,
-                                                                max_mem_usage_mb=
-                                                                settings.get['processing']['max_mem_usage_mb'],
-                                                                required_for=['OUTPUT', 'COMPOSITE', 'TRIGGER_ZONE'],
-                                                                frames_required_for=['COMPOSITE', 'TRIGGER_ZONE'])
-
-        # Use a third thread to create composites
-        clip.threads['3_create_composites'] = Clip.CreateComposites(clip=clip)
-
-        # Another thread to check for trigger zone activity
-        clip.threads['4_trigger_zones'] = plugins.TriggerZones(clip=clip,
-                                                               trigger_zones=settings.get['trigger_zones'])
-
-        # Add annotation of trigger zones
-        helper.annotate_contour(annotate_img=clip.base_frame.get_img('annotated'),
-                                contour_points_dict=settings.get['trigger_zones'])
-
-        clip.threads['5_output_frames'] = OutputFrames(clip=clip,
-                                                       basename=video_metadata['basename_new'],
-                                                       file_date=video_metadata['file_date'])
-        # helper.sleep(20)
-        clip.threads['6_output_segments'] = OutputSegments(clip=clip,
-                                                           basename=video_metadata['basename_new'],
-                                                           file_date=video_metadata['file_date'],
-                                                           pre_requisites=['COMPOSITE', 'TRIGGER_ZONE'])
+        # If capturing audit data, save it to a per-clip archive in a separate thread, rather than keeping it in memory
+        audit_archive_fullpath = None
+        if settings.get['debug']['audit_mode'] != 'off':
+            audit_archive_fullpath = os.path.join(settings.get['folders']['images_debug'],
+                                                  video_metadata['file_date'],
+                                                  '%s-Audit.npz' % video_metadata['basename_new'])
+
+        clip.restore_segments(resume_segments)
+        output_paths = []
+        start_clip_threads(clip=clip,
+                           camera_profile=camera_profile,
+                           basename=video_metadata['basename_new'],
+                           file_date=video_metadata['file_date'],
+                           frames_required_for=frames_required_for,
+                           audit_archive_fullpath=audit_archive_fullpath,
+                           checkpoint=checkpoint,
+                           output_paths=output_paths)
 
         #
         # END OF PRIMARY VIDEO PROCESSING CODE
@@ -168,7 +402,7 @@ def process_video(video_filename):
             running_threads = ''
 
             if main_abort:
-                process_video_error(None, 'Main Thread Abort!', video_metadata, 'Abort Triggered from Main Thread!')
+                process_video_error(clip, 'Main Thread Abort!', video_metadata, 'Abort Triggered from Main Thread!')
                 return False
 
             # Check status of each running thread
@@ -180,39 +414,20 @@ def process_video(video_filename):
                             running_threads += ', '
                         running_threads += thread_name
                 except BaseException as exc:
-                    Log.add_entry('activity_log', 'ERROR - %s' % traceback.format_exc())
+                    ActivityLog.add_entry('ERROR - %s' % traceback.format_exc())
                     process_video_error(clip, 'Exception in %s' % thread_name, video_metadata, repr(exc))
                     return False
 
             if any_running_threads:
                 if kd_timers.secs_elapsed_since_last(180, 'process_video_watchdog'):
-                    Log.add_entry('activity_log', 'Still processing in: %s' % running_threads)
+                    ActivityLog.add_entry('Still processing in: %s' % running_threads)
                 if kd_timers.secs_elapsed_since_last(720, 'process_video_watchdog_timeout'):
-                    Log.add_entry('activity_log', 'Still processing after 12mins in: %s - stopping!' % running_threads)
-                    process_video_error(None, 'Process Video Timeout', video_metadata, 'Timed out after 12mins!')
+                    ActivityLog.add_entry('Still processing after 12mins in: %s - stopping!' % running_threads)
+                    process_video_error(clip, 'Process Video Timeout', video_metadata, 'Timed out after 12mins!')
+                    return False
             else:
                 break
 
-        # Tidy up videos / move to the 'done' folder
-        if settings.get['debug']['move_complete_videos']:
-            video_path = file_handling.move_to_done(settings.get['folders']['video_done'],
-                                                    source_fullpath=video_metadata['source_fullpath'],
-                                                    file_date=video_metadata['file_date'],
-                                                    filename_new=video_metadata['filename_new'])
-            file_handling.remove_with_basename(settings.get['folders']['video_pending'],
-                                               video_metadata['sub_folder'],
-                                               video_metadata['basename_original'])
-            file_handling.remove_empty_folder(settings.get['folders']['video_pending'],
-                                              video_metadata['sub_folder'])
-        else:
-            video_path = video_metadata['source_fullpath']
-
-        # In all cases, remove any fixed versions of the video if they were created
-        file_handling.remove_fixed_video(settings.get['processing']['fixed_fullpath'])
-
-        Log.add_entry('activity_log', 'Video Total Time: %s' % kd_timers.end_timer('vid'))
-
-        # Add details to log file
         log_segments = []
         for segment in clip.segments:
             log_segments.append({'index': chr(65+segment.index),
@@ -220,15 +435,32 @@ def process_video(video_filename):
                                  'time_end': segment.end_time,
                                  'trigger_zones': segment.trigger_zones})
 
-        Log.add_entry('clip_data',
-                      {'basename': video_metadata['basename_new'],
-                       'video': video_path,
-                       'is_night': clip.is_night(),
-                       'clip_length': '%ds' % clip.video_duration_secs,
-                       'segments': log_segments,
-                       'timestamp': kd_timers.timestamp()
-                       },
-                      wait_until_added=True)
+        # Tidy up videos / move to the 'done' folder - first releasing the video, so it can be trimmed if needed
+        clip.remove_fixed_video()
+        video_path, archived = move_video_to_done(video_metadata, log_segments)
+
+        # The clip is complete, so its checkpoint is no longer needed
+        checkpoint.remove()
+
+        video_total_time = kd_timers.end_timer('vid')
+        ActivityLog.add_entry('Video Total Time: %s' % video_total_time,
+                              counters={'processing_secs': float(video_total_time.rstrip('s'))})
+
+        # Add details to log file
+        clip_data_entry = {'basename': video_metadata['basename_new'],
+                           'video': video_path,
+                           'archived': archived,
+                           'camera': video_metadata['camera'],
+                           'is_night': clip.is_night(),
+                           'clip_length': '%ds' % clip.video_duration_secs,
+                           'segments': log_segments,
+                           'timestamp': kd_timers.timestamp()
+                           }
+        add_clip_data(clip_data_entry, wait_until_added=True)
+
+        # Outputs from before a resume aren't known, so only index clips which were processed in one go
+        if content_index is not None and not resume_segments:
+            index_video_results(content_hash, video_metadata, clip_data_entry, output_paths)
 
         Log.update_aggregate_log('daily_stats')
 
@@ -243,12 +475,22 @@ class VideoProcessing(AppThread):
 
     def threaded_function(self, max_videos):
         num_processed = 0
+        # Process videos in priority order, rather than strictly oldest first - sharing fairly between cameras
+        pending_queue = PendingQueue(options=settings.get['queue'],
+                                     state_fullpath=settings.get['files']['queue_state'])
         while True:
 
             if self.should_abort():
                 return
 
-            pending_videos = file_handling.get_pending_video_list(settings.get['folders']['video_pending'])
+            # Don't add anything more to the disk while Cleanup frees space
+            if disk_space_critical:
+                kd_timers.sleep(secs=5)
+                continue
+
+            pending_videos = pending_queue.order(
+                file_handling.get_pending_video_list(settings.get['folders']['video_pending']),
+                settings.get['folders']['video_pending'])
             if len(pending_videos) >= 1:
                 process_video_success = False
                 while not process_video_success and len(pending_videos) >= 1:
@@ -256,11 +498,25 @@ class VideoProcessing(AppThread):
                     if self.should_abort():
                         return
 
-                    process_video_success = process_video(pending_videos.pop(0))
+                    video_filename = pending_videos.pop(0)
+                    # If sharing video_pending with other nodes, only process videos which this node has claimed - and
+                    #  which are still pending, as another node may have completed it since pending_videos was listed
+                    if lease_manager is not None:
+                        if not lease_manager.claim(video_filename):
+                            continue
+                        if not os.path.isfile(os.path.join(settings.get['folders']['video_pending'], video_filename)):
+                            lease_manager.release(video_filename)
+                            continue
+                    try:
+                        process_video_success = process_video(video_filename)
+                    finally:
+                        if lease_manager is not None:
+                            lease_manager.release(video_filename)
                     if process_video_success:
+                        pending_queue.mark_served(video_filename)
                         num_processed += 1
                         if num_processed >= max_videos != -1:
-                            Log.add_entry('activity_log', 'Max number of videos threshold reached - stopping!')
+                            ActivityLog.add_entry('Max number of videos threshold reached - stopping!')
                         break
                 else:
                     kd_timers.sleep(secs=5)
@@ -268,12 +524,112 @@ class VideoProcessing(AppThread):
                 kd_timers.sleep(secs=5)
 
 
+#
+# ##### WORK THROUGH LIVE STREAMS
+#
+def process_stream(stream, should_abort):
+    """ Processes a live stream until it ends (or should_abort), outputting each segment as soon as it closes - rather
+        than waiting for a complete video file to be uploaded, and then unmodified for a while, before processing.
+        To test without a camera, replay a video file as a stream with ffmpeg, and set the stream url to match:
+            ffmpeg -re -i test.mp4 -f mpegts udp://127.0.0.1:5000
+        Or just set the url to the video file itself, with replay_realtime set to true.
+        :param stream: A dict from the streams settings - name (also used as its camera prefix), url and replay_realtime
+        :param should_abort: A function returning True when processing should stop, e.g. from the calling thread.
+        :return: Returns True if the stream was processed until it ended, or False if it failed or was aborted.
+    """
+    # Frame dimensions are shared by every Clip, including any videos being processed at the same time - so streams
+    #  must be the same size as the default camera profile
+    camera_profile = CameraProfiles.get(stream['name'])
+    if ((camera_profile['source_size_x'], camera_profile['source_size_y'])
+            != (default_camera_profile['source_size_x'], default_camera_profile['source_size_y'])):
+        ActivityLog.add_entry('ERROR - Stream %s must be the same size as the default camera profile'
+                              % stream['name'])
+        return False
+
+    frames_required_for = ['SEGMENT', 'OUTPUT']
+    try:
+        clip = Clip(video_fullpath=stream['url'], base_frame_time=0, frames_required_for=frames_required_for,
+                    stream=True, stream_realtime=stream['replay_realtime'])
+    except EOFError:
+        ActivityLog.add_entry('ERROR - Unable to open stream %s: %s' % (stream['name'], stream['url']))
+        return False
+
+    ActivityLog.add_entry('Processing stream %s...' % stream['name'])
+    streams_running.add(stream['name'])
+    try:
+        start_clip_threads(clip=clip,
+                           camera_profile=camera_profile,
+                           basename=stream['name'],
+                           file_date=clip.stream_start_datetime.strftime('%Y%m%d'),
+                           frames_required_for=frames_required_for)
+
+        # Unlike a video, a stream has no expected length - so no timeout, just run until every thread has finished
+        while True:
+            kd_timers.sleep(0.05)
+
+            if main_abort or should_abort():
+                for thread_name in sorted(list(clip.threads), reverse=True):
+                    clip.threads[thread_name].stop(wait_until_stopped=True)
+                return False
+
+            any_running_threads = False
+            for thread_name in sorted(list(clip.threads)):
+                try:
+                    if clip.threads[thread_name].is_running():
+                        any_running_threads = True
+                except BaseException as exc:
+                    ActivityLog.add_entry('ERROR - %s' % traceback.format_exc())
+                    ActivityLog.add_entry('ERROR - Exception in stream %s, %s: %s'
+                                          % (stream['name'], thread_name, repr(exc)))
+                    for stop_thread_name in sorted(list(clip.threads), reverse=True):
+                        clip.threads[stop_thread_name].stop(wait_until_stopped=True)
+                    return False
+
+            if not any_running_threads:
+                break
+    finally:
+        streams_running.discard(stream['name'])
+
+    ActivityLog.add_entry('Stream %s ended' % stream['name'])
+    Log.update_aggregate_log('daily_stats')
+    del clip
+    return True
+
+
+#
+# ##### STREAM PROCESSING THREAD
+#
+class StreamProcessing(AppThread):
+
+    def threaded_function(self, stream, reconnect_secs):
+        while True:
+
+            if self.should_abort():
+                return
+
+            # Don't add anything more to the disk while Cleanup frees space
+            if disk_space_critical:
+                kd_timers.sleep(secs=5)
+                continue
+
+            process_stream(stream, self.should_abort)
+
+            # Whether the stream ended, failed, or couldn't be opened at all, wait a while before reconnecting
+            kd_timers.clear_elapsed_timer('stream_reconnect_%s' % stream['name'])
+            while not kd_timers.secs_elapsed_since_last(secs=reconnect_secs,
+                                                        timer_id='stream_reconnect_%s' % stream['name']):
+                if self.should_abort():
+                    return
+                kd_timers.sleep(secs=1)
+
+
 #
 # ##### OUTPUT THREADS
 #
 class OutputFrames(AppThread):
 
     def threaded_function(self, clip, basename, file_date):
+        ThreadBudget.pin_current_thread('output')
 
         # One-off - if needed, save an annotated image with grid-lines, masks, etc
         if settings.get['debug']['save_annotated']:
@@ -366,7 +722,8 @@ class OutputFrames(AppThread):
 
 class OutputSegments(AppThread):
 
-    def threaded_function(self, clip, basename, file_date, pre_requisites):
+    def threaded_function(self, clip, basename, file_date, pre_requisites, checkpoint=None, output_paths=None):
+        ThreadBudget.pin_current_thread('output')
 
         while True:
 
@@ -388,7 +745,15 @@ class OutputSegments(AppThread):
 
                     # print('Clip Num Segments %d' % clip.num_segments)
 
-                    if clip.num_segments == 1:
+                    segment_file_date = file_date
+                    if clip.is_stream:
+                        # A stream never ends, so name each segment as if it were a clip of its own, by its start time
+                        #  - in the same format as camera filenames, i.e. basename-YYYYMMDD-HHMM-SSmmm
+                        segment_datetime = clip.stream_start_datetime + timedelta(milliseconds=segment.start_time)
+                        segment_basename = '%s-%s%03d' % (basename, segment_datetime.strftime('%Y%m%d-%H%M-%S'),
+                                                          segment_datetime.microsecond // 1000)
+                        segment_file_date = segment_datetime.strftime('%Y%m%d')
+                    elif clip.num_segments == 1:
                         segment_basename = basename
                     else:
                         segment_basename = '%s%s' % (basename, chr(65+segment.index))
@@ -396,11 +761,15 @@ class OutputSegments(AppThread):
                     # print('Clip Seg Index %d' % segment.index)
 
                     # If this is a second segment, append A to the basename of the first
-                    if segment.index == 1:
-                        file_handling.rename_basename_append(settings.get['folders']['images_output'], file_date,
-                                                             basename, 'A', conditional_suffix='Composite')
-                        file_handling.rename_basename_append(settings.get['folders']['images_debug'], file_date,
-                                                             basename, 'A', conditional_suffix='Composite')
+                    if segment.index == 1 and not clip.is_stream:
+                        renamed = file_handling.rename_basename_append(settings.get['folders']['images_output'],
+                                                                       file_date, basename, 'A',
+                                                                       conditional_suffix='Composite')
+                        renamed.update(file_handling.rename_basename_append(settings.get['folders']['images_debug'],
+                                                                            file_date, basename, 'A',
+                                                                            conditional_suffix='Composite'))
+                        if output_paths is not None:
+                            output_paths[:] = [renamed.get(output_path, output_path) for output_path in output_paths]
 
                     # TODO: Make this more flexible / generic - move this functionality elsewhere!
                     # TODO: Should also take account of e.g. people in image, movement tracks, etc...
@@ -411,28 +780,48 @@ class OutputSegments(AppThread):
                         else:
                             group_subfolder = trigger_zone
 
+                    composite_paths = []
                     for composite in segment.composites:
 
                         # print('Style: %s' % composite['style'])
 
                         if composite['style'] in settings.get['outputs']['composite_styles']:
-                            file_handling.save_image(image=composite['composite'],
-                                                     path=settings.get['folders']['images_output'],
-                                                     basename=segment_basename,
-                                                     descriptor='Composite-%s' % composite['style'],
-                                                     date_subfolder=file_date,
-                                                     group_subfolder=group_subfolder)
+                            composite_folder = settings.get['folders']['images_output']
                         elif composite['style'] in settings.get['debug']['composite_styles']:
-                            file_handling.save_image(image=composite['composite'],
-                                                     path=settings.get['folders']['images_debug'],
-                                                     basename=segment_basename,
-                                                     descriptor='Composite-%s' % composite['style'],
-                                                     date_subfolder=file_date,
-                                                     group_subfolder=group_subfolder)
+                            composite_folder = settings.get['folders']['images_debug']
+                        else:
+                            continue
+                        composite_paths.append(file_handling.save_image(image=composite['composite'],
+                                                                        path=composite_folder,
+                                                                        basename=segment_basename,
+                                                                        descriptor='Composite-%s' % composite['style'],
+                                                                        date_subfolder=segment_file_date,
+                                                                        group_subfolder=group_subfolder))
+
+                    # Only once every composite is saved, record the segment as complete in case we need to resume
+                    if checkpoint is not None:
+                        checkpoint.add_segment(segment, clip.time_increment, composite_paths)
+                    if output_paths is not None:
+                        output_paths.extend(composite_paths)
 
                     # print('Removing Output Req')
                     segment.remove_requirement('OUTPUT')
 
+                    # Streams have no end to log the whole clip, so log each segment as soon as it's output - and then
+                    #  drop it, otherwise segments would accumulate for as long as the stream runs
+                    if clip.is_stream:
+                        add_clip_data({'basename': segment_basename,
+                                       'video': clip.stream_url,
+                                       'camera': basename,
+                                       'is_night': clip.is_night(),
+                                       'clip_length': '%ds' % ((segment.end_time - segment.start_time) / 1000),
+                                       'segments': [{'index': 'A',
+                                                     'time_begin': 0,
+                                                     'time_end': segment.end_time - segment.start_time,
+                                                     'trigger_zones': segment.trigger_zones}],
+                                       'timestamp': kd_timers.timestamp()})
+                        clip.segments.remove(segment)
+
             # print('Created All Segments: %s' % clip.created_all_segments)
             # print('Segments Req for Output: %s' % clip.segments_required(required_for='OUTPUT'))
 
@@ -460,11 +849,19 @@ class SysStatus(AppThread):
             if kd_timers.secs_elapsed_since_last(secs=every_x_secs, timer_id='mem_usage') or first_run:
                 first_run = False
                 kd_diskmemory.clear_memory()
-                Log.add_entry('activity_log', 'Sys Mem Free: %dMB, KDCam Mem Usage: %dMB, Temp: %s' %
-                              (kd_diskmemory.memory_free(), kd_diskmemory.memory_usage(), helper.get_temp_str()))
+                ActivityLog.add_entry('Sys Mem Free: %dMB, KDCam Mem Usage: %dMB, Temp: %s'
+                                      % (kd_diskmemory.memory_free(), kd_diskmemory.memory_usage(),
+                                         helper.get_temp_str()))
             else:
                 kd_timers.sleep(secs=1)
 
+            # Check the temperature far more often, so that thread budgets are reduced before the SoC throttles itself
+            if kd_timers.secs_elapsed_since_last(secs=10, timer_id='temp_check'):
+                if ThreadBudget.update_temperature(helper.get_temp_c()):
+                    ActivityLog.add_entry('Thread budgets %s, Temp: %s'
+                                          % ('throttled' if ThreadBudget.is_throttled else 'restored',
+                                             helper.get_temp_str()))
+
 
 #
 # ##### CLEANUP THREAD
@@ -472,87 +869,103 @@ class SysStatus(AppThread):
 class Cleanup(AppThread):
 
     def threaded_function(self):
+        global disk_space_critical
         first_run = True
+        disk_space = settings.get['disk_space']
+        ingest_model = IngestRateModel(smoothing=disk_space['ingest_smoothing'])
         while True:
 
             if self.should_abort():
                 return
 
-            space_critical, _ = kd_diskmemory.is_disk_space_low(settings.get['folders']['video_done'],
-                                                                settings.get['disk_space']['critical_remaining_gb'])
-            if space_critical:
-                # TODO: Remove something that's really quick to remove here!  Suggests major error, so data loss is ok!
-                pass
-
-            space_low, free_space = kd_diskmemory.is_disk_space_low(settings.get['folders']['video_done'],
-                                                                    settings.get['disk_space']['min_remaining_gb'])
-            if (kd_timers.secs_elapsed_since_last(secs=settings.get['disk_space']['check_interval_secs'],
-                                               timer_id='diskspace')
-                    or free_space < settings.get['disk_space']['critical_remaining_gb']
+            # Check free space just once each loop, and use that for everything below
+            _, free_space = kd_diskmemory.is_disk_space_low(settings.get['folders']['video_done'],
+                                                            disk_space['critical_remaining_gb'])
+            ingest_model.update(free_space)
+            space_critical = free_space < disk_space['critical_remaining_gb']
+            space_low = free_space < disk_space['min_remaining_gb']
+            if space_critical and not disk_space_critical:
+                ActivityLog.add_entry('Disk space critical - pausing processing until cleaned up...')
+            disk_space_critical = space_critical
+
+            if (kd_timers.secs_elapsed_since_last(secs=disk_space['check_interval_secs'], timer_id='diskspace')
+                    or space_critical
                     or first_run):
                 first_run = False
 
-                Log.add_entry('activity_log', 'Disk free space: %.1fGB' % free_space)
+                ActivityLog.add_entry('Disk free space: %.1fGB, ingest rate: %s'
+                                      % (free_space, 'unknown' if ingest_model.gb_per_hour is None
+                                         else '%.2fGB/hr' % ingest_model.gb_per_hour))
                 if space_low or settings.get['debug']['always_cleanup']:
-                    folder_info = [(f, settings.get['folders'][f]) for f in
-                                   ['video_done', 'images_output', 'images_debug']]
-                    Log.add_entry('activity_log', '  Building Library...')
-                    library = Library(folder_info)
-                    Log.add_entry('activity_log', '  Determining Cleanup Folder...')
-                    library.determine_cleanup_folder(settings.get['disk_space']['target_ratios'])
-                    Log.add_entry('activity_log', '  Getting File Ages...')
-                    library.get_file_ages()
-                    Log.add_entry('activity_log', '  Modifying File Ages...')
-                    library.modify_ages(Log.get_entire_log('clip_data'))
-
-                    Log.add_entry('activity_log', '  Removing Files...')
-                    library.do_cleanup(min_gb_to_remove=settings.get['disk_space']['min_gb_to_remove'],
-                                       min_remaining_gb=settings.get['disk_space']['min_remaining_gb'],
-                                       gb_free_space=free_space)
-                    for file in library.deleted_files:
-                        Log.add_entry('activity_log',
-                                      '  Deleted file (%s): %s' % (library.cleanup_folder, file['basename']))
-                    for folder in library.deleted_folders:
-                        Log.add_entry('activity_log', '  Deleted folder (%s): %s' % (library.cleanup_folder, folder))
-
-                    Log.add_entry('activity_log', '  Cleaning Up Log Entries...')
-                    basenames_set, basenames_list = library.basenames_setlist()
-                    # Note that by using basenames_set, we will always delete anything from Log that doesn't match
-                    # the standard filename format!  But could expand regex in Library to return more valid basenames...
-                    deleted_log_entries = Log.cleanup_log('clip_data', basenames_set, 'basename')
-                    for entry in deleted_log_entries:
-                        Log.add_entry('activity_log', '  Deleted log entry: %s' % entry)
-
-                    Log.add_entry('activity_log', '  Cleanup Complete!')
-
-                Log.cleanup_log_by_date('activity_log', num_days_to_keep=7)
+                    ingest_model.record_freed(self._cleanup(min_gb_to_remove=disk_space['min_gb_to_remove'],
+                                                            min_remaining_gb=disk_space['min_remaining_gb'],
+                                                            free_space=free_space))
+
+                ActivityLog.cleanup_by_date(num_days_to_keep=7)
+
+            # Otherwise, if free space is expected to run low soon, then free a little now while the CPU is idle - so
+            #  that it doesn't run low (and need a larger cleanup) in the middle of busy processing
+            elif (kd_timers.secs_elapsed_since_last(secs=disk_space['incremental_interval_secs'],
+                                                    timer_id='diskspace_incremental')
+                  and helper.is_cpu_idle(disk_space['idle_load_per_cpu'])):
+                shortfall_gb = (disk_space['min_remaining_gb']
+                                - ingest_model.projected_free_gb(free_space, disk_space['lookahead_hours']))
+                if shortfall_gb > 0:
+                    ActivityLog.add_entry('Disk free space expected to run low within %gh - cleaning up early'
+                                          % disk_space['lookahead_hours'])
+                    ingest_model.record_freed(self._cleanup(min_gb_to_remove=min(shortfall_gb,
+                                                                                 disk_space['incremental_batch_gb']),
+                                                            min_remaining_gb=0,
+                                                            free_space=free_space))
+
             else:
                 kd_timers.sleep(5)
 
-    def __init__(self, wait_for_critical, **kwargs):
-        super().__init__(**kwargs)
-
-        # Prevent the rest of the application from continuing if disk space is below the critical threshold
-        if wait_for_critical:
-            while True:
-
-                if self.should_abort():
-                    return
-
-                space_critical, _ = kd_diskmemory.is_disk_space_low(settings.get['folders']['video_done'],
-                                                                    settings.get['disk_space']['critical_remaining_gb'])
-                if not space_critical:
-                    break
-                else:
-                    Log.add_entry('activity_log', 'Disk space critical on startup - waiting for cleanup...')
-                    kd_timers.sleep(secs=120)
+    @staticmethod
+    def _cleanup(min_gb_to_remove, min_remaining_gb, free_space):
+        """ PRIVATE: Removes the oldest (or least valuable) files from whichever folder is most over its target ratio.
+            :param min_gb_to_remove: Minimum amount to remove, in GB.
+            :param min_remaining_gb: If more than min_gb_to_remove, removes enough to leave this much free, in GB.
+            :param free_space: Current free space, in GB.
+            :return: Returns the amount of space freed, in GB.
+        """
+        folder_info = [(f, settings.get['folders'][f]) for f in
+                       ['video_done', 'images_output', 'images_debug']]
+        ActivityLog.add_entry('  Building Library...')
+        library = Library(folder_info)
+        ActivityLog.add_entry('  Determining Cleanup Folder...')
+        library.determine_cleanup_folder(settings.get['disk_space']['target_ratios'])
+        ActivityLog.add_entry('  Getting File Ages...')
+        library.get_file_ages()
+        ActivityLog.add_entry('  Modifying File Ages...')
+        library.modify_ages(Log.get_entire_log('clip_data'))
+
+        ActivityLog.add_entry('  Removing Files...')
+        library.do_cleanup(min_gb_to_remove=min_gb_to_remove,
+                           min_remaining_gb=min_remaining_gb,
+                           gb_free_space=free_space)
+        for file in library.deleted_files:
+            ActivityLog.add_entry('  Deleted file (%s): %s' % (library.cleanup_folder, file['basename']))
+        for folder in library.deleted_folders:
+            ActivityLog.add_entry('  Deleted folder (%s): %s' % (library.cleanup_folder, folder))
+
+        ActivityLog.add_entry('  Cleaning Up Log Entries...')
+        basenames_set, basenames_list = library.basenames_setlist()
+        # Note that by using basenames_set, we will always delete anything from Log that doesn't match
+        # the standard filename format!  But could expand regex in Library to return more valid basenames...
+        deleted_log_entries = Log.cleanup_log('clip_data', basenames_set, 'basename')
+        for entry in deleted_log_entries:
+            ActivityLog.add_entry('  Deleted log entry: %s' % entry)
+
+        ActivityLog.add_entry('  Cleanup Complete!')
+        return sum(file['filesize'] for file in library.deleted_files) / (1024 * 1024 * 1024)
 
 
 #
 # ##### MAIN PROGRAM LOOP
 #
 def main():
-    global main_threads
+    global main_threads, lease_manager, shared_clip_data, content_index
     #
 
     # Start service to keep the lock_file continually updated
@@ -560,7 +973,7 @@ def main():
 
     # Generate Log in separate thread
     Log('clip_data', settings.get['files']['clip_data'], simple=False)
-    Log('activity_log', settings.get['files']['activity_log'], simple=True, print_also=True)
+    ActivityLog.setup(settings.get['files']['activity_log'], print_also=True)
     Log.define_aggregate('daily_stats', settings.get['files']['daily_stats'],
                          [
                              {'name': 'num_clips_all', 'source': 'clip_data',
@@ -588,19 +1001,61 @@ def main():
                              {'name': 'num_segments_night', 'source': 'clip_data',
                               'function': lambda log_data: sum([len(d.get('segments', [])) for d in log_data
                                                                 if d.get('is_night')])},
-                             {'name': 'num_app_restarts', 'source': 'activity_log',
-                              'function': lambda log_data: len([d for d in log_data
-                                                                if d[29:] == '*** Started KDCam Application! ***'])},
-                             {'name': 'total_processing_time', 'source': 'activity_log',
-                              'function': lambda log_data: kd_timers.secs_to_hhmmss(sum([float(d[47:-1]) for d in log_data
-                                                                                 if d[29:46] == 'Video Total Time:']))}
+                             # The activity log isn't held by Log, so these read its running counters instead - every
+                             #  aggregate needs a source, but log_data from it is ignored
+                             {'name': 'num_app_restarts', 'source': 'clip_data',
+                              'function': lambda log_data: ActivityLog.get_counter('app_restarts')},
+                             {'name': 'total_processing_time', 'source': 'clip_data',
+                              'function': lambda log_data: kd_timers.secs_to_hhmmss(
+                                  ActivityLog.get_counter('processing_secs'))}
                          ])
 
     # Startup other threads: for logging, disk cleanup, and regularly logging system status
     main_threads['1_log'] = LogThread()
-    Log.add_entry('activity_log', '*** Started KDCam Application! ***')
-    main_threads['2_cleanup'] = Cleanup(wait_for_critical=True)
+    main_threads['1a_activity_log'] = ActivityLogThread(flush_secs=5)
+    ActivityLog.add_entry('*** Started KDCam Application! ***', counters={'app_restarts': 1})
+    main_threads['2_cleanup'] = Cleanup()
+    # Optionally, transcode older videos to a smaller size, so more history can be kept before Cleanup deletes them -
+    #  also needed to transcode videos without segments, if archived that way, even if older videos aren't transcoded
+    if settings.get['tiered_storage']['enabled'] or settings.get['archive']['no_segments'] == 'transcode':
+        tiered_storage_options = dict(settings.get['tiered_storage'])
+        if not tiered_storage_options['enabled']:
+            tiered_storage_options['transcode_after_hours'] = None
+        main_threads['2a_tiered_storage'] = TieredStorage(
+            video_folder=settings.get['folders']['video_done'],
+            index=VideoArchiveIndex(settings.get['files']['video_archive_index']),
+            get_clip_data=lambda: Log.get_entire_log('clip_data'),
+            options=tiered_storage_options)
+    # Optionally, keep a static HTML gallery of every composite up to date
+    if settings.get['gallery']['enabled']:
+        main_threads['2b_gallery'] = GalleryBuilder(
+            gallery=Gallery(gallery_folder=settings.get['gallery']['folder'],
+                            images_folder=settings.get['folders']['images_output'],
+                            thumb_width=Frame.dimensions.small[0]),
+            get_clip_data=lambda: Log.get_entire_log('clip_data'),
+            interval_secs=settings.get['gallery']['interval_secs'])
     main_threads['3_sys_status'] = SysStatus(every_x_secs=1800)
+
+    # If sharing video_pending with other nodes, claim each video via a lease and merge results into a shared store
+    if settings.get['distributed']['enabled']:
+        node_name = settings.get['distributed']['node_name'] or helper.hostname()
+        shared_folder = (settings.get['distributed']['shared_folder'] or
+                         os.path.join(settings.get['folders']['video_pending'], '.kdcam_shared'))
+        lease_manager = LeaseManager(lease_folder=os.path.join(shared_folder, 'leases'),
+                                     node_name=node_name,
+                                     expiry_secs=settings.get['distributed']['lease_expiry_secs'])
+        shared_clip_data = SharedClipData(shared_folder=shared_folder, node_name=node_name)
+        main_threads['3a_lease_heartbeat'] = LeaseHeartbeat(lease_manager=lease_manager,
+                                                            interval_secs=settings.get['distributed']['heartbeat_secs'])
+    # Optionally, re-use results for any video with identical content to one already processed
+    if settings.get['files']['content_index']:
+        content_index = ContentIndex(settings.get['files']['content_index'])
+
+    # Each live stream is processed by its own thread, alongside any videos uploaded to video_pending
+    for stream in settings.get['streams']['sources']:
+        if stream['enabled']:
+            main_threads['3b_stream_%s' % stream['name']] = StreamProcessing(
+                stream=stream, reconnect_secs=settings.get['streams']['reconnect_secs'])
     if not settings.get['debug']['skip_videos']:
         main_threads['4_video_processing'] = VideoProcessing(max_videos=settings.get['debug']['max_videos'])
 
@@ -625,35 +1080,19 @@ def main():
                         running_threads += ', '
                     running_threads += thread_name
             except BaseException as exc:
-                Log.add_entry('activity_log', 'ERROR - %s' % traceback.format_exc())
-                Log.add_entry('activity_log', 'ERROR - Exception in %s: %s'
-                              % (thread_name, repr(exc)))
+                ActivityLog.add_entry('ERROR - %s' % traceback.format_exc())
+                ActivityLog.add_entry('ERROR - Exception in %s: %s'
+                                      % (thread_name, repr(exc)))
                 # return False
                 raise
 
         if any_running_threads:
             if kd_timers.secs_elapsed_since_last(3600, 'main_watchdog'):
-                Log.add_entry('activity_log', 'Active threads: %s' % running_threads)
+                ActivityLog.add_entry('Active threads: %s' % running_threads)
         else:
             break
 
 
-    #
-
-    # doc = dominate.document(title='ZZCam')
-    # with doc:
-    #     p('testing...')
-    #
-    # with open('test.htm', 'w') as doc_handle:
-    #     try:
-    #         doc_handle.write(doc.render())
-    #     except OSError:
-    #         # If e.g. disk full or unable to write, continue running anyway...
-    #         pass
-
-#
-
-
 #
 # ##### ENTRY POINT
 #
@@ -687,5 +1126,7 @@ if __name__ == "__main__":
         for thread_name in sorted(list(main_threads), reverse=True):
             print('Stopping ' + thread_name + '...')
             main_threads[thread_name].stop(wait_until_stopped=True)
+        # Write any activity logged whilst stopping the threads
+        ActivityLog.flush()
         print('Safely Stopped the Application!')
         sys.exit()
@@ -0,0 +1,194 @@
+import os
+import cv2
+import numpy
+import tempfile
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from numpy.lib.format import open_memmap
+from frame import Frame
+from image_pool import ImagePool
+
+
+class ParallelDecoder:
+    """ The ParallelDecoder class decodes a single clip using several processes at once, so that decoding a long clip
+        isn't limited to a single core - even when it is the only clip being processed.
+
+        The clip is split into windows of chunk_secs, each decoded by a worker process with its own VideoCapture, which
+        seeks to the start of its window and then reads sequentially - matching frames to times exactly as
+        Frame.init_from_video_sequential does.  Each worker resizes its frames to the 'large' size and writes them into
+        a .npy array in shared memory (tmpfs, i.e. /dev/shm, where available), which is memory-mapped by both the
+        worker and this process.  Frames are then handed out by get_frame() in time order, as with a FrameCache.
+        Only num_workers windows are decoded ahead at any time, so the memory used is bounded by the window size.
+        ParallelDecoder is dependent on Frame, as a project-specific dependency.
+    """
+
+    # Seeking lands on the keyframe before the requested time at best, and past it at worst - so seek this far before
+    #  the start of each window, and further back (to the start of the video if needed) if it still lands beyond it
+    _seek_margins_ms = [1000, 5000, 30000]
+
+    def __init__(self, video_fullpath, start_time, end_time, time_increment, large_shape, greyscale=False,
+                 num_workers=2, chunk_secs=10, temp_folder=None):
+        """ Create a new ParallelDecoder, and start decoding the first windows straight away.
+            :param video_fullpath: A fully qualified path to a video file (which can be loaded by cv2.VideoCapture).
+            :param start_time: The time (in milliseconds) of the first frame to decode.
+            :param end_time: The time (in milliseconds) beyond which no frames are decoded, i.e. the video duration.
+            :param time_increment: The time, in milliseconds, between subsequent frames.
+            :param large_shape: The numpy shape of each 'large' image - greyscale clips have no channel dimension.
+            :param greyscale: Boolean; if true, frames are stored as single-channel - as for Frame initialisers.
+            :param num_workers: Number of worker processes, and so the number of windows decoded at once.
+            :param chunk_secs: Length of each window, in seconds of video.
+            :param temp_folder: Folder for the shared arrays - if None, uses tmpfs or the system temp folder.
+        """
+        self._video_fullpath = video_fullpath
+        self._large_shape = tuple(large_shape)
+        self._greyscale = greyscale
+        self._num_workers = num_workers
+        self._temp_folder = temp_folder or ('/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir())
+
+        # Split every frame time into windows of (at least one) frame each, to be decoded in order
+        frames_per_window = max(int(chunk_secs * 1000 / time_increment), 1)
+        times = list(range(start_time, int(end_time) + 1, time_increment))
+        self._windows = deque(times[index:index + frames_per_window]
+                              for index in range(0, len(times), frames_per_window))
+
+        # Workers are started by a fork server, rather than forked from this process - forking a process which is
+        #  running other threads can leave a worker deadlocked on a lock which another thread held at the time
+        self._executor = ProcessPoolExecutor(max_workers=num_workers,
+                                             mp_context=multiprocessing.get_context('forkserver'))
+        self._in_progress = deque()
+        self._current = None
+        for _ in range(num_workers):
+            self._submit_next()
+
+    def get_frame(self, time, frames_required_for):
+        """ Creates a new Frame from the decoded 'large' image at the specified time, via Frame.init_from_image.
+            :param time: The time (in milliseconds) of the frame to get - frames must be requested in time order.
+            :param frames_required_for: A list of requirements, as passed to the Frame initialisers.
+            :return: Returns a new Frame object; raises EOFError if the video ends before the specified time.
+        """
+        while self._current is None or time > self._current['times'][-1]:
+            self._next_window()
+        try:
+            index = self._current['times'].index(time)
+        except ValueError:
+            raise EOFError
+        if index >= self._current['num_decoded']:
+            # The video ended part way through this window
+            raise EOFError
+        # Copy out of the shared array, so the Frame owns (and can modify, e.g. annotate) its own image
+        img = ImagePool.get(self._large_shape)
+        numpy.copyto(img, self._current['array'][index])
+        return Frame.init_from_image(img, time, frames_required_for, img_type='large')
+
+    def close(self):
+        """ Stops any workers, and removes every shared array - must be called once finished with, or if aborted. """
+        for window in self._in_progress:
+            window['future'].cancel()
+        # Wait for any running workers, so their arrays are no longer in use before being removed
+        self._executor.shutdown(wait=True)
+        for window in list(self._in_progress) + ([self._current] if self._current is not None else []):
+            self._remove_window(window)
+        self._in_progress.clear()
+        self._current = None
+
+    #
+    # ##### PRIVATE METHODS
+    #
+    def _submit_next(self):
+        """ PRIVATE: Creates the shared array for the next window (if any remain), and passes it to a worker. """
+        if not self._windows:
+            return
+        times = self._windows.popleft()
+        file_handle, array_fullpath = tempfile.mkstemp(prefix='kdcam-decode-', suffix='.npy', dir=self._temp_folder)
+        os.close(file_handle)
+        array = open_memmap(array_fullpath, mode='w+', dtype=numpy.uint8, shape=(len(times),) + self._large_shape)
+        future = self._executor.submit(_decode_window, self._video_fullpath, times, array_fullpath,
+                                       self._greyscale, ParallelDecoder._seek_margins_ms)
+        self._in_progress.append({'times': times, 'array': array, 'array_fullpath': array_fullpath,
+                                  'future': future, 'num_decoded': 0})
+
+    def _next_window(self):
+        """ PRIVATE: Moves on to the next window, once decoded - and starts decoding another in its place.
+            Raises EOFError if there are no more windows, or if the worker failed.
+        """
+        if self._current is not None:
+            self._remove_window(self._current)
+            self._current = None
+        if not self._in_progress:
+            raise EOFError
+        window = self._in_progress.popleft()
+        self._submit_next()
+        try:
+            window['num_decoded'] = window['future'].result()
+        except Exception as e:
+            # Handle any error decoding as EOF, as would be the case when decoding sequentially
+            print('DEBUG: ParallelDecoder worker failed - %s' % e)
+            self._remove_window(window)
+            raise EOFError
+        self._current = window
+
+    @staticmethod
+    def _remove_window(window):
+        """ PRIVATE: Closes and removes a window's shared array. """
+        window['array'] = None
+        if os.path.isfile(window['array_fullpath']):
+            os.remove(window['array_fullpath'])
+
+
+def _decode_window(video_fullpath, times, array_fullpath, greyscale, seek_margins_ms):
+    """ PRIVATE: Runs in a worker process - decodes the frames at each of the times into the shared array, resized to
+        the array's ('large') dimensions.
+        :return: Returns the number of frames decoded, which is less than len(times) only if the video ended first.
+    """
+    array = open_memmap(array_fullpath, mode='r+')
+    large_size = (array.shape[2], array.shape[1])
+    # Parallelism comes from the workers, so each decoder uses a single thread (if supported by this OpenCV) - this
+    #  is only applied when passed as an open parameter, not if set afterwards
+    if hasattr(cv2, 'CAP_PROP_N_THREADS'):
+        video_capture = cv2.VideoCapture(video_fullpath, cv2.CAP_ANY, [cv2.CAP_PROP_N_THREADS, 1])
+    else:
+        video_capture = cv2.VideoCapture(video_fullpath)
+    if not video_capture.isOpened():
+        return 0
+
+    # Seek to before the first time needed - the position reported after seeking must be no later than it, otherwise
+    #  the first frame(s) would be missed, so keep seeking further back until that's the case
+    for seek_margin_ms in seek_margins_ms + [times[0]]:
+        seek_time = max(times[0] - seek_margin_ms, 0)
+        if seek_time > 0:
+            video_capture.set(cv2.CAP_PROP_POS_MSEC, seek_time)
+        else:
+            video_capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+        if video_capture.get(cv2.CAP_PROP_POS_MSEC) <= times[0]:
+            break
+
+    num_decoded = 0
+    for time in times:
+        if not _grab_until(video_capture, time):
+            # No frames remaining - the video has ended part way through this window
+            break
+        capture_success, source_img = video_capture.retrieve()
+        if not capture_success:
+            break
+        if greyscale:
+            source_img = cv2.extractChannel(source_img, 0)
+        array[num_decoded] = cv2.resize(source_img, large_size, interpolation=cv2.INTER_AREA)
+        num_decoded += 1
+    array.flush()
+    video_capture.release()
+    return num_decoded
+
+
+def _grab_until(video_capture, time):
+    """ PRIVATE: Grabs frames until reaching the one for the specified time, as in Frame.init_from_video_sequential.
+        :return: Returns True once grabbed, ready to be retrieved; or False if the video ended first.
+    """
+    prev_time = video_capture.get(cv2.CAP_PROP_POS_MSEC)
+    while True:
+        if not video_capture.grab():
+            return False
+        this_time = video_capture.get(cv2.CAP_PROP_POS_MSEC)
+        if prev_time <= time <= this_time:
+            return True
+        prev_time = this_time
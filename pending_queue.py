@@ -0,0 +1,154 @@
+import os
+import json
+import math
+import time
+from datetime import datetime
+import file_handling
+import kd_timers
+from camera import CameraProfiles, FairScheduler
+
+
+#
+# ##### PRIORITY POLICIES
+#
+# Each policy is a function taking (entry, options) and returning a number of priority points - an entry is a dict with
+#  the video's 'metadata' (from get_file_metadata), 'clip_age_hours' (since it was recorded) and 'wait_hours' (since it
+#  was first seen in the queue), and options is the dict of queue settings.  Points from every enabled policy are added
+#  together, and the videos with the most points are processed first.
+def _policy_newest_first(entry, options):
+    """ Most points for the newest clips, halving every newest_half_life_hours - so fresh clips jump the backlog. """
+    return options.get('newest_first_points', 10) * 0.5 ** (entry['clip_age_hours']
+                                                             / options.get('newest_half_life_hours', 1))
+
+
+def _policy_camera_weight(entry, options):
+    """ Fixed points per camera, e.g. to always favour the front door over the garden. """
+    return options.get('camera_weights', {}).get(entry['metadata']['camera'], 0)
+
+
+def _policy_trigger_zone_boost(entry, options):
+    """ Extra points for any camera with trigger zones, as these are the cameras watching for specific activity. """
+    if CameraProfiles.get(entry['metadata']['camera'])['trigger_zones']:
+        return options.get('trigger_zone_boost', 5)
+    return 0
+
+
+class PendingQueue:
+    """ The PendingQueue class decides the order in which pending videos are processed - by default strictly oldest
+        first, but after an outage that means fresh (and likely more important) clips wait behind hours of backlog.
+
+        Each video is scored by the enabled policies (see POLICIES, and register_policy() to add more), plus optional
+        aging points for each hour it has waited in the queue - so however low its priority, an old clip does still
+        eventually finish.
+        Scores are grouped into buckets of priority_bucket_points, and within a bucket cameras take turns round-robin
+        (via FairScheduler), each with its own highest scoring video - so a busy camera with many similar clips can't
+        starve the others, but a video in a higher bucket still goes first.  Scores are almost never exactly equal, so
+        without buckets the round-robin would almost never apply.
+        The state of the queue is saved to a JSON file each time it is ordered, for monitoring.
+        PendingQueue is dependent on CameraProfiles, as a project-specific dependency.
+    """
+
+    POLICIES = {'newest_first': _policy_newest_first,
+                'camera_weight': _policy_camera_weight,
+                'trigger_zone_boost': _policy_trigger_zone_boost}
+
+    def __init__(self, options, state_fullpath=None):
+        """ Create a new PendingQueue.
+            :param options: A dict of queue settings - 'policies' (a list of policy names), 'aging_points_per_hour',
+                            'priority_bucket_points', plus any options used by the policies themselves.
+            :param state_fullpath: Optionally, a fully qualified path to save the queue state to, for monitoring.
+        """
+        for policy in options['policies']:
+            if policy not in PendingQueue.POLICIES:
+                raise Exception('Unknown pending queue policy: %s' % policy)
+        self._options = options
+        self._state_fullpath = state_fullpath
+        self._fair_scheduler = FairScheduler()
+        self._first_seen = {}       # Keyed by video, with the value being the time it was first seen in the queue
+
+    @staticmethod
+    def register_policy(name, policy_function):
+        """ Adds a custom policy, which can then be enabled by including its name in the 'policies' option.
+            :param policy_function: A function taking (entry, options) and returning a number of priority points.
+        """
+        PendingQueue.POLICIES[name] = policy_function
+
+    def order(self, video_list, video_folder):
+        """ Re-orders a list of pending videos, highest priority first.
+            :param video_list: A list of video paths, relative to video_folder, as from get_pending_video_list.
+            :param video_folder: The video_pending folder.
+            :return: Returns a new list, of the same videos in the order they should be processed.
+        """
+        now = time.time()
+        self._first_seen = {video: self._first_seen.get(video, now) for video in video_list}
+
+        entries = []
+        for video in video_list:
+            metadata = file_handling.get_file_metadata(video_folder, video)
+            entry = {'video': video,
+                     'metadata': metadata,
+                     'clip_age_hours': self._clip_age_secs(metadata, now) / 3600,
+                     'wait_hours': (now - self._first_seen[video]) / 3600}
+            entry['priority'] = (sum(PendingQueue.POLICIES[policy](entry, self._options)
+                                     for policy in self._options['policies'])
+                                 + entry['wait_hours'] * self._options.get('aging_points_per_hour', 0))
+            entries.append(entry)
+
+        # Within each camera, highest priority first - sort is stable, so equal priorities stay in filename order
+        by_camera = {}
+        for entry in sorted(entries, key=lambda entry: entry['priority'], reverse=True):
+            by_camera.setdefault(entry['metadata']['camera'], []).append(entry)
+        # Then number each camera's turns within each bucket, so every camera has a first turn, second turn, etc
+        bucket_points = self._options.get('priority_bucket_points', 5)
+        for camera_entries in by_camera.values():
+            turns = {}
+            for entry in camera_entries:
+                entry['bucket'] = math.floor(entry['priority'] / bucket_points) if bucket_points > 0 else 0
+                entry['turn'] = turns.get(entry['bucket'], 0)
+                turns[entry['bucket']] = entry['turn'] + 1
+        # Highest bucket first, then each camera's first turn in round-robin order, then each second turn, etc
+        rotation = {camera: position for position, camera in enumerate(self._fair_scheduler.camera_order(by_camera))}
+        entries.sort(key=lambda entry: (-entry['bucket'], entry['turn'], rotation[entry['metadata']['camera']]))
+
+        if self._state_fullpath:
+            self._save_state(entries)
+        return [entry['video'] for entry in entries]
+
+    def mark_served(self, video):
+        """ Records that a video has just been processed, so cameras within the same bucket take turns. """
+        self._fair_scheduler.mark_served(file_handling.get_file_metadata('', video)['camera'])
+        self._first_seen.pop(video, None)
+
+    @staticmethod
+    def _clip_age_secs(metadata, now):
+        """ PRIVATE: Age of the clip since it was recorded - from its filename, or failing that its modified time. """
+        file_datetime = file_handling.get_file_datetime(metadata['basename_new'])
+        if file_datetime is not None:
+            return max((datetime.fromtimestamp(now) - file_datetime).total_seconds(), 0)
+        try:
+            return max(now - os.path.getmtime(metadata['source_fullpath']), 0)
+        except OSError:
+            return 0
+
+    def _save_state(self, entries, max_entries=50):
+        """ PRIVATE: Saves a summary of the queue to the state file - written to a temporary file and then renamed, so
+            that anything monitoring the file never sees it part-written.
+        """
+        by_camera = {}
+        for entry in entries:
+            camera = entry['metadata']['camera'] or 'unknown'
+            by_camera[camera] = by_camera.get(camera, 0) + 1
+        state = {'timestamp': kd_timers.timestamp(),
+                 'length': len(entries),
+                 'by_camera': by_camera,
+                 'policies': self._options['policies'],
+                 'queue': [{'video': entry['video'],
+                            'camera': entry['metadata']['camera'],
+                            'priority': round(entry['priority'], 2),
+                            'clip_age_mins': int(entry['clip_age_hours'] * 60),
+                            'wait_mins': int(entry['wait_hours'] * 60)}
+                           for entry in entries[:max_entries]]}
+        temp_fullpath = '%s.tmp' % self._state_fullpath
+        with open(temp_fullpath, 'w') as state_handle:
+            json.dump(state, state_handle, indent=2)
+        os.replace(temp_fullpath, self._state_fullpath)
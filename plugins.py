@@ -1,3 +1,5 @@
+import cv2
+import numpy
 from kd_app_thread import AppThread
 import kd_timers
 
@@ -6,6 +8,15 @@ class TriggerZones(AppThread):
 
     def threaded_function(self, clip, trigger_zones):
 
+        # Draw each zone as a mask just once, so each segment's subjects can then be checked in a single lookup
+        trigger_zone_masks = {}
+        for trigger_zone in trigger_zones:
+            if trigger_zone['type'] == 'contour':
+                contour = numpy.array(trigger_zone['value'], dtype=numpy.int32)
+                trigger_zone_masks[trigger_zone['label']] = numpy.zeros(clip.base_frame.dimensions_numpy.large[:2],
+                                                                        numpy.uint8)
+                cv2.drawContours(trigger_zone_masks[trigger_zone['label']], [contour], -1, 255, cv2.FILLED)
+
         while True:
 
             if self.should_abort():
@@ -13,17 +24,21 @@ class TriggerZones(AppThread):
 
             for segment in [segment for segment in clip.segments if segment.is_required_for('TRIGGER_ZONE')]:
 
-                for frame_time in range(segment.start_time, segment.end_time, clip.time_increment):
-                    for subject in clip.frames[frame_time].subjects:
-                        is_triggered = subject.within_trigger_zone(trigger_zones)
-                        zones = [zone for zone, triggered in is_triggered.items() if triggered]
-                        for zone in zones:
-                            if zone not in segment.trigger_zones:
-                                segment.trigger_zones.append(zone)
-                            # TODO: Break out of the loops here, if found all zones
-                            # TODO: Make this more flexible, provide option to also do per individual frame - and then
-                            # TODO:  use that to help make the primary composite more relevant
+                # Only active subjects are tested - i.e. the tracks moving through the segment, not static noise.
+                #  Zones are added in the order they were first triggered (as group_subfolder names depend on it).
+                #  Rows are in the same order as looping through each frame and then each subject, so the zone
+                #  triggered by the earliest row comes first - with any ties in the order the zones are listed.
+                first_rows = {}
+                for zone, zone_mask in trigger_zone_masks.items():
+                    if zone not in segment.trigger_zones:
+                        first_row = segment.subjects.first_row_within(zone_mask, only_active=True)
+                        if first_row is not None:
+                            first_rows[zone] = first_row
+                segment.trigger_zones.extend(sorted(first_rows, key=lambda zone: first_rows[zone]))
+                # TODO: Make this more flexible, provide option to also do per individual frame - and then
+                # TODO:  use that to help make the primary composite more relevant
 
+                for frame_time in range(segment.start_time, segment.end_time, clip.time_increment):
                     clip.remove_redundant_frame(time=frame_time,
                                                 expired_requirement='TRIGGER_ZONE')
 
@@ -22,6 +22,9 @@ class Subject:
     _min_difference_area_percent = None
     _min_difference_area_pixels = None
     _dilate_pixels = None
+    _dilate_kernel = None
+    _dilate_scale = 1
+    _dilate_kernel_scaled = None
 
     _is_setup_dimensions_numpy = False
     _dimensions_numpy = None
@@ -34,7 +37,7 @@ class Subject:
     #
     @staticmethod
     def setup(bounds_padding, annotate_line_colour, absolute_intensity_threshold, min_difference_area_percent,
-              min_difference_area_pixels, dilate_pixels):
+              min_difference_area_pixels, dilate_pixels, dilate_scale=1):
         """ Subject.setup() must be called prior to creating a Subject instance.
             Typically this would be at the top of the main file.
             :param bounds_padding:
@@ -43,6 +46,8 @@ class Subject:
             :param min_difference_area_percent: Fraction (range 0-1) for % of difference in subject area to be active
             :param min_difference_area_pixels: Absolute pixels for difference in subject area to be considered active
             :param dilate_pixels: Number of pixels by which to dilate the subject contour mask
+            :param dilate_scale: 1 for the exact dilation; otherwise a faster approximation, dilating a mask reduced in
+                                 size by this factor (see contour_dilate)
         """
         Subject._bounds_padding = bounds_padding
         Subject._annotate_line_colour = annotate_line_colour
@@ -50,6 +55,10 @@ class Subject:
         Subject._min_difference_area_percent = min_difference_area_percent
         Subject._min_difference_area_pixels = min_difference_area_pixels
         Subject._dilate_pixels = dilate_pixels
+        Subject._dilate_kernel = numpy.ones((dilate_pixels, dilate_pixels), numpy.uint8)
+        Subject._dilate_scale = dilate_scale
+        dilate_pixels_scaled = max(int(round(dilate_pixels / dilate_scale)), 1)
+        Subject._dilate_kernel_scaled = numpy.ones((dilate_pixels_scaled, dilate_pixels_scaled), numpy.uint8)
         Subject._is_setup = True
 
     @staticmethod
@@ -78,7 +87,6 @@ class Subject:
 
         # Save / initialise key values for use later
         self.contour = contour
-        self.contour_dilated = self.contour_dilate()
         contour_moments = cv2.moments(contour)
         self.contour_center = (int(contour_moments['m10']/contour_moments['m00']),
                                int(contour_moments['m01']/contour_moments['m00']))
@@ -92,6 +100,12 @@ class Subject:
                             min(self.bounds[0] + self.bounds[2] + Subject._bounds_padding,
                                 Subject._dimensions_numpy[1])]
 
+        # The dilated contour is calculated just within the area around the subject, along with a mask of the dilated
+        #  subject cropped to that same area.  dilated_params uses the same [y1, y2, x1, x2] format as crop_params.
+        self.contour_dilated, self.dilated_params, self.dilated_mask = self.contour_dilate()
+        # Cropped (un-dilated) subject mask is only created if needed, but then cached - see get_subject_mask
+        self._subject_mask_cropped = None
+
         self._is_active = None
         self.is_tracked = False     # Set externally if added to a Track class
         self.is_used = False        # Set externally if used within a Composite image
@@ -131,50 +145,60 @@ class Subject:
                              offset=(-self.crop_params[2], -self.crop_params[0]))
         return cropped_img
 
-    def test_if_active(self, prev_img_greyblur, this_img_greyblur):
+    def test_if_active(self, prev_img_greyblur, this_img_greyblur, capture_audit=False):
         """ Compares the previous frame to current frame, only within the region of the subject, to determine activity.
             Note that a subject is considered 'active' if the difference between the previous and current frame, just
             within the subject contour boundary, is more than x% of the total area, or an area of at least ypx.
             :param prev_img_greyblur: Must be the 'large' size greyblur image for the previous frame.
             :param this_img_greyblur: Must be the 'large' size greyblur image for the current frame.
+            :param capture_audit: Boolean; if true, interim images and values are saved within self.audit.
             :return: Returns boolean, describing whether the subject is considered active.
         """
 
         # Get just the cropped areas of each image, then get a difference _retain_mask of them
-        self.audit['prev_cropped_img'] = self.get_cropped_img(prev_img_greyblur)
-        self.audit['this_cropped_img'] = self.get_cropped_img(this_img_greyblur)
-        self.audit['prev_basic'] = cv2.absdiff(self.audit['prev_cropped_img'],
-                                               self.audit['this_cropped_img'])
-        self.audit['prev_absolute'] = cv2.threshold(self.audit['prev_basic'],
-                                                    Subject._absolute_intensity_threshold,
-                                                    255,
-                                                    cv2.THRESH_BINARY)[1]  # Note [1] returns just the array / image
+        audit = {}
+        audit['prev_cropped_img'] = self.get_cropped_img(prev_img_greyblur)
+        audit['this_cropped_img'] = self.get_cropped_img(this_img_greyblur)
+        audit['prev_basic'] = cv2.absdiff(audit['prev_cropped_img'],
+                                          audit['this_cropped_img'])
+        audit['prev_absolute'] = cv2.threshold(audit['prev_basic'],
+                                               Subject._absolute_intensity_threshold,
+                                               255,
+                                               cv2.THRESH_BINARY)[1]  # Note [1] returns just the array / image
 
         # Create a _retain_mask for just the subject area, and apply this to the difference _retain_mask to ensure only
         # differences within the subject contour are considered
-        self.audit['subject_mask'] = self.get_subject_mask(crop=True)
-        self.audit['prev_masked_absolute'] = numpy.bitwise_and(self.audit['prev_absolute'],
-                                                               self.audit['subject_mask'])
+        audit['subject_mask'] = self.get_subject_mask(crop=True)
+        audit['prev_masked_absolute'] = numpy.bitwise_and(audit['prev_absolute'],
+                                                          audit['subject_mask'])
 
         # Calculate the number of pixels which have changed sufficiently, then check if that exceeds defined threshold
-        self.audit['difference_area'] = numpy.count_nonzero(self.audit['prev_masked_absolute'])
-        if (self.audit['difference_area'] / self.contour_area > Subject._min_difference_area_percent
-                or self.audit['difference_area'] > Subject._min_difference_area_pixels):
+        audit['difference_area'] = numpy.count_nonzero(audit['prev_masked_absolute'])
+        if (audit['difference_area'] / self.contour_area > Subject._min_difference_area_percent
+                or audit['difference_area'] > Subject._min_difference_area_pixels):
             # More than x% or ypx of previous difference contour_area is still different, hence object still moving
             self._is_active = True
         else:
             self._is_active = False
+
+        # Only keep the interim images and values if requested - otherwise they are discarded straight away
+        if capture_audit:
+            self.audit.update(audit)
         return self._is_active
 
     def get_subject_mask(self, dilated=False, crop=False, invert=False):
         """ Creates an 'include _retain_mask' for the subject, i.e. non-zero (255) where the subject is.
         The default is for the background to be zeros, with the subject as 255's (white / non-zero).
+        The cropped, un-dilated, non-inverted mask is cached, as it is frequently used - so must not be modified.
         :param dilated: Boolean; if true, returns a dilated contour, rather than the original.
         :param crop: Boolean; if true crops to the subject contour + padding boundary.
         :param invert: Boolean; if true the subject is 0's, whilst the background is 255's.
         :return: The selected _retain_mask, as a numpy array.
         """
 
+        if crop and not dilated and not invert and self._subject_mask_cropped is not None:
+            return self._subject_mask_cropped
+
         # Prepare _dimensions, offset values, base _retain_mask and fill colour depending on options chosen.
         if crop:
             dimensions_numpy = (self.crop_params[1] - self.crop_params[0],
@@ -197,23 +221,49 @@ class Subject:
         else:
             selected_contour = self.contour
         cv2.drawContours(subject_mask, [selected_contour], -1, fill_colour, cv2.FILLED, offset=offset)
+
+        if crop and not dilated and not invert:
+            self._subject_mask_cropped = subject_mask
         return subject_mask
 
     def contour_dilate(self):
         """ Generates and returns a dilated version of the contour, to give cleaner edges to subjects when composited.
-            Amount of dilation is set within Subject.setup().  The mask itself is not currently saved; just the contour.
-            :return: Returns a single dilated contour.
+            Amount of dilation is set within Subject.setup().  All work is done within the subject's bounding rect,
+            padded by enough to hold the dilation, rather than on a full-size mask.  If dilate_scale is more than 1,
+            the mask is reduced in size by that factor before dilating (where any pixel set within each block remains
+            set), then enlarged back up - quicker for large subjects, but with blockier edges.
+            :return: Returns a tuple of (dilated contour, [y1, y2, x1, x2] of the padded area, and a mask of the
+                     filled dilated contour, cropped to that padded area).
         """
-        subject_mask = numpy.zeros(Subject._dimensions_numpy, numpy.uint8)
-        cv2.drawContours(subject_mask, [self.contour], -1, (255, 255, 255), cv2.FILLED)
-        subject_mask = cv2.morphologyEx(subject_mask,
-                                        cv2.MORPH_DILATE,
-                                        numpy.ones((Subject._dilate_pixels, Subject._dilate_pixels), numpy.uint8))
+        dilate_padding = Subject._dilate_pixels // 2 + 1
+        dilated_params = [max(self.bounds[1] - dilate_padding, 0),
+                          min(self.bounds[1] + self.bounds[3] + dilate_padding, Subject._dimensions_numpy[0]),
+                          max(self.bounds[0] - dilate_padding, 0),
+                          min(self.bounds[0] + self.bounds[2] + dilate_padding, Subject._dimensions_numpy[1])]
+        dilated_dimensions_numpy = (dilated_params[1] - dilated_params[0], dilated_params[3] - dilated_params[2])
+        offset = (-dilated_params[2], -dilated_params[0])
+
+        subject_mask = numpy.zeros(dilated_dimensions_numpy, numpy.uint8)
+        cv2.drawContours(subject_mask, [self.contour], -1, (255, 255, 255), cv2.FILLED, offset=offset)
+        if Subject._dilate_scale <= 1:
+            subject_mask = cv2.dilate(subject_mask, Subject._dilate_kernel)
+        else:
+            scaled_size = (max(dilated_dimensions_numpy[1] // Subject._dilate_scale, 1),
+                           max(dilated_dimensions_numpy[0] // Subject._dilate_scale, 1))
+            scaled_mask = cv2.resize(subject_mask, scaled_size, interpolation=cv2.INTER_AREA)
+            cv2.threshold(scaled_mask, 0, 255, cv2.THRESH_BINARY, dst=scaled_mask)
+            scaled_mask = cv2.dilate(scaled_mask, Subject._dilate_kernel_scaled)
+            subject_mask = cv2.resize(scaled_mask, dilated_dimensions_numpy[::-1], interpolation=cv2.INTER_NEAREST)
         contour_dilate = cv2.findContours(subject_mask,
                                           cv2.RETR_EXTERNAL,
-                                          cv2.CHAIN_APPROX_SIMPLE)[self._contours_return_index]
-        # As we start with only one contour, and are dilating it, we're guaranteed to still only have one - hence [0]
-        return contour_dilate[0]
+                                          cv2.CHAIN_APPROX_SIMPLE,
+                                          offset=(dilated_params[2], dilated_params[0]))[self._contours_return_index]
+
+        # As we start with only one contour, and are dilating it, we're guaranteed to still only have one - hence [0].
+        # The mask is re-drawn from the contour, so any holes are filled exactly as for get_subject_mask(dilated=True)
+        dilated_mask = numpy.zeros(dilated_dimensions_numpy, numpy.uint8)
+        cv2.drawContours(dilated_mask, [contour_dilate[0]], -1, (255, 255, 255), cv2.FILLED, offset=offset)
+        return contour_dilate[0], dilated_params, dilated_mask
 
     def dist_from_point(self, point_xy):
         """ Calculate and return the distance (in pixels) of the centre of the subject from the specified point.
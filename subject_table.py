@@ -0,0 +1,127 @@
+import numpy
+
+
+class SubjectTable:
+    """ The SubjectTable class holds the key properties of every subject within a segment, as a numpy record array,
+        so that searching for subjects (e.g. when building composites or checking trigger zones) can be done as a
+        single vectorised query rather than looping over every frame and subject.
+
+        Rows are added a frame at a time via add_frame(), as subjects are found, and are always in the same order as
+        looping through each frame (by time) and then each subject within the frame.  The Subject objects themselves
+        are kept alongside, so that any row can be turned back into its Subject via get_subject().
+        The 'used' column is the record of whether a subject has been used within a composite - use mark_used() to
+        keep this in sync with Subject.is_used.
+        SubjectTable is indirectly dependent on Subject, as a project-specific dependency.
+    """
+
+    dtype = numpy.dtype([('time', numpy.int64),
+                         ('area', numpy.float64),
+                         ('cx', numpy.int32),
+                         ('cy', numpy.int32),
+                         ('bounds', numpy.int32, (4,)),     # [x, y, w, h], as Subject.bounds
+                         ('active', numpy.bool_),
+                         ('used', numpy.bool_),
+                         ('tracked', numpy.bool_),
+                         ('track', numpy.int32)])           # Track.index, or -1 if not in a track
+
+    def __init__(self, initial_capacity=64):
+        self._data = numpy.zeros(initial_capacity, SubjectTable.dtype)
+        self._num_rows = 0
+        self._subjects = []
+        self._rows_by_subject = {}      # Keyed by id(subject), with the value being its row number
+
+    def __len__(self):
+        return self._num_rows
+
+    @property
+    def rows(self):
+        """ Returns a view of the populated rows - which can be queried as e.g. table.rows['area'] """
+        return self._data[:self._num_rows]
+
+    #
+    # ##### BUILDING THE TABLE
+    #
+    def add_frame(self, time, subjects):
+        """ Adds a row for each subject within a frame - subjects must already have been tested for activity.
+            :param time: The time of the frame, in milliseconds.
+            :param subjects: A list of Subjects within the frame.
+        """
+        if self._num_rows + len(subjects) > len(self._data):
+            # Grow by doubling, so that frequently adding a few rows doesn't mean frequently copying the whole table
+            self._data = numpy.resize(self._data, max(len(self._data) * 2, self._num_rows + len(subjects)))
+        for subject in subjects:
+            self._data[self._num_rows] = (time, subject.contour_area, subject.contour_center[0],
+                                          subject.contour_center[1], subject.bounds, subject.is_active,
+                                          subject.is_used, subject.is_tracked, -1)
+            self._rows_by_subject[id(subject)] = self._num_rows
+            self._subjects.append(subject)
+            self._num_rows += 1
+
+    def restrict_to(self, start_time, end_time):
+        """ Removes any rows outside the range start_time < time < end_time, i.e. frames not within the segment.
+            The segment's first frame is its base frame, which never has subjects of its own.
+        """
+        keep = (self.rows['time'] > start_time) & (self.rows['time'] < end_time)
+        if keep.all():
+            return
+        self._subjects = [subject for subject, kept in zip(self._subjects, keep) if kept]
+        self._data = self.rows[keep].copy()
+        self._num_rows = len(self._data)
+        self._rows_by_subject = {id(subject): row for row, subject in enumerate(self._subjects)}
+
+    def add_tracks(self, tracks):
+        """ Records the track of each subject, and whether it is tracked, i.e. excluded in favour of a representative.
+            :param tracks: A list of Track objects, whose representatives have already been selected.
+        """
+        for track in tracks:
+            for subject in track.subjects.values():
+                row = self._rows_by_subject.get(id(subject))
+                if row is not None:
+                    self._data[row]['track'] = track.index
+                    self._data[row]['tracked'] = subject.is_tracked
+
+    def get_subject(self, row):
+        return self._subjects[row]
+
+    def mark_used(self, row):
+        self._data[row]['used'] = True
+        self._subjects[row].is_used = True
+
+    #
+    # ##### QUERIES
+    #
+    def available_rows(self, skip_is_used=False):
+        """ Returns the row numbers of all active, untracked subjects - and unless skip_is_used, only unused subjects.
+            Rows are returned in order, i.e. by frame time and then subject.
+        """
+        available = self.rows['active'] & ~self.rows['tracked']
+        if not skip_is_used:
+            available &= ~self.rows['used']
+        return numpy.flatnonzero(available)
+
+    def primary_row(self, target_point, min_fraction_of_max_area):
+        """ Finds the nearest available subject to target_point, of at least a fraction of the largest subject's area.
+            :param target_point: An (x, y) tuple specifying the target point where we want the subject to be closest to.
+            :param min_fraction_of_max_area: Proportion of the largest available subject, as a minimum size.
+            :return: Returns the row number of the primary subject; raises EOFError if there are no available subjects.
+        """
+        candidates = self.available_rows()
+        if len(candidates) == 0:
+            raise EOFError
+        areas = self.rows['area'][candidates]
+        candidates = candidates[areas >= areas.max() * min_fraction_of_max_area]
+        distances = numpy.hypot(self.rows['cx'][candidates] - target_point[0],
+                                self.rows['cy'][candidates] - target_point[1])
+        return candidates[numpy.argmin(distances)]
+
+    def first_row_within(self, zone_mask, only_active=False):
+        """ Finds the first subject whose centre falls within the non-zero area of zone_mask.
+            :param zone_mask: A single channel mask, the same size as the images the subjects were found within.
+            :param only_active: Boolean; if true, only active subjects are tested, i.e. those making up each track.
+            :return: Returns the row number of the first such subject (i.e. the earliest), or None if there are none.
+        """
+        within = zone_mask[self.rows['cy'], self.rows['cx']] != 0
+        if only_active:
+            within &= self.rows['active']
+        rows = numpy.flatnonzero(within)
+        return int(rows[0]) if len(rows) else None
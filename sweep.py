@@ -0,0 +1,401 @@
+import sys
+import csv
+import json
+import time
+import itertools
+import traceback
+import multiprocessing
+import cv2
+import numpy
+import kd_timers
+from clip import Clip
+from frame import Frame
+from subject import Subject
+from kd_app_thread import AppThread
+
+
+#
+# ##### DEFAULT PARAMETERS
+#
+# These match the values used by main.py - any parameter not included in the sweep grid uses these values
+frame_defaults = {'blur_pixel_width': 7,
+                  'absolute_intensity_threshold': 40,
+                  'morph_radius': 15,
+                  'subject_size_threshold': 1500,
+                  'source_size_x': 3072,
+                  'source_size_y': 1728,
+                  'large_size_x': 1024,
+                  'medium_size_x': 640,
+                  'small_size_x': 160,
+                  'morph_scale': 1}
+subject_defaults = {'bounds_padding': 10,
+                    'annotate_line_colour': (0, 255, 255),
+                    'absolute_intensity_threshold': 40,
+                    'min_difference_area_percent': 0.05,
+                    'min_difference_area_pixels': 1500,
+                    'dilate_pixels': 25,
+                    'dilate_scale': 1}
+# Frame parameters which change the frame cache's signature (see FrameCache) - the cache is only used if none are swept
+frame_cache_params = ['source_size_x', 'source_size_y', 'large_size_x']
+# Scales compared against the exact morph / dilation by benchmark_morph
+morph_benchmark_scales = [2, 3, 4]
+
+
+#
+# ##### SWEEP COUNTER THREAD
+#
+class SweepCounter(AppThread):
+    """ Counts subjects within each segment as it is created, then releases the frames - in the same way as the
+        TriggerZones plugin, so that frames do not need to be held in memory until the end of the clip.
+    """
+
+    def threaded_function(self, clip, counts):
+
+        while True:
+
+            if self.should_abort():
+                return
+
+            for segment in [segment for segment in clip.segments if segment.is_required_for('SWEEP')]:
+
+                for frame_time in range(segment.start_time, segment.end_time, clip.time_increment):
+                    counts['subjects'] += clip.frames[frame_time].num_subjects(only_active=False)
+                    counts['active_subjects'] += clip.frames[frame_time].num_subjects(only_active=True)
+                    clip.remove_redundant_frame(time=frame_time,
+                                                expired_requirement='SWEEP')
+
+                segment.remove_requirement('SWEEP')
+
+            else:
+                if clip.created_all_segments:
+                    break
+                kd_timers.sleep(secs=0.05)
+
+
+#
+# ##### PROCESS A SINGLE CLIP
+#
+def process_clip(task):
+    """ Processes a single clip with a single combination of parameters - intended to run in a separate process.
+        :param task: A tuple of (combination index, frame params, subject params, label, options)
+        :return: Returns a dict of results for this clip / combination.
+    """
+    combination, frame_params, subject_params, label, options = task
+    result = {'combination': combination, 'video': label['video']}
+    result.update(frame_params)
+    result.update({'subject_%s' % key: value for key, value in subject_params.items()
+                   if key != 'annotate_line_colour'})
+
+    Clip.setup(time_increment=options['time_increment'],
+               annotate_line_colour=(0, 255, 255),
+               frame_cache=options['frame_cache'],
+               frame_cache_greyblur=options['frame_cache'] and 'blur_pixel_width' not in options['swept'])
+    Frame.setup(**frame_params)
+    Subject.setup(**subject_params)
+
+    start_time = time.perf_counter()
+    try:
+        clip = Clip(video_fullpath=label['video'], base_frame_time=0, frames_required_for=['SEGMENT'])
+    except EOFError:
+        result['error'] = 'Unable to open video'
+        return result
+
+    counts = {'subjects': 0, 'active_subjects': 0}
+    clip.threads['1_frame_getter'] = Clip.FrameGetter(clip=clip,
+                                                      max_mem_usage_mb=options['max_mem_usage_mb'],
+                                                      required_for=['SEGMENT'])
+    clip.setup_exclude_mask(mask_exclusions=options['masks'])
+    clip.threads['2_create_segments'] = Clip.CreateSegments(clip=clip,
+                                                            max_mem_usage_mb=options['max_mem_usage_mb'],
+                                                            required_for=['COMPOSITE', 'SWEEP'],
+                                                            frames_required_for=['COMPOSITE', 'SWEEP'])
+    clip.threads['3_create_composites'] = Clip.CreateComposites(clip=clip)
+    clip.threads['4_sweep_counter'] = SweepCounter(clip=clip, counts=counts)
+
+    try:
+        while any(clip.threads[thread_name].is_running() for thread_name in sorted(list(clip.threads))):
+            kd_timers.sleep(0.05)
+    except BaseException:
+        for thread_name in sorted(list(clip.threads), reverse=True):
+            clip.threads[thread_name].stop(wait_until_stopped=True)
+        result['error'] = traceback.format_exc(limit=1).strip().splitlines()[-1]
+        return result
+
+    result['runtime_secs'] = time.perf_counter() - start_time
+    result['clip_length_secs'] = clip.video_duration_secs
+    result['subjects'] = counts['subjects']
+    result['active_subjects'] = counts['active_subjects']
+    result['num_segments'] = len(clip.segments)
+    result['segments'] = [[segment.start_time, segment.end_time] for segment in clip.segments]
+    result['is_active'] = len(clip.segments) > 0
+
+    # Compare against the reference labels, where provided
+    if 'active' in label:
+        result['active_match'] = result['is_active'] == label['active']
+    if 'segments' in label:
+        result['segment_iou'] = segment_iou(result['segments'], label['segments'])
+    del clip
+    return result
+
+
+def segment_iou(segments, reference_segments):
+    """ Calculates the intersection-over-union of two lists of time segments, i.e. how closely they agree.
+        :param segments: A list of [time_begin, time_end] pairs, in milliseconds.
+        :param reference_segments: A list of [time_begin, time_end] pairs, in milliseconds, from the reference labels.
+        :return: Returns a value in the range 0-1, where 1 is perfect agreement.  Two empty lists are perfect agreement.
+    """
+    def total_length(segment_list):
+        return sum(end - begin for begin, end in segment_list)
+
+    intersection = 0
+    for begin, end in segments:
+        for ref_begin, ref_end in reference_segments:
+            intersection += max(0, min(end, ref_end) - max(begin, ref_begin))
+    union = total_length(segments) + total_length(reference_segments) - intersection
+    if union <= 0:
+        return 1.0
+    return intersection / union
+
+
+#
+# ##### SWEEP ACROSS ALL COMBINATIONS
+#
+def get_combinations(grid):
+    """ Expands a grid of parameter values into a list of every combination of frame and subject parameters.
+        :param grid: A dict with optional 'frame' and 'subject' dicts, each mapping a parameter name to a list of values
+        :return: Returns a list of (frame_params, subject_params) tuples.
+    """
+    swept = [('frame', key, values) for key, values in sorted(grid.get('frame', {}).items())]
+    swept += [('subject', key, values) for key, values in sorted(grid.get('subject', {}).items())]
+    combinations = []
+    for values in itertools.product(*[param[2] for param in swept]):
+        frame_params = frame_defaults.copy()
+        subject_params = subject_defaults.copy()
+        for (group, key, _), value in zip(swept, values):
+            if group == 'frame':
+                frame_params[key] = value
+            else:
+                subject_params[key] = value
+        combinations.append((frame_params, subject_params))
+    return combinations
+
+
+def run_sweep(labels, grid):
+    """ Runs every combination of parameters in the grid over every labelled clip, in parallel processes.
+        :param labels: A list of dicts, each with a 'video' path, and optionally 'active' (True/False) and 'segments'
+                       (a list of [time_begin, time_end] pairs, in milliseconds) as reference labels.
+        :param grid: A dict of parameters to sweep - see get_combinations - plus optional 'workers', 'masks',
+                     'time_increment', 'max_mem_usage_mb' and 'frame_cache' settings.
+        :return: Returns a list of result dicts, one per clip per combination, ordered by combination.
+    """
+    options = {'time_increment': grid.get('time_increment', 1000),
+               'max_mem_usage_mb': grid.get('max_mem_usage_mb', 1000),
+               'frame_cache': grid.get('frame_cache', True),
+               'masks': grid.get('masks', []),
+               'swept': list(grid.get('frame', {}))}
+    # Each video has a single frame cache, so if combinations differ in any parameter within its signature, they would
+    #  all re-write the same cache files at the same time - so the cache can only be used if none of these are swept
+    if any(key in options['swept'] for key in frame_cache_params):
+        options['frame_cache'] = False
+    tasks = []
+    for combination, (frame_params, subject_params) in enumerate(get_combinations(grid)):
+        for label in labels:
+            tasks.append((combination, frame_params, subject_params, label, options))
+
+    # When using the frame cache, run the first combination on its own so that each clip is only decoded once, and
+    #  every later combination can then read from the cache rather than all decoding in parallel
+    first_tasks = [task for task in tasks if task[0] == 0] if options['frame_cache'] else []
+    other_tasks = [task for task in tasks if task not in first_tasks]
+
+    results = []
+    with multiprocessing.Pool(processes=grid.get('workers', multiprocessing.cpu_count())) as pool:
+        for task_list in [first_tasks, other_tasks]:
+            for result in pool.imap_unordered(process_clip, task_list):
+                print('Combination %d, %s: %s' % (result['combination'], result['video'],
+                                                  result.get('error', '%.1fs' % result.get('runtime_secs', 0))))
+                results.append(result)
+    results.sort(key=lambda k: (k['combination'], k['video']))
+    return results
+
+
+def summarise(results):
+    """ Summarises results per combination - mean runtime, detection counts and agreement with reference labels.
+        :param results: A list of result dicts, as returned by run_sweep.
+        :return: Returns a list of summary dicts, one per combination.
+    """
+    summaries = []
+    for combination, combination_results in itertools.groupby(results, key=lambda k: k['combination']):
+        combination_results = [result for result in combination_results if 'error' not in result]
+        if not combination_results:
+            continue
+        summary = {'combination': combination,
+                   'clips': len(combination_results),
+                   'runtime_secs': sum(r['runtime_secs'] for r in combination_results),
+                   'secs_per_clip_min': (sum(r['runtime_secs'] for r in combination_results)
+                                         / max(sum(r['clip_length_secs'] for r in combination_results), 1) * 60),
+                   'subjects': sum(r['subjects'] for r in combination_results),
+                   'active_subjects': sum(r['active_subjects'] for r in combination_results),
+                   'segments': sum(r['num_segments'] for r in combination_results)}
+        matches = [r['active_match'] for r in combination_results if 'active_match' in r]
+        if matches:
+            summary['active_accuracy'] = sum(matches) / len(matches)
+        ious = [r['segment_iou'] for r in combination_results if 'segment_iou' in r]
+        if ious:
+            summary['mean_segment_iou'] = sum(ious) / len(ious)
+        summaries.append(summary)
+    return summaries
+
+
+#
+# ##### BENCHMARK FAST MORPH AGAINST EXACT
+#
+def _save_class_settings(classes):
+    """ PRIVATE: Returns a copy of every setting (i.e. non-method class attribute) of each class, as set by its setup().
+        :return: Returns a dict keyed by class, to pass to _restore_class_settings.
+    """
+    return {cls: {name: value for name, value in vars(cls).items()
+                  if not name.startswith('__') and not callable(value)
+                  and not isinstance(value, (staticmethod, classmethod, property))}
+            for cls in classes}
+
+
+def _restore_class_settings(saved_settings):
+    """ PRIVATE: Restores the class settings saved by _save_class_settings. """
+    for cls, settings in saved_settings.items():
+        for name, value in settings.items():
+            setattr(cls, name, value)
+
+
+def benchmark_morph(labels, scales, frames_per_clip=30, time_increment=1000):
+    """ Compares the faster, approximate morph (Frame morph_scale) and dilation (Subject dilate_scale) against the
+        exact versions, on frames taken from each clip - so that a scale can be chosen for each board, trading accuracy
+        for speed.  Accuracy is the intersection-over-union of the approximate and exact masks, totalled over all
+        frames (for the morph) or subjects (for the dilation), where 1 is identical.
+        :param labels: A list of dicts, each with a 'video' path - as for run_sweep, but any reference labels are unused
+        :param scales: A list of scales to compare against the exact method, e.g. [2, 3, 4]
+        :param frames_per_clip: Maximum number of frames taken from each clip.
+        :param time_increment: Time in milliseconds between the frames taken.
+        :return: Returns a list of result dicts, one per scale (including 1, the exact method, for reference).
+    """
+    scales = [1] + [scale for scale in scales if scale != 1]
+    totals = {scale: {'close_secs': 0, 'close_intersection': 0, 'close_union': 0,
+                      'dilate_secs': 0, 'dilate_intersection': 0, 'dilate_union': 0} for scale in scales}
+    num_frames = 0
+    num_subjects = 0
+    # Clip, Frame and Subject settings are shared by the whole process, so are restored once the benchmark is done
+    saved_settings = _save_class_settings([Clip, Frame, Subject])
+    try:
+        Clip.setup(time_increment=time_increment, annotate_line_colour=(0, 255, 255))
+
+        for label in labels:
+            Frame.setup(**frame_defaults)
+            Subject.setup(**subject_defaults)
+            try:
+                clip = Clip(video_fullpath=label['video'], base_frame_time=0, frames_required_for=[])
+            except EOFError:
+                print('%s: Unable to open video' % label['video'])
+                continue
+
+            for frame_time in range(time_increment, (frames_per_clip + 1) * time_increment, time_increment):
+                try:
+                    frame = clip.get_frame(frame_time, [])
+                except EOFError:
+                    break
+                # The thresholded difference from the base frame, as in Frame.get_subjects
+                difference_img = cv2.absdiff(clip.base_frame.get_img('greyblur'), frame.get_img('greyblur'))
+                threshold_img = cv2.threshold(difference_img, frame_defaults['absolute_intensity_threshold'], 255,
+                                              cv2.THRESH_BINARY)[1]
+                exact_morph = None
+                exact_masks = []
+                for scale in scales:
+                    Frame.setup(**dict(frame_defaults, morph_scale=scale))
+                    start_time = time.perf_counter()
+                    morph_img = Frame.morph_close(threshold_img)
+                    totals[scale]['close_secs'] += time.perf_counter() - start_time
+                    if scale == 1:
+                        exact_morph = morph_img
+                        contours = cv2.findContours(morph_img, cv2.RETR_EXTERNAL,
+                                                    cv2.CHAIN_APPROX_SIMPLE)[Frame._contours_return_index]
+                        contours = [contour for contour in contours
+                                    if cv2.contourArea(contour) > frame_defaults['subject_size_threshold']]
+                    totals[scale]['close_intersection'] += numpy.count_nonzero(
+                        cv2.bitwise_and(morph_img, exact_morph))
+                    totals[scale]['close_union'] += numpy.count_nonzero(cv2.bitwise_or(morph_img, exact_morph))
+
+                    # Subjects are always taken from the exact morph, so that only the dilation differs
+                    Subject.setup(**dict(subject_defaults, dilate_scale=scale))
+                    for index, contour in enumerate(contours):
+                        start_time = time.perf_counter()
+                        dilated_mask = Subject(contour).dilated_mask
+                        totals[scale]['dilate_secs'] += time.perf_counter() - start_time
+                        if scale == 1:
+                            exact_masks.append(dilated_mask)
+                        totals[scale]['dilate_intersection'] += numpy.count_nonzero(
+                            cv2.bitwise_and(dilated_mask, exact_masks[index]))
+                        totals[scale]['dilate_union'] += numpy.count_nonzero(
+                            cv2.bitwise_or(dilated_mask, exact_masks[index]))
+                num_frames += 1
+                num_subjects += len(exact_masks)
+                frame.release_imgs()
+            clip.remove_fixed_video()
+            del clip
+    finally:
+        _restore_class_settings(saved_settings)
+
+    results = []
+    for scale in scales:
+        total = totals[scale]
+        results.append({'scale': scale,
+                        'frames': num_frames,
+                        'subjects': num_subjects,
+                        'close_ms': total['close_secs'] / max(num_frames, 1) * 1000,
+                        'close_speedup': totals[1]['close_secs'] / max(total['close_secs'], 1e-9),
+                        'close_iou': total['close_intersection'] / max(total['close_union'], 1),
+                        'dilate_ms': total['dilate_secs'] / max(num_subjects, 1) * 1000,
+                        'dilate_speedup': totals[1]['dilate_secs'] / max(total['dilate_secs'], 1e-9),
+                        'dilate_iou': total['dilate_intersection'] / max(total['dilate_union'], 1)})
+    return results
+
+
+def save_csv(rows, output_fullpath):
+    fieldnames = []
+    for row in rows:
+        fieldnames += [key for key in row if key not in fieldnames]
+    with open(output_fullpath, 'w', newline='') as csv_handle:
+        writer = csv.DictWriter(csv_handle, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+#
+# ##### ENTRY POINT
+#
+if __name__ == "__main__":
+
+    if len(sys.argv) < 3:
+        print('Usage: python3 sweep.py labels.json grid.json [output.csv]')
+        print('       python3 sweep.py --morph labels.json [output.csv]')
+        sys.exit(1)
+
+    if sys.argv[1] == '--morph':
+        with open(sys.argv[2], 'r') as labels_handle:
+            sweep_labels = json.load(labels_handle)
+        morph_results = benchmark_morph(sweep_labels, morph_benchmark_scales)
+        for morph_result in morph_results:
+            print(morph_result)
+        if len(sys.argv) >= 4:
+            save_csv(morph_results, sys.argv[3])
+
+    else:
+        with open(sys.argv[1], 'r') as labels_handle:
+            sweep_labels = json.load(labels_handle)
+        with open(sys.argv[2], 'r') as grid_handle:
+            sweep_grid = json.load(grid_handle)
+
+        sweep_results = run_sweep(sweep_labels, sweep_grid)
+        sweep_summaries = summarise(sweep_results)
+        for sweep_summary in sweep_summaries:
+            print(sweep_summary)
+        if len(sys.argv) >= 4:
+            save_csv(sweep_results, sys.argv[3])
+            save_csv(sweep_summaries, '%s-summary.csv' % sys.argv[3][:-4])
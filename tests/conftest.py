@@ -0,0 +1,21 @@
+import os
+import sys
+import pytest
+
+# The application's modules sit at the top level of the repository, rather than in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from clip import Clip
+from frame import Frame
+from subject import Subject
+from sweep import _save_class_settings, _restore_class_settings
+
+
+@pytest.fixture(autouse=True)
+def restore_class_settings():
+    """ Clip, Frame and Subject settings are class attributes shared by every test, so restore them after each test
+        rather than letting one test's setup() leak into the next.
+    """
+    saved_settings = _save_class_settings([Clip, Frame, Subject])
+    yield
+    _restore_class_settings(saved_settings)
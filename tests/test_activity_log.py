@@ -0,0 +1,64 @@
+import os
+from datetime import datetime, timedelta
+import pytest
+from activity_log import ActivityLog
+
+
+@pytest.fixture
+def log_prefix(tmp_path):
+    ActivityLog._buffer = []
+    ActivityLog.setup(str(tmp_path / 'activity_log.json'), max_buffered=3)
+    yield str(tmp_path / 'activity_log')
+    ActivityLog._buffer = []
+
+
+def day_fullpath(log_prefix, days_ago):
+    return '%s-%s.log' % (log_prefix, (datetime.now() - timedelta(days=days_ago)).strftime('%Y%m%d'))
+
+
+def test_entries_are_buffered_until_flushed_or_full(log_prefix):
+    ActivityLog.add_entry('First')
+    ActivityLog.add_entry('Second')
+    assert not os.path.exists(day_fullpath(log_prefix, 0))
+    ActivityLog.add_entry('Third')
+    with open(day_fullpath(log_prefix, 0)) as log_handle:
+        lines = log_handle.read().splitlines()
+    assert [line[29:] for line in lines] == ['First', 'Second', 'Third']
+    assert lines[0][26:29] == ' - '
+    ActivityLog.add_entry('Fourth')
+    assert [line[29:] for line in ActivityLog.get_entire_log()] == ['First', 'Second', 'Third', 'Fourth']
+
+
+def test_cleanup_removes_only_whole_old_days(log_prefix):
+    for days_ago in [0, 1, 5, 10]:
+        with open(day_fullpath(log_prefix, days_ago), 'w') as log_handle:
+            log_handle.write('2019-01-01 12:00:00.000000 - Day %d\n' % days_ago)
+    # Other files sharing the prefix are left alone
+    open('%s-notes.log' % log_prefix, 'w').close()
+    removed = ActivityLog.cleanup_by_date(num_days_to_keep=2)
+    assert sorted(removed) == sorted([day_fullpath(log_prefix, 5), day_fullpath(log_prefix, 10)])
+    assert [line[29:] for line in ActivityLog.get_entire_log()] == ['Day 1', 'Day 0']
+    assert os.path.exists('%s-notes.log' % log_prefix)
+
+
+def test_counters_are_totalled_and_persisted(log_prefix):
+    ActivityLog.add_entry('*** Started KDCam Application! ***', counters={'app_restarts': 1})
+    ActivityLog.add_entry('Video Total Time: 12.50s', counters={'processing_secs': 12.5})
+    ActivityLog.add_entry('Video Total Time: 7.25s', counters={'processing_secs': 7.25})
+    assert ActivityLog.get_counter('app_restarts') == 1
+    assert ActivityLog.get_counter('processing_secs') == pytest.approx(19.75)
+    assert ActivityLog.get_counter('unknown') == 0
+
+    ActivityLog.flush()
+    ActivityLog._counters = {}
+    ActivityLog.setup('%s.json' % log_prefix)
+    assert ActivityLog.get_counter('processing_secs') == pytest.approx(19.75)
+
+
+def test_cleanup_removes_old_days_counters(log_prefix):
+    old_day = (datetime.now() - timedelta(days=10)).strftime('%Y%m%d')
+    ActivityLog._counters = {old_day: {'app_restarts': 3}}
+    ActivityLog.add_entry('*** Started KDCam Application! ***', counters={'app_restarts': 1})
+    assert ActivityLog.get_counter('app_restarts') == 4
+    ActivityLog.cleanup_by_date(num_days_to_keep=7)
+    assert ActivityLog.get_counter('app_restarts') == 1
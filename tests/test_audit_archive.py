@@ -0,0 +1,21 @@
+import numpy
+from audit_archive import AuditArchive
+
+
+def test_audits_are_written_to_the_archive(tmp_path):
+    archive = AuditArchive(str(tmp_path / 'audit' / 'clip-Audit.npz'))
+    assert archive.add(3000, {'threshold': numpy.ones((2, 2))}, [{'area': 5}])
+    assert archive.write_next(timeout=0.1)
+    assert not archive.write_next(timeout=0.01)
+    archive.close()
+    with numpy.load(str(tmp_path / 'audit' / 'clip-Audit.npz')) as audit:
+        assert sorted(audit.files) == ['frame3000-subject0-area', 'frame3000-threshold']
+        assert audit['frame3000-subject0-area'] == 5
+
+
+def test_add_does_not_block_once_the_writer_has_stopped(tmp_path):
+    archive = AuditArchive(str(tmp_path / 'clip-Audit.npz'), max_queued=1)
+    assert archive.add(1000, {}, [])
+    archive.writer_stopped = True
+    # The queue is full, and will never be emptied - so the audit is dropped rather than waiting forever
+    assert not archive.add(2000, {}, [])
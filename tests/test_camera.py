@@ -0,0 +1,48 @@
+import pytest
+from camera import CameraProfiles, FairScheduler
+
+
+def test_camera_profile_overrides_default():
+    CameraProfiles.setup(default_profile={'source_size_x': 3072, 'masks': ['default'], 'trigger_zones': []},
+                         camera_profiles={'Door': {'source_size_x': 1920}})
+    assert CameraProfiles.get('Door') == {'source_size_x': 1920, 'masks': ['default'], 'trigger_zones': []}
+    assert CameraProfiles.get('Garden')['source_size_x'] == 3072
+    assert CameraProfiles.get(None)['source_size_x'] == 3072
+
+
+def test_fair_scheduler_interleaves_cameras():
+    videos = ['A-20240101-1200-00000.mp4', 'A-20240101-1201-00000.mp4', 'A-20240101-1202-00000.mp4',
+              'B-20240101-1230-00000.mp4', 'C-20240101-1215-00000.mp4']
+    assert FairScheduler().order(videos) == ['A-20240101-1200-00000.mp4', 'B-20240101-1230-00000.mp4',
+                                             'C-20240101-1215-00000.mp4', 'A-20240101-1201-00000.mp4',
+                                             'A-20240101-1202-00000.mp4']
+
+
+def test_fair_scheduler_rotates_after_each_camera_is_served():
+    scheduler = FairScheduler()
+    assert scheduler.camera_order(['B', 'A', None, 'C']) == [None, 'A', 'B', 'C']
+    scheduler.mark_served('A')
+    assert scheduler.camera_order(['B', 'A', None, 'C']) == ['B', 'C', None, 'A']
+    # A camera with nothing pending is skipped, without losing its place
+    scheduler.mark_served('B')
+    assert scheduler.camera_order(['A', 'C']) == ['C', 'A']
+
+
+@pytest.mark.parametrize('busy_clips', [10, 100])
+def test_fair_scheduler_does_not_starve_quiet_cameras(busy_clips):
+    """ Processing one video at a time, re-ordering before each as VideoProcessing does - every camera with pending
+        videos is served within each round of len(cameras) videos, however many the busy camera has.
+    """
+    pending = ['Tree-20240101-%04d-00000.mp4' % (1200 + minute) for minute in range(busy_clips)]
+    pending += ['Door-20240101-1300-00000.mp4', 'Drive-20240101-1300-00000.mp4', 'Drive-20240101-1301-00000.mp4']
+    scheduler = FairScheduler()
+    served = []
+    while pending:
+        video = scheduler.order(pending)[0]
+        pending.remove(video)
+        camera = video.split('-')[0]
+        scheduler.mark_served(camera)
+        served.append(camera)
+    assert served[:3] == ['Door', 'Drive', 'Tree']
+    assert served[3:5] == ['Drive', 'Tree']
+    assert served[5:] == ['Tree'] * (busy_clips - 2)
@@ -0,0 +1,78 @@
+import os
+from types import SimpleNamespace
+import pytest
+from checkpoint import ClipCheckpoint
+from frame import Frame
+
+
+@pytest.fixture
+def video_fullpath(tmp_path):
+    Frame.setup_dimensions(source_size_x=3072, source_size_y=1728, large_size_x=1536, medium_size_x=768,
+                           small_size_x=384)
+    fullpath = str(tmp_path / 'Door-20240101-1200-00000.mp4')
+    with open(fullpath, 'wb') as video_handle:
+        video_handle.write(b'video')
+    return fullpath
+
+
+def save_composites(tmp_path, basename, index):
+    composite_paths = [str(tmp_path / ('%s-%d-%s.jpg' % (basename, index, layer))) for layer in ['CP', 'CF']]
+    for composite_path in composite_paths:
+        open(composite_path, 'w').close()
+    return composite_paths
+
+
+def add_segment(checkpoint, tmp_path, basename, index):
+    segment = SimpleNamespace(index=index, start_time=index * 10000, end_time=(index + 1) * 10000,
+                              trigger_zones=['Path'])
+    checkpoint.add_segment(segment, time_increment=250, composite_paths=save_composites(tmp_path, basename, index))
+
+
+def test_checkpoint_round_trip(tmp_path, video_fullpath):
+    checkpoint = ClipCheckpoint(video_fullpath)
+    add_segment(checkpoint, tmp_path, 'Door-20240101-1200', 0)
+    add_segment(checkpoint, tmp_path, 'Door-20240101-1200', 1)
+
+    resumed = ClipCheckpoint(video_fullpath)
+    segments = resumed.load('Door-20240101-1200')
+    assert [(segment['index'], segment['start_time'], segment['end_time']) for segment in segments] == \
+        [(0, 0, 10000), (1, 10000, 20000)]
+    assert segments[0]['trigger_zones'] == ['Path']
+    assert resumed.time_increment == 250
+
+    resumed.remove()
+    assert ClipCheckpoint(video_fullpath).load('Door-20240101-1200') == []
+
+
+def test_composites_renamed_with_a_suffix_are_still_found(tmp_path, video_fullpath):
+    checkpoint = ClipCheckpoint(video_fullpath)
+    add_segment(checkpoint, tmp_path, 'Door-20240101-1200', 0)
+    # As file_handling.rename_basename_append does when a second segment is output
+    for filename in os.listdir(str(tmp_path)):
+        if filename.endswith('.jpg'):
+            os.rename(str(tmp_path / filename), str(tmp_path / filename.replace('1200-', '1200A-')))
+    assert len(ClipCheckpoint(video_fullpath).load('Door-20240101-1200')) == 1
+    # But only for the clip's own basename
+    assert ClipCheckpoint(video_fullpath).load('Door-20240101-120') == []
+
+
+def test_only_contiguous_segments_with_all_composites_are_trusted(tmp_path, video_fullpath):
+    checkpoint = ClipCheckpoint(video_fullpath)
+    for index in range(3):
+        add_segment(checkpoint, tmp_path, 'Door-20240101-1200', index)
+    os.remove(str(tmp_path / 'Door-20240101-1200-1-CF.jpg'))
+    assert [segment['index'] for segment in ClipCheckpoint(video_fullpath).load('Door-20240101-1200')] == [0]
+
+
+def test_checkpoint_is_ignored_if_the_video_or_dimensions_change(tmp_path, video_fullpath):
+    add_segment(ClipCheckpoint(video_fullpath), tmp_path, 'Door-20240101-1200', 0)
+    Frame.setup_dimensions(source_size_x=3072, source_size_y=1728, large_size_x=1024, medium_size_x=768,
+                           small_size_x=384)
+    assert ClipCheckpoint(video_fullpath).load('Door-20240101-1200') == []
+
+    Frame.setup_dimensions(source_size_x=3072, source_size_y=1728, large_size_x=1536, medium_size_x=768,
+                           small_size_x=384)
+    assert len(ClipCheckpoint(video_fullpath).load('Door-20240101-1200')) == 1
+    with open(video_fullpath, 'ab') as video_handle:
+        video_handle.write(b'more')
+    assert ClipCheckpoint(video_fullpath).load('Door-20240101-1200') == []
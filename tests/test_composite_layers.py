@@ -0,0 +1,64 @@
+import random
+from types import SimpleNamespace
+import numpy
+import pytest
+from clip import Clip, Segment
+from subject import Subject
+
+dimensions_numpy = (120, 200)
+
+
+class FakeFrame:
+    """ Just the parts of Frame used when rendering composites - a 'large' image, unique to each frame. """
+
+    def __init__(self, value):
+        self._img = numpy.full(dimensions_numpy + (3,), value, numpy.uint8)
+        self.dimensions_numpy = SimpleNamespace(large=dimensions_numpy)
+
+    def get_img(self, img_type):
+        return self._img
+
+
+def make_subject(x, y, size):
+    contour = numpy.array([[[x, y]], [[x + size, y]], [[x + size, y + size]], [[x, y + size]]], numpy.int32)
+    subject = Subject(contour)
+    subject._is_active = True
+    return subject
+
+
+def make_clip_and_segment(seed):
+    """ A Clip (without a video) with a segment of randomly placed, often overlapping, subjects. """
+    Subject.setup(bounds_padding=2, annotate_line_colour=(0, 255, 255), absolute_intensity_threshold=40,
+                  min_difference_area_percent=0.05, min_difference_area_pixels=10, dilate_pixels=5)
+    Subject.setup_dimensions_numpy(dimensions_numpy)
+    rng = random.Random(seed)
+    clip = Clip.__new__(Clip)
+    clip.frames = {0: FakeFrame(0)}
+    clip.base_frame = clip.frames[0]
+    segment = Segment(0, 0, 10000, [])
+    for time in range(1000, 10000, 1000):
+        clip.frames[time] = FakeFrame(time // 1000 * 20)
+        segment.subjects.add_frame(time, [make_subject(rng.randrange(0, 170), rng.randrange(0, 90),
+                                                       rng.randrange(5, 25)) for _ in range(rng.randrange(0, 4))])
+    return clip, segment
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_layers_match_repeated_fallback(seed):
+    clip, segment = make_clip_and_segment(seed)
+    num_layers = clip.get_composite_layers(segment)
+
+    expected_clip, expected_segment = make_clip_and_segment(seed)
+    while True:
+        try:
+            expected_clip.get_composite_fallback(expected_segment)
+        except EOFError:
+            break
+
+    assert num_layers == len(expected_segment.composites)
+    for composite, expected in zip(segment.composites, expected_segment.composites):
+        assert numpy.array_equal(composite['composite'], expected['composite'])
+        assert numpy.array_equal(composite['mask'], expected['mask'])
+    # Every subject has been used in exactly one layer
+    assert len(segment.subjects.available_rows()) == 0
+
@@ -0,0 +1,46 @@
+from content_index import ContentIndex
+
+
+def write_video(fullpath, content):
+    with open(fullpath, 'wb') as video_handle:
+        video_handle.write(content)
+    return fullpath
+
+
+def test_hash_depends_on_content_not_name(tmp_path):
+    index = ContentIndex(str(tmp_path / 'index.jsonl'), sample_mb=0.001)
+    content = bytes(range(256)) * 20
+    first = index.content_hash(write_video(str(tmp_path / 'a.mp4'), content))
+    assert index.content_hash(write_video(str(tmp_path / 'b.mp4'), content)) == first
+    # A change within the sampled end of the file, or to its size, changes the hash
+    assert index.content_hash(write_video(str(tmp_path / 'c.mp4'), content[:-1] + b'x')) != first
+    assert index.content_hash(write_video(str(tmp_path / 'd.mp4'), content + b'x')) != first
+
+
+def test_small_video_is_hashed_whole(tmp_path):
+    index = ContentIndex(str(tmp_path / 'index.jsonl'))
+    first = index.content_hash(write_video(str(tmp_path / 'a.mp4'), b'small video'))
+    assert index.content_hash(write_video(str(tmp_path / 'b.mp4'), b'small vidEo')) != first
+
+
+def test_entries_are_persisted_and_latest_wins(tmp_path):
+    index = ContentIndex(str(tmp_path / 'index.jsonl'))
+    assert index.get('abc') is None
+    index.add('abc', {'basename': 'first'})
+    index.add('abc', {'basename': 'second'})
+    index.add('def', {'basename': 'other'})
+    assert index.get('abc') == {'basename': 'second', 'hash': 'abc'}
+
+    reloaded = ContentIndex(str(tmp_path / 'index.jsonl'))
+    assert reloaded.get('abc')['basename'] == 'second'
+    assert reloaded.get('def')['basename'] == 'other'
+
+
+def test_partially_written_line_is_ignored(tmp_path):
+    index = ContentIndex(str(tmp_path / 'index.jsonl'))
+    index.add('abc', {'basename': 'first'})
+    with open(str(tmp_path / 'index.jsonl'), 'a') as index_handle:
+        index_handle.write('{"hash": "def", "base')
+    reloaded = ContentIndex(str(tmp_path / 'index.jsonl'))
+    assert reloaded.get('abc')['basename'] == 'first'
+    assert reloaded.get('def') is None
@@ -0,0 +1,111 @@
+import os
+import json
+import time
+from distributed import LeaseManager, SharedClipData
+
+
+def age_file(fullpath, secs):
+    old_time = time.time() - secs
+    os.utime(fullpath, (old_time, old_time))
+
+
+#
+# ##### LEASES
+#
+def test_only_one_node_can_claim_a_video(tmp_path):
+    node_a = LeaseManager(str(tmp_path), 'node_a', expiry_secs=60)
+    node_b = LeaseManager(str(tmp_path), 'node_b', expiry_secs=60)
+    assert node_a.claim('Door-20240101-1200-00000.mp4')
+    assert not node_b.claim('Door-20240101-1200-00000.mp4')
+    assert not node_a.claim('Door-20240101-1200-00000.mp4')
+    # Videos in sub-folders each get their own lease
+    assert node_b.claim(os.path.join('2024-01-01', 'Door-20240101-1200-00000.mp4'))
+
+
+def test_released_video_can_be_claimed_again(tmp_path):
+    node_a = LeaseManager(str(tmp_path), 'node_a', expiry_secs=60)
+    node_b = LeaseManager(str(tmp_path), 'node_b', expiry_secs=60)
+    assert node_a.claim('Door-20240101-1200-00000.mp4')
+    node_a.release('Door-20240101-1200-00000.mp4')
+    assert node_b.claim('Door-20240101-1200-00000.mp4')
+
+
+def test_expired_lease_is_taken_over(tmp_path):
+    node_a = LeaseManager(str(tmp_path), 'node_a', expiry_secs=60)
+    node_b = LeaseManager(str(tmp_path), 'node_b', expiry_secs=60)
+    assert node_a.claim('Door-20240101-1200-00000.mp4')
+    lease_fullpath = node_a._lease_fullpath('Door-20240101-1200-00000.mp4')
+    age_file(lease_fullpath, 30)
+    assert not node_b.claim('Door-20240101-1200-00000.mp4')
+    age_file(lease_fullpath, 120)
+    assert node_b.claim('Door-20240101-1200-00000.mp4')
+    with open(lease_fullpath) as lease_handle:
+        assert json.load(lease_handle)['node'] == 'node_b'
+    # No stale lease files are left behind
+    assert os.listdir(str(tmp_path)) == [os.path.basename(lease_fullpath)]
+
+
+def test_heartbeat_keeps_a_lease_live(tmp_path):
+    node_a = LeaseManager(str(tmp_path), 'node_a', expiry_secs=60)
+    node_b = LeaseManager(str(tmp_path), 'node_b', expiry_secs=60)
+    assert node_a.claim('Door-20240101-1200-00000.mp4')
+    age_file(node_a._lease_fullpath('Door-20240101-1200-00000.mp4'), 120)
+    node_a.heartbeat()
+    assert not node_b.claim('Door-20240101-1200-00000.mp4')
+
+
+def test_lost_lease_is_dropped_and_not_released(tmp_path):
+    node_a = LeaseManager(str(tmp_path), 'node_a', expiry_secs=60)
+    node_b = LeaseManager(str(tmp_path), 'node_b', expiry_secs=60)
+    assert node_a.claim('Door-20240101-1200-00000.mp4')
+    lease_fullpath = node_a._lease_fullpath('Door-20240101-1200-00000.mp4')
+    age_file(lease_fullpath, 120)
+    assert node_b.claim('Door-20240101-1200-00000.mp4')
+    node_a.heartbeat()
+    assert lease_fullpath not in node_a._held
+    # Releasing after the lease was taken over must not remove node_b's lease
+    node_a.release('Door-20240101-1200-00000.mp4')
+    assert os.path.exists(lease_fullpath)
+
+
+#
+# ##### SHARED CLIP DATA
+#
+def test_shared_clip_data_merges_nodes_keeping_the_latest_entry(tmp_path):
+    node_a = SharedClipData(str(tmp_path), 'node_a')
+    node_b = SharedClipData(str(tmp_path), 'node_b')
+    node_a.add({'basename': 'clip1', 'timestamp': '2024-01-01 12:00:00', 'node': 'node_a'})
+    node_b.add({'basename': 'clip2', 'timestamp': '2024-01-01 12:01:00', 'node': 'node_b'})
+    node_b.add({'basename': 'clip1', 'timestamp': '2024-01-01 12:02:00', 'node': 'node_b'})
+    assert [(entry['basename'], entry['node']) for entry in node_a.get_all()] == [('clip2', 'node_b'),
+                                                                                  ('clip1', 'node_b')]
+    assert node_a.contains('clip2') and not node_a.contains('clip3')
+
+
+def test_shared_clip_data_reads_only_new_complete_lines(tmp_path):
+    reader = SharedClipData(str(tmp_path), 'reader')
+    writer = SharedClipData(str(tmp_path), 'writer')
+    writer.add({'basename': 'clip1', 'timestamp': '2024-01-01 12:00:00'})
+    assert reader.contains('clip1')
+    offset = reader._read_to['clip_data-writer.jsonl'][0]
+
+    # A line still being written by another node is left until it's complete
+    with open(os.path.join(str(tmp_path), 'clip_data-writer.jsonl'), 'a') as data_handle:
+        data_handle.write('{"basename": "clip2", "time')
+    assert not reader.contains('clip2')
+    assert reader._read_to['clip_data-writer.jsonl'][0] == offset
+    with open(os.path.join(str(tmp_path), 'clip_data-writer.jsonl'), 'a') as data_handle:
+        data_handle.write('stamp": "2024-01-01 12:01:00"}\n')
+    assert reader.contains('clip2')
+    assert reader.contains('clip1')
+
+
+def test_shared_clip_data_rereads_a_replaced_file(tmp_path):
+    reader = SharedClipData(str(tmp_path), 'reader')
+    writer = SharedClipData(str(tmp_path), 'writer')
+    writer.add({'basename': 'clip1', 'timestamp': '2024-01-01 12:00:00'})
+    writer.add({'basename': 'clip2', 'timestamp': '2024-01-01 12:01:00'})
+    assert reader.contains('clip1')
+    os.remove(os.path.join(str(tmp_path), 'clip_data-writer.jsonl'))
+    writer.add({'basename': 'clip3', 'timestamp': '2024-01-01 12:02:00'})
+    assert [entry['basename'] for entry in reader.get_all()] == ['clip3']
@@ -0,0 +1,53 @@
+import struct
+import pytest
+from file_handling import get_file_metadata, probe_mp4
+
+
+def box(box_type, payload=b''):
+    return struct.pack('>I4s', 8 + len(payload), box_type) + payload
+
+
+def write_video(tmp_path, content, filename='Door-20240101-1200-00000.mp4'):
+    fullpath = str(tmp_path / filename)
+    with open(fullpath, 'wb') as video_handle:
+        video_handle.write(content)
+    return fullpath
+
+
+@pytest.mark.parametrize('content, expected', [
+    (box(b'ftyp', b'isom') + box(b'moov', b'x' * 20) + box(b'mdat', b'y' * 100), 'ok'),
+    # mdat may come before moov, e.g. if not saved with faststart
+    (box(b'ftyp', b'isom') + box(b'mdat', b'y' * 100) + box(b'moov', b'x' * 20), 'ok'),
+    # The last box is truncated, e.g. an incomplete upload
+    (box(b'ftyp', b'isom') + box(b'moov', b'x' * 20) + box(b'mdat', b'y' * 100)[:-10], 'repairable'),
+    (box(b'ftyp', b'isom') + box(b'moov', b'x' * 20), 'repairable'),
+    (box(b'ftyp', b'isom') + box(b'mdat', b'y' * 100), 'unrecoverable'),
+    (b'not an mp4 file at all', 'unrecoverable'),
+    (b'', 'unrecoverable'),
+])
+def test_probe_mp4(tmp_path, content, expected):
+    assert probe_mp4(write_video(tmp_path, content)) == expected
+
+
+def test_probe_mp4_handles_64_bit_and_to_end_sizes(tmp_path):
+    large_mdat = struct.pack('>I4sQ', 1, b'mdat', 16 + 50) + b'y' * 50
+    to_end_mdat = struct.pack('>I4s', 0, b'mdat') + b'y' * 50
+    assert probe_mp4(write_video(tmp_path, box(b'moov', b'x' * 20) + large_mdat)) == 'ok'
+    assert probe_mp4(write_video(tmp_path, box(b'moov', b'x' * 20) + to_end_mdat)) == 'ok'
+
+
+def test_probe_mp4_only_probes_mp4_files(tmp_path):
+    assert probe_mp4(write_video(tmp_path, b'anything', filename='stream.mkv')) == 'ok'
+    assert probe_mp4(str(tmp_path / 'missing.mp4')) == 'unrecoverable'
+
+
+@pytest.mark.parametrize('video, camera', [
+    ('XXCam_01_20180517203949574.mp4', 'XXCam'),
+    ('XXCam_01_20190517203949.mp4', 'XXCam'),
+    ('2019/01/01/XXCam-20180502-1727-34996.mp4', 'XXCam'),
+    ('XXCam-01-20180502-1727-34996.mp4', 'XXCam-01'),
+    ('XXCam-02-20180502-1727-34996.mp4', 'XXCam-02'),
+    ('unrecognised.mp4', None),
+])
+def test_camera_is_parsed_from_each_filename_format(video, camera):
+    assert get_file_metadata('/pending', video)['camera'] == camera
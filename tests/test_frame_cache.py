@@ -0,0 +1,57 @@
+import numpy
+import pytest
+from frame import Frame
+from frame_cache import FrameCache
+
+frame_params = {'blur_pixel_width': 7, 'absolute_intensity_threshold': 40, 'morph_radius': 15,
+                'subject_size_threshold': 1500, 'source_size_x': 320, 'source_size_y': 180, 'large_size_x': 160,
+                'medium_size_x': 80, 'small_size_x': 40}
+
+
+@pytest.fixture
+def video_fullpath(tmp_path):
+    Frame.setup(**frame_params)
+    Frame.setup_time_increment(1000)
+    fullpath = str(tmp_path / 'Door-20240101-1200-00000.mp4')
+    with open(fullpath, 'wb') as video_handle:
+        video_handle.write(b'video')
+    return fullpath
+
+
+def write_cache(video_fullpath, greyscale_night, num_frames=3):
+    cache = FrameCache(video_fullpath, 1000, greyscale_night=greyscale_night)
+    cache.open_for_write(frame_count=num_frames, frames_per_second=1, large_shape=(90, 160, 3))
+    for time in range(0, num_frames * 1000, 1000):
+        cache.add_frame(Frame.init_from_image(numpy.full((90, 160, 3), time // 100, numpy.uint8), time, [],
+                                              img_type='large'))
+    cache.close()
+
+
+def open_cache(video_fullpath, greyscale_night):
+    cache = FrameCache(video_fullpath, 1000, greyscale_night=greyscale_night)
+    if not cache.is_valid():
+        return None
+    cache.open_for_read()
+    return cache
+
+
+def test_cached_frames_are_read_back(video_fullpath):
+    write_cache(video_fullpath, greyscale_night=False)
+    cache = open_cache(video_fullpath, greyscale_night=False)
+    assert cache.frame_count == 3
+    frame = cache.get_frame(2000, [])
+    assert frame.get_img('large').shape == (90, 160, 3) and frame.get_img('large')[0, 0, 0] == 20
+    with pytest.raises(EOFError):
+        cache.get_frame(3000, [])
+
+
+def test_cache_is_only_valid_for_the_same_greyscale_night_setting(video_fullpath):
+    write_cache(video_fullpath, greyscale_night=False)
+    assert open_cache(video_fullpath, greyscale_night=True) is None
+    assert open_cache(video_fullpath, greyscale_night=False) is not None
+
+
+def test_colour_frames_are_converted_when_greyscale(video_fullpath):
+    write_cache(video_fullpath, greyscale_night=False)
+    frame = open_cache(video_fullpath, greyscale_night=False).get_frame(1000, [], greyscale=True)
+    assert frame.get_img('large').shape == (90, 160)
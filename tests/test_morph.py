@@ -0,0 +1,65 @@
+import random
+import cv2
+import numpy
+import pytest
+import sweep
+from clip import Clip
+from frame import Frame
+from subject import Subject
+
+frame_params = dict(sweep.frame_defaults, source_size_x=1280, source_size_y=720, large_size_x=640, medium_size_x=320,
+                    small_size_x=160)
+subject_params = sweep.subject_defaults
+
+
+def iou(mask_a, mask_b):
+    return (numpy.count_nonzero(cv2.bitwise_and(mask_a, mask_b))
+            / max(numpy.count_nonzero(cv2.bitwise_or(mask_a, mask_b)), 1))
+
+
+def threshold_img(seed):
+    """ A 'greyblur' sized mask of a few subject-sized blobs, each speckled with small gaps as from a real difference.
+    """
+    rng = random.Random(seed)
+    img = numpy.zeros(Frame.dimensions_numpy.greyblur, numpy.uint8)
+    for _ in range(3):
+        cx, cy = rng.randrange(80, 560), rng.randrange(80, 280)
+        cv2.ellipse(img, (cx, cy), (rng.randrange(20, 60), rng.randrange(30, 70)), rng.randrange(0, 180), 0, 360, 255,
+                    cv2.FILLED)
+        for _ in range(15):
+            cv2.circle(img, (cx + rng.randrange(-40, 40), cy + rng.randrange(-50, 50)), rng.randrange(1, 4), 0,
+                       cv2.FILLED)
+    return img
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_approximate_morph_is_close_to_exact(seed):
+    Frame.setup(**frame_params)
+    img = threshold_img(seed)
+    exact = Frame.morph_close(img).copy()
+    Frame.setup(**dict(frame_params, morph_scale=2))
+    assert iou(Frame.morph_close(img), exact) > 0.85
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_approximate_dilation_is_close_to_exact(seed):
+    Frame.setup(**frame_params)
+    Subject.setup(**subject_params)
+    contours = cv2.findContours(Frame.morph_close(threshold_img(seed)), cv2.RETR_EXTERNAL,
+                                cv2.CHAIN_APPROX_SIMPLE)[Frame._contours_return_index]
+    assert contours
+    for contour in contours:
+        Subject.setup(**subject_params)
+        exact = Subject(contour).dilated_mask
+        Subject.setup(**dict(subject_params, dilate_scale=2))
+        assert iou(Subject(contour).dilated_mask, exact) > 0.85
+
+
+def test_benchmark_restores_settings():
+    Clip.setup(time_increment=500, annotate_line_colour=(0, 0, 255))
+    Frame.setup(**dict(frame_params, morph_radius=9))
+    Subject.setup(**dict(subject_params, dilate_pixels=11))
+    sweep.benchmark_morph([{'video': '/nonexistent.mp4'}], [2])
+    assert Clip._time_increment_default == 500
+    assert Frame._morph_radius == 9 and Frame.dimensions.source == (1280, 720)
+    assert Subject._dilate_pixels == 11 and Subject._dilate_scale == 1
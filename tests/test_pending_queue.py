@@ -0,0 +1,80 @@
+from datetime import datetime, timedelta
+import pytest
+from camera import CameraProfiles
+from pending_queue import PendingQueue
+
+
+@pytest.fixture(autouse=True)
+def camera_profiles():
+    CameraProfiles.setup(default_profile={'masks': [], 'trigger_zones': []},
+                         camera_profiles={'Door': {'trigger_zones': [{'label': 'Path'}]}})
+
+
+def video_name(camera, minutes_ago):
+    recorded = datetime.now() - timedelta(minutes=minutes_ago)
+    return '%s-%s-%s-%02d000.mp4' % (camera, recorded.strftime('%Y%m%d'), recorded.strftime('%H%M'),
+                                     recorded.second)
+
+
+def options(**overrides):
+    queue_options = {'policies': ['newest_first', 'camera_weight', 'trigger_zone_boost'],
+                     'newest_first_points': 10,
+                     'newest_half_life_hours': 1,
+                     'camera_weights': {},
+                     'trigger_zone_boost': 5,
+                     'aging_points_per_hour': 2,
+                     'priority_bucket_points': 5}
+    queue_options.update(overrides)
+    return queue_options
+
+
+def process(queue, pending, count):
+    """ Processes videos one at a time as VideoProcessing does - re-ordering the queue before each one. """
+    processed = []
+    for _ in range(count):
+        video = queue.order(pending, '/nonexistent')[0]
+        pending.remove(video)
+        queue.mark_served(video)
+        processed.append(video)
+    return processed
+
+
+def test_newest_clips_are_processed_first():
+    pending = [video_name('Garden', minutes) for minutes in [600, 300, 5]]
+    queue = PendingQueue(options(policies=['newest_first']))
+    assert queue.order(pending, '/nonexistent') == [pending[2], pending[1], pending[0]]
+
+
+def test_camera_weight_and_trigger_zone_boost_raise_priority():
+    pending = [video_name('Garden', 300), video_name('Door', 300), video_name('Drive', 300)]
+    queue = PendingQueue(options(camera_weights={'Drive': 20}))
+    assert queue.order(pending, '/nonexistent') == [pending[2], pending[1], pending[0]]
+
+
+def test_busy_camera_does_not_starve_the_others():
+    # One camera has uploaded many more clips than the others, all over the same few minutes
+    pending = [video_name('Tree', minutes) for minutes in range(0, 40, 2)]
+    pending += [video_name('Garden', 11), video_name('Garden', 31), video_name('Drive', 21)]
+    queue = PendingQueue(options(policies=['newest_first']))
+    processed = process(queue, list(pending), 6)
+    cameras = [video.split('-')[0] for video in processed]
+    # Every camera gets a turn within the first round, and the busy camera no more than its share
+    assert set(cameras[:3]) == {'Tree', 'Garden', 'Drive'}
+    assert cameras.count('Tree') <= 3
+    assert processed.index(video_name('Garden', 31)) < 6
+
+
+def test_each_camera_gives_its_highest_priority_video_on_its_turn():
+    pending = [video_name('Tree', 30), video_name('Tree', 1), video_name('Garden', 20)]
+    queue = PendingQueue(options(policies=['newest_first'], priority_bucket_points=20))
+    processed = process(queue, list(pending), 3)
+    assert processed[processed.index(video_name('Tree', 1)) + 1:].count(video_name('Tree', 30)) == 1
+    assert processed.index(video_name('Tree', 1)) < processed.index(video_name('Tree', 30))
+
+
+def test_higher_bucket_still_goes_first():
+    pending = [video_name('Tree', minutes) for minutes in range(0, 10, 2)] + [video_name('Garden', 600)]
+    queue = PendingQueue(options(policies=['newest_first']))
+    ordered = queue.order(pending, '/nonexistent')
+    # The ten hour old clip scores almost nothing, so waits behind the fresh ones
+    assert ordered[-1] == video_name('Garden', 600)
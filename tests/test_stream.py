@@ -0,0 +1,48 @@
+import pytest
+from clip import Clip
+from frame import Frame
+
+
+class FakeStream:
+    """ Just the parts of cv2.VideoCapture used when reading a stream - counts the frames grabbed, up to a limit. """
+
+    def __init__(self, num_frames):
+        self.num_frames = num_frames
+        self.num_grabbed = 0
+        self.retrieved = []
+
+    def grab(self):
+        if self.num_grabbed >= self.num_frames:
+            return False
+        self.num_grabbed += 1
+        return True
+
+
+@pytest.fixture
+def stream_clip(monkeypatch):
+    def init_from_video_grabbed(video_capture, time, frames_required_for, greyscale=False):
+        video_capture.retrieved.append((video_capture.num_grabbed, time))
+        return time
+    monkeypatch.setattr(Frame, 'init_from_video_grabbed', init_from_video_grabbed)
+
+    clip = Clip.__new__(Clip)
+    clip._video_capture = FakeStream(num_frames=100)
+    clip._frames_per_second = 10
+    clip._stream_realtime = False
+    clip._stream_frames_grabbed = 0
+    return clip
+
+
+def test_stream_frame_times_come_from_the_frame_count(stream_clip):
+    for time in [0, 250, 500, 1000, 1050]:
+        stream_clip._get_stream_frame(time, [])
+    # At 10fps each frame is 100ms apart - frame n (counting from 1) is at (n - 1) * 100ms, and the first frame at or
+    #  after each time is decoded
+    assert stream_clip._video_capture.retrieved == [(1, 0), (4, 250), (6, 500), (11, 1000), (12, 1050)]
+
+
+def test_stream_end_raises_eof(stream_clip):
+    stream_clip._get_stream_frame(9900, [])
+    assert stream_clip._video_capture.num_grabbed == 100
+    with pytest.raises(EOFError):
+        stream_clip._get_stream_frame(10000, [])
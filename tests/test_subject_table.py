@@ -0,0 +1,90 @@
+import numpy
+import pytest
+from subject_table import SubjectTable
+from track import Track
+
+
+class FakeSubject:
+    """ Just the parts of Subject recorded by SubjectTable. """
+
+    def __init__(self, cx, cy, area=100, is_active=True):
+        self.contour_area = area
+        self.contour_center = (cx, cy)
+        self.bounds = (cx - 5, cy - 5, 10, 10)
+        self.is_active = is_active
+        self.is_used = False
+        self.is_tracked = False
+
+
+def zone_mask(x1, y1, x2, y2):
+    mask = numpy.zeros((100, 200), numpy.uint8)
+    mask[y1:y2, x1:x2] = 255
+    return mask
+
+
+def test_rows_are_added_in_frame_then_subject_order_and_grow():
+    table = SubjectTable(initial_capacity=1)
+    subjects = [FakeSubject(10, 10), FakeSubject(20, 20), FakeSubject(30, 30)]
+    table.add_frame(1000, subjects[:2])
+    table.add_frame(2000, subjects[2:])
+    assert len(table) == 3
+    assert list(table.rows['time']) == [1000, 1000, 2000]
+    assert list(table.rows['cx']) == [10, 20, 30]
+    assert table.get_subject(2) is subjects[2]
+
+
+def test_restrict_to_keeps_rows_within_the_segment():
+    table = SubjectTable()
+    subjects = [FakeSubject(10, 10), FakeSubject(20, 20), FakeSubject(30, 30)]
+    for time, subject in zip([0, 1000, 2000], subjects):
+        table.add_frame(time, [subject])
+    table.restrict_to(0, 2000)
+    assert list(table.rows['time']) == [1000]
+    assert table.get_subject(0) is subjects[1]
+
+
+def test_available_rows_and_mark_used():
+    table = SubjectTable()
+    subjects = [FakeSubject(10, 10), FakeSubject(20, 20, is_active=False), FakeSubject(30, 30)]
+    table.add_frame(1000, subjects)
+    assert list(table.available_rows()) == [0, 2]
+    table.mark_used(0)
+    assert subjects[0].is_used
+    assert list(table.available_rows()) == [2]
+    assert list(table.available_rows(skip_is_used=True)) == [0, 2]
+
+
+def test_add_tracks_excludes_tracked_subjects():
+    table = SubjectTable()
+    subjects = [FakeSubject(10, 10), FakeSubject(12, 10)]
+    table.add_frame(1000, subjects[:1])
+    table.add_frame(2000, subjects[1:])
+    track = Track(7)
+    track.add_subject(1000, subjects[0])
+    track.add_subject(2000, subjects[1])
+    subjects[1].is_tracked = True
+    table.add_tracks([track])
+    assert list(table.rows['track']) == [7, 7]
+    assert list(table.available_rows()) == [0]
+
+
+def test_primary_row_is_nearest_of_the_large_enough_subjects():
+    table = SubjectTable()
+    table.add_frame(1000, [FakeSubject(10, 10, area=100), FakeSubject(90, 90, area=1000),
+                           FakeSubject(100, 50, area=900)])
+    assert table.primary_row((95, 50), min_fraction_of_max_area=0.5) == 2
+    assert table.primary_row((95, 50), min_fraction_of_max_area=0.95) == 1
+    with pytest.raises(EOFError):
+        SubjectTable().primary_row((0, 0), 0.5)
+
+
+def test_first_row_within_finds_the_earliest_subject_in_the_zone():
+    table = SubjectTable()
+    table.add_frame(1000, [FakeSubject(10, 10), FakeSubject(150, 50, is_active=False)])
+    table.add_frame(2000, [FakeSubject(150, 50)])
+    left_zone, right_zone = zone_mask(0, 0, 50, 50), zone_mask(100, 0, 200, 100)
+    assert table.first_row_within(left_zone) == 0
+    assert table.first_row_within(right_zone) == 1
+    # The inactive subject at 1000ms is ignored, leaving the one at 2000ms
+    assert table.first_row_within(right_zone, only_active=True) == 2
+    assert table.first_row_within(zone_mask(60, 60, 90, 90)) is None
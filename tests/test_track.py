@@ -0,0 +1,145 @@
+import math
+import random
+import itertools
+import numpy
+import pytest
+from track import Tracker, _linear_sum_assignment, _rects_iou
+
+
+class FakeSubject:
+    """ Just the parts of Subject used by Tracker - a rect, and its centre. """
+
+    def __init__(self, x, y, w=20, h=20):
+        self.bounds = (x, y, w, h)
+        self.contour_center = (x + w // 2, y + h // 2)
+
+    def dist_from_point(self, point_xy):
+        return math.hypot(self.contour_center[0] - point_xy[0], self.contour_center[1] - point_xy[1])
+
+
+def brute_force_cost(cost):
+    """ Lowest total cost of any assignment, by trying every one - only practical for small matrices. """
+    num_rows, num_cols = cost.shape
+    if num_rows <= num_cols:
+        return min(sum(cost[row, col] for row, col in zip(range(num_rows), cols))
+                   for cols in itertools.permutations(range(num_cols), num_rows))
+    return min(sum(cost[row, col] for row, col in zip(rows, range(num_cols)))
+               for rows in itertools.permutations(range(num_rows), num_cols))
+
+
+def assert_valid_assignment(cost, pairs):
+    rows = [row for row, _ in pairs]
+    cols = [col for _, col in pairs]
+    assert len(pairs) == min(cost.shape)
+    assert len(set(rows)) == len(rows) and len(set(cols)) == len(cols)
+    assert all(0 <= row < cost.shape[0] and 0 <= col < cost.shape[1] for row, col in pairs)
+
+
+#
+# ##### ASSIGNMENT
+#
+@pytest.mark.parametrize('shape', [(1, 1), (3, 3), (5, 5), (2, 5), (5, 2), (1, 4), (4, 1), (3, 6)])
+def test_assignment_matches_brute_force(shape):
+    rng = random.Random(sum(shape))
+    for _ in range(20):
+        cost = numpy.array([[rng.uniform(0, 2) for _ in range(shape[1])] for _ in range(shape[0])])
+        pairs = _linear_sum_assignment(cost)
+        assert_valid_assignment(cost, pairs)
+        assert sum(cost[row, col] for row, col in pairs) == pytest.approx(brute_force_cost(cost))
+
+
+def test_assignment_with_infeasible_costs_avoids_them_where_possible():
+    infeasible = Tracker._infeasible_cost
+    cost = numpy.array([[infeasible, 0.5, infeasible],
+                        [0.2, infeasible, infeasible],
+                        [infeasible, infeasible, infeasible]])
+    pairs = _linear_sum_assignment(cost)
+    assert_valid_assignment(cost, pairs)
+    assert (0, 1) in pairs and (1, 0) in pairs
+    assert sum(cost[row, col] for row, col in pairs) == pytest.approx(brute_force_cost(cost))
+
+
+def test_assignment_all_infeasible_still_returns_a_full_assignment():
+    cost = numpy.full((3, 2), Tracker._infeasible_cost)
+    pairs = _linear_sum_assignment(cost)
+    assert_valid_assignment(cost, pairs)
+
+
+def test_assignment_with_ties():
+    cost = numpy.ones((4, 4))
+    pairs = _linear_sum_assignment(cost)
+    assert_valid_assignment(cost, pairs)
+    assert sum(cost[row, col] for row, col in pairs) == pytest.approx(4)
+
+    cost = numpy.array([[0.0, 0.0, 1.0],
+                        [0.0, 0.0, 1.0]])
+    pairs = _linear_sum_assignment(cost)
+    assert_valid_assignment(cost, pairs)
+    assert sum(cost[row, col] for row, col in pairs) == pytest.approx(0)
+
+
+def test_rects_iou():
+    assert _rects_iou((0, 0, 10, 10), (0, 0, 10, 10)) == pytest.approx(1)
+    assert _rects_iou((0, 0, 10, 10), (5, 0, 10, 10)) == pytest.approx(50 / 150)
+    assert _rects_iou((0, 0, 10, 10), (10, 0, 10, 10)) == 0
+
+
+#
+# ##### TRACKER
+#
+def test_tracker_links_subjects_across_consecutive_frames():
+    tracker = Tracker(time_increment=1000)
+    left, right = FakeSubject(0, 0), FakeSubject(300, 0)
+    tracker.update(1000, [left, right])
+    # Given in the opposite order, but each should still be matched to the nearest
+    left_moved, right_moved = FakeSubject(5, 0), FakeSubject(305, 0)
+    tracker.update(2000, [right_moved, left_moved])
+    tracks = tracker.close_segment()
+    assert len(tracks) == 2
+    by_first = {id(track.subjects[1000]): track for track in tracks}
+    assert by_first[id(left)].subjects[2000] is left_moved
+    assert by_first[id(right)].subjects[2000] is right_moved
+
+
+def test_tracker_starts_new_track_for_new_or_distant_subjects():
+    tracker = Tracker(time_increment=1000, max_distance=100)
+    tracker.update(1000, [FakeSubject(0, 0)])
+    # One subject continues the track, the other is too far from it so starts its own
+    tracker.update(2000, [FakeSubject(10, 0), FakeSubject(500, 500)])
+    tracks = tracker.close_segment()
+    assert sorted(len(track.subjects) for track in tracks) == [1, 2]
+
+
+def test_tracker_ends_tracks_after_a_frame_without_subjects():
+    tracker = Tracker(time_increment=1000)
+    tracker.update(1000, [FakeSubject(0, 0)])
+    tracker.update(2000, [])
+    tracker.update(3000, [FakeSubject(0, 0)])
+    tracks = tracker.close_segment()
+    assert [sorted(track.subjects) for track in tracks] == [[1000], [3000]]
+
+
+def test_tracker_ends_tracks_after_a_gap_in_time():
+    tracker = Tracker(time_increment=1000)
+    tracker.update(1000, [FakeSubject(0, 0)])
+    tracker.update(3000, [FakeSubject(0, 0)])
+    assert len(tracker.close_segment()) == 2
+
+
+def test_tracker_ends_a_track_when_its_subject_disappears():
+    tracker = Tracker(time_increment=1000)
+    tracker.update(1000, [FakeSubject(0, 0), FakeSubject(300, 0)])
+    tracker.update(2000, [FakeSubject(300, 0)])
+    tracker.update(3000, [FakeSubject(0, 0), FakeSubject(300, 0)])
+    tracks = tracker.close_segment()
+    # The left subject's track ended at 1000ms, so it starts a new track at 3000ms
+    assert sorted(sorted(track.subjects) for track in tracks) == [[1000], [1000, 2000, 3000], [3000]]
+
+
+def test_close_segment_resets_tracks():
+    tracker = Tracker(time_increment=1000)
+    tracker.update(1000, [FakeSubject(0, 0)])
+    assert len(tracker.close_segment()) == 1
+    tracker.update(2000, [FakeSubject(0, 0)])
+    tracks = tracker.close_segment()
+    assert len(tracks) == 1 and sorted(tracks[0].subjects) == [2000]
@@ -0,0 +1,21 @@
+from video_archive import _padded_ranges, trim_video_to_segments
+
+
+def segment(time_begin, time_end):
+    return {'time_begin': time_begin, 'time_end': time_end}
+
+
+def test_segments_are_padded_and_clipped_at_the_start():
+    assert _padded_ranges([segment(2000, 4000), segment(30000, 35000)], padding_secs=5) == [[0, 9], [25, 40]]
+
+
+def test_overlapping_and_touching_segments_are_merged_in_order():
+    segments = [segment(40000, 42000), segment(10000, 12000), segment(20000, 22000), segment(14000, 15000)]
+    assert _padded_ranges(segments, padding_secs=4) == [[6, 26], [36, 46]]
+    # A segment entirely within an earlier padded range doesn't shorten it
+    assert _padded_ranges([segment(10000, 30000), segment(12000, 14000)], padding_secs=1) == [[9, 31]]
+
+
+def test_no_segments_are_not_trimmed(tmp_path):
+    assert _padded_ranges([], padding_secs=5) == []
+    assert not trim_video_to_segments(str(tmp_path / 'in.mp4'), str(tmp_path / 'out.mp4'), [])
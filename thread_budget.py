@@ -0,0 +1,110 @@
+import os
+import cv2
+import threading
+
+
+class ThreadBudget:
+    """ The ThreadBudget class co-ordinates how many CPU threads each stage of the processing pipeline may use, to avoid
+        over-subscribing the CPU (and the resulting thermal throttling) on small devices such as a Raspberry Pi.
+
+        Each stage is given a budget, which is applied as follows:
+            decode:    threads used by the video decoder, set via CAP_PROP_N_THREADS when a clip's video is opened
+            detect:    OpenCV's internal thread pool, via cv2.setNumThreads - used heavily when finding subjects
+            composite: number of worker threads rendering composites
+            output:    no direct control, as saving images is single-threaded, but is given cores if pinning stages
+        Optionally, each stage can also be pinned to its own set of cores, allocated in the order above.  If the SoC
+        temperature passes throttle_temp_c then every budget is halved (to a minimum of 1), until it falls back below
+        throttle_temp_c less throttle_hysteresis_c.
+        ThreadBudget.setup() is optional - until it is called, get() returns None and nothing is pinned or limited.
+        ThreadBudget has no project-specific dependencies.
+    """
+
+    #
+    # ##### CLASS ATTRIBUTES
+    #
+    stages = ['decode', 'detect', 'composite', 'output']
+    _is_setup = False
+    _budgets = {}
+    _cores = {}
+    _pin_stages = False
+    _throttle_temp_c = None
+    _throttle_hysteresis_c = 5
+    is_throttled = False
+    _lock = threading.Lock()
+
+    #
+    # ##### SETUP METHODS
+    #
+    @staticmethod
+    def setup(stage_budgets, pin_stages=False, throttle_temp_c=None, throttle_hysteresis_c=5):
+        """ Sets the thread budget for each stage - typically this would be at the top of the main file.
+            :param stage_budgets: A dict with the number of threads for each of the stages listed in ThreadBudget.stages
+            :param pin_stages: Boolean; if true, each stage's threads are restricted to its own set of cores.
+            :param throttle_temp_c: Temperature (in degrees C) above which all budgets are halved, or None to disable.
+            :param throttle_hysteresis_c: How far below throttle_temp_c it must cool, before budgets are restored.
+        """
+        for stage in ThreadBudget.stages:
+            if stage_budgets.get(stage, 0) < 1:
+                raise Exception('ThreadBudget.setup() requires a budget of at least 1 thread for %s' % stage)
+        ThreadBudget._budgets = {stage: stage_budgets[stage] for stage in ThreadBudget.stages}
+        ThreadBudget._pin_stages = pin_stages and hasattr(os, 'sched_setaffinity')
+        ThreadBudget._throttle_temp_c = throttle_temp_c
+        ThreadBudget._throttle_hysteresis_c = throttle_hysteresis_c
+        ThreadBudget.is_throttled = False
+
+        # Allocate consecutive cores to each stage in turn - wrapping around if the budgets exceed the available cores
+        if ThreadBudget._pin_stages:
+            cores = sorted(os.sched_getaffinity(0))
+            next_core = 0
+            for stage in ThreadBudget.stages:
+                ThreadBudget._cores[stage] = {cores[(next_core + num) % len(cores)]
+                                              for num in range(min(ThreadBudget._budgets[stage], len(cores)))}
+                next_core += ThreadBudget._budgets[stage]
+
+        ThreadBudget._is_setup = True
+        cv2.setNumThreads(ThreadBudget.get('detect'))
+
+    #
+    # ##### PUBLIC METHODS
+    #
+    @staticmethod
+    def get(stage):
+        """ Returns the number of threads the stage should currently use, taking account of any throttling.
+            :param stage: One of the stages listed in ThreadBudget.stages
+            :return: Returns an integer number of threads, or None if ThreadBudget hasn't been set up.
+        """
+        if not ThreadBudget._is_setup:
+            return None
+        if ThreadBudget.is_throttled:
+            return max(ThreadBudget._budgets[stage] // 2, 1)
+        return ThreadBudget._budgets[stage]
+
+    @staticmethod
+    def pin_current_thread(stage):
+        """ If pinning stages, restricts the calling thread to the cores allocated to the stage.  Should be called at
+            the start of each stage's thread - any threads it then starts (e.g. worker pools) inherit the same cores.
+            :param stage: One of the stages listed in ThreadBudget.stages
+        """
+        if ThreadBudget._is_setup and ThreadBudget._pin_stages:
+            # On Linux, pid 0 refers to the calling thread only, rather than the whole process
+            os.sched_setaffinity(0, ThreadBudget._cores[stage])
+
+    @staticmethod
+    def update_temperature(temp_c):
+        """ Throttles or restores the thread budgets based on the current SoC temperature.  The decode budget only
+            takes effect from the next clip, whereas the detect and composite budgets change immediately.
+            :param temp_c: The current temperature in degrees C, or None if not known (in which case nothing changes).
+            :return: Returns True if the throttled state changed, otherwise False.
+        """
+        if not ThreadBudget._is_setup or ThreadBudget._throttle_temp_c is None or temp_c is None:
+            return False
+        with ThreadBudget._lock:
+            if not ThreadBudget.is_throttled and temp_c >= ThreadBudget._throttle_temp_c:
+                ThreadBudget.is_throttled = True
+            elif (ThreadBudget.is_throttled
+                  and temp_c < ThreadBudget._throttle_temp_c - ThreadBudget._throttle_hysteresis_c):
+                ThreadBudget.is_throttled = False
+            else:
+                return False
+            cv2.setNumThreads(ThreadBudget.get('detect'))
+            return True
@@ -1,12 +1,187 @@
-# NEW
-
-#
+import math
+import numpy
 
 
 class Track:
+    """ The Track class links together the same subject across consecutive frames, i.e. a single object moving.
+
+        Tracks are created and extended by a Tracker, as each frame's subjects are found.  Once a segment is complete,
+        select_representatives() picks a small number of subjects to represent the whole track within composites, and
+        marks the others as tracked - composites then ignore those, rather than re-examining every subject.
+        Track is indirectly dependent on Subject, as a project-specific dependency.
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self.subjects = {}      # Keyed by frame time, with the value being the Subject within that frame
+
+    def add_subject(self, time, subject):
+        self.subjects[time] = subject
+
+    @property
+    def last_time(self):
+        return max(self.subjects)
+
+    @property
+    def last_subject(self):
+        return self.subjects[self.last_time]
+
+    def select_representatives(self):
+        """ Picks the subjects to represent this track within composites, and marks all others as tracked.
+            Working through the track in time order, an active subject is picked whenever its dilated area no longer
+            overlaps the previously picked subject - giving a series of snapshots along the path of the track.
+            :return: Returns a list of the representative subjects.
+        """
+        representatives = []
+        for time in sorted(self.subjects):
+            subject = self.subjects[time]
+            if not subject.is_active:
+                continue
+            if not representatives or not _rects_overlap(representatives[-1].dilated_params, subject.dilated_params):
+                representatives.append(subject)
+            else:
+                subject.is_tracked = True
+        return representatives
+
+
+class Tracker:
+    """ The Tracker class builds Tracks, by linking each frame's subjects to those in the frame immediately before.
 
-    subjects = {}
+        Subjects are matched by the overlap (intersection over union) of their bounds, or failing that by the distance
+        between their centres, with the overall best set of matches found via the Hungarian algorithm.  Any subject
+        not matched to an existing track starts a new one.  Tracks only link consecutive frames, so any frame without
+        subjects ends all current tracks.
+        Tracker is indirectly dependent on Subject, as a project-specific dependency.
+    """
+
+    _infeasible_cost = 1e6
+
+    def __init__(self, time_increment, max_distance=100):
+        """ Create a new Tracker, typically one per Clip.
+            :param time_increment: The time, in milliseconds, between subsequent frames.
+            :param max_distance: Maximum distance, in pixels, between the centres of non-overlapping subjects to match.
+        """
+        self._time_increment = time_increment
+        self._max_distance = max_distance
+        self._num_tracks = 0
+        self.tracks = []            # All tracks since the last call to close_segment
+        self._current_tracks = []   # Tracks with a subject in the most recent frame, so may be extended
+
+    def update(self, time, subjects):
+        """ Adds the subjects from a single frame, either extending existing tracks or creating new ones.
+            :param time: The time of the frame, in milliseconds.
+            :param subjects: A list of Subjects within the frame.
+        """
+        current_tracks = [track for track in self._current_tracks
+                          if track.last_time == time - self._time_increment]
+        matched_subjects = set()
+        self._current_tracks = []
+        if current_tracks and subjects:
+            cost = numpy.array([[self._match_cost(track.last_subject, subject) for subject in subjects]
+                                for track in current_tracks])
+            for track_num, subject_num in _linear_sum_assignment(cost):
+                if cost[track_num, subject_num] < Tracker._infeasible_cost:
+                    current_tracks[track_num].add_subject(time, subjects[subject_num])
+                    self._current_tracks.append(current_tracks[track_num])
+                    matched_subjects.add(subject_num)
+        for subject_num, subject in enumerate(subjects):
+            if subject_num not in matched_subjects:
+                track = Track(self._num_tracks)
+                track.add_subject(time, subject)
+                self._num_tracks += 1
+                self.tracks.append(track)
+                self._current_tracks.append(track)
+
+    def close_segment(self):
+        """ Ends all tracks, e.g. at the end of a segment.
+            :return: Returns a list of all tracks created since the last call to close_segment.
+        """
+        tracks = self.tracks
+        self.tracks = []
+        self._current_tracks = []
+        return tracks
+
+    def _match_cost(self, prev_subject, subject):
+        """ PRIVATE: Calculates the cost of matching two subjects - lower is a better match.
+            Overlapping subjects cost 0-1 (1 - IoU), otherwise 1-2 based on the distance between centres, up to
+            max_distance - any further apart than that cannot be matched.
+        """
+        iou = _rects_iou(prev_subject.bounds, subject.bounds)
+        if iou > 0:
+            return 1 - iou
+        distance = subject.dist_from_point(prev_subject.contour_center)
+        if distance <= self._max_distance:
+            return 1 + distance / self._max_distance
+        return Tracker._infeasible_cost
+
+
+#
+# ##### GEOMETRY HELPERS
+#
+def _rects_iou(rect1, rect2):
+    """ PRIVATE: Intersection over union of two rects, each in [x, y, w, h] format. """
+    overlap_x = min(rect1[0] + rect1[2], rect2[0] + rect2[2]) - max(rect1[0], rect2[0])
+    overlap_y = min(rect1[1] + rect1[3], rect2[1] + rect2[3]) - max(rect1[1], rect2[1])
+    if overlap_x <= 0 or overlap_y <= 0:
+        return 0
+    intersection = overlap_x * overlap_y
+    return intersection / (rect1[2] * rect1[3] + rect2[2] * rect2[3] - intersection)
 
 
+def _rects_overlap(params1, params2):
+    """ PRIVATE: Tests whether two areas overlap, each in [y1, y2, x1, x2] format (as Subject.crop_params). """
+    return (params1[0] < params2[1] and params2[0] < params1[1]
+            and params1[2] < params2[3] and params2[2] < params1[3])
 
 
+def _linear_sum_assignment(cost):
+    """ PRIVATE: Hungarian algorithm - finds the assignment of rows to columns with the lowest total cost.
+        :param cost: A 2D numpy array, which need not be square.
+        :return: Returns a list of (row, column) tuples, one for each row or column (whichever is fewer).
+    """
+    transposed = cost.shape[0] > cost.shape[1]
+    if transposed:
+        cost = cost.T
+    num_rows, num_cols = cost.shape
+    # Uses 1-based indexing, with 0 as a dummy column - u and v are the row and column potentials, col_row holds the
+    #  row assigned to each column, and col_way the previous column on the augmenting path
+    u = [0.0] * (num_rows + 1)
+    v = [0.0] * (num_cols + 1)
+    col_row = [0] * (num_cols + 1)
+    col_way = [0] * (num_cols + 1)
+    for row in range(1, num_rows + 1):
+        col_row[0] = row
+        col0 = 0
+        min_v = [math.inf] * (num_cols + 1)
+        used = [False] * (num_cols + 1)
+        while True:
+            used[col0] = True
+            row0 = col_row[col0]
+            delta = math.inf
+            col1 = 0
+            for col in range(1, num_cols + 1):
+                if not used[col]:
+                    reduced_cost = cost[row0 - 1, col - 1] - u[row0] - v[col]
+                    if reduced_cost < min_v[col]:
+                        min_v[col] = reduced_cost
+                        col_way[col] = col0
+                    if min_v[col] < delta:
+                        delta = min_v[col]
+                        col1 = col
+            for col in range(num_cols + 1):
+                if used[col]:
+                    u[col_row[col]] += delta
+                    v[col] -= delta
+                else:
+                    min_v[col] -= delta
+            col0 = col1
+            if col_row[col0] == 0:
+                break
+        while col0:
+            col1 = col_way[col0]
+            col_row[col0] = col_row[col1]
+            col0 = col1
+    pairs = [(col_row[col] - 1, col - 1) for col in range(1, num_cols + 1) if col_row[col] != 0]
+    if transposed:
+        pairs = [(col, row) for row, col in pairs]
+    return sorted(pairs)
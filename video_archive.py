@@ -0,0 +1,222 @@
+import os
+import json
+import shutil
+import tempfile
+import subprocess
+import threading
+import kd_timers
+import helper
+from library import Library
+from activity_log import ActivityLog
+from kd_app_thread import AppThread
+
+
+def transcode_video(source_fullpath, dest_fullpath, ffmpeg_path='ffmpeg', scale_width=640, crf=30, threads=1):
+    """ Re-encodes a video at a lower resolution and quality, using ffmpeg at the lowest CPU priority.
+        :param source_fullpath: A fully qualified path to the video to transcode - left untouched.
+        :param dest_fullpath: A fully qualified path to save the transcoded video to, always in mp4 format.
+        :param ffmpeg_path: Path to the ffmpeg executable, or just 'ffmpeg' if on the path.
+        :param scale_width: Width of the transcoded video, in pixels - the height is scaled to match.
+        :param crf: x264 constant rate factor - higher is smaller but lower quality, where 23 is the x264 default.
+        :param threads: Maximum number of threads ffmpeg may use.
+        :return: Returns True if the video was transcoded successfully, otherwise False (and removes any partial file).
+    """
+    command = [ffmpeg_path, '-nostdin', '-loglevel', 'error', '-y', '-threads', str(threads),
+               '-i', source_fullpath,
+               '-vf', 'scale=%d:-2' % scale_width,
+               '-c:v', 'libx264', '-preset', 'veryfast', '-crf', str(crf), '-threads', str(threads),
+               '-an', '-movflags', '+faststart', '-f', 'mp4', dest_fullpath]
+    # Lowest priority, so it only ever uses CPU time which the rest of the application doesn't need
+    if not _run_ffmpeg(command) or not os.path.isfile(dest_fullpath):
+        if os.path.isfile(dest_fullpath):
+            os.remove(dest_fullpath)
+        return False
+    return True
+
+
+def trim_video_to_segments(source_fullpath, dest_fullpath, segments, padding_secs=5, ffmpeg_path='ffmpeg'):
+    """ Saves a copy of a video containing only its active segments, each with some padding before and after - using
+        ffmpeg's stream copy, so nothing is re-encoded and it is nearly as quick as copying the file.
+        Stream copy can only cut at keyframes, so each part starts at the keyframe before its padded start time, i.e.
+        may include a little extra.  Overlapping padded segments are merged, and the parts are then joined in order.
+        :param source_fullpath: A fully qualified path to the video to trim - left untouched.
+        :param dest_fullpath: A fully qualified path to save the trimmed video to.
+        :param segments: A list of dicts each with time_begin and time_end in milliseconds, as in clip_data.
+        :param padding_secs: Number of seconds of video to keep before and after each segment.
+        :param ffmpeg_path: Path to the ffmpeg executable, or just 'ffmpeg' if on the path.
+        :return: Returns True if trimmed successfully, otherwise False (and removes any partial file).
+    """
+    ranges = _padded_ranges(segments, padding_secs)
+    if not ranges:
+        return False
+
+    temp_folder = tempfile.mkdtemp(prefix='.trim-', dir=os.path.dirname(dest_fullpath))
+    try:
+        part_fullpaths = []
+        for part_num, (start_secs, end_secs) in enumerate(ranges):
+            part_fullpath = os.path.join(temp_folder, 'part%03d.mp4' % part_num)
+            if not _run_ffmpeg([ffmpeg_path, '-nostdin', '-loglevel', 'error', '-y',
+                                '-ss', '%.3f' % start_secs, '-i', source_fullpath,
+                                '-t', '%.3f' % (end_secs - start_secs),
+                                '-c', 'copy', '-avoid_negative_ts', 'make_zero', part_fullpath]):
+                return False
+            part_fullpaths.append(part_fullpath)
+
+        # Join the parts with ffmpeg's concat demuxer, which also only copies the streams
+        concat_fullpath = os.path.join(temp_folder, 'concat.txt')
+        with open(concat_fullpath, 'w') as concat_handle:
+            for part_fullpath in part_fullpaths:
+                concat_handle.write("file '%s'\n" % part_fullpath.replace("'", "'\\''"))
+        temp_dest_fullpath = os.path.join(temp_folder, 'trimmed.mp4')
+        if not _run_ffmpeg([ffmpeg_path, '-nostdin', '-loglevel', 'error', '-y', '-f', 'concat', '-safe', '0',
+                            '-i', concat_fullpath, '-c', 'copy', '-movflags', '+faststart', temp_dest_fullpath]):
+            return False
+        os.replace(temp_dest_fullpath, dest_fullpath)
+        return True
+    finally:
+        shutil.rmtree(temp_folder, ignore_errors=True)
+
+
+def _padded_ranges(segments, padding_secs):
+    """ PRIVATE: Pads each segment, merging any which then overlap or touch.
+        :return: Returns a list of [start_secs, end_secs] lists, in time order.
+    """
+    ranges = []
+    for segment in sorted(segments, key=lambda segment: segment['time_begin']):
+        start_secs = max(segment['time_begin'] / 1000 - padding_secs, 0)
+        end_secs = segment['time_end'] / 1000 + padding_secs
+        if ranges and start_secs <= ranges[-1][1]:
+            ranges[-1][1] = max(ranges[-1][1], end_secs)
+        else:
+            ranges.append([start_secs, end_secs])
+    return ranges
+
+
+def _run_ffmpeg(command):
+    """ PRIVATE: Runs an ffmpeg command at the lowest CPU priority.
+        :return: Returns True if successful, otherwise False.
+    """
+    try:
+        result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                preexec_fn=lambda: os.nice(19))
+    except OSError:
+        return False
+    return result.returncode == 0
+
+
+class VideoArchiveIndex:
+    """ The VideoArchiveIndex class records every video which has been moved to the transcoded tier, keyed by basename,
+        with its size before and after - so videos are never transcoded twice, and the space saved can be reported.
+        The index is a single JSON file, re-written (atomically, via a temporary file) each time a video is added.
+        VideoArchiveIndex has no project-specific dependencies.
+    """
+
+    def __init__(self, index_fullpath):
+        self._index_fullpath = index_fullpath
+        self._lock = threading.Lock()
+        try:
+            with open(index_fullpath, 'r') as index_handle:
+                self._entries = json.load(index_handle)
+        except (OSError, ValueError):
+            self._entries = {}
+
+    def contains(self, basename):
+        with self._lock:
+            return basename in self._entries
+
+    def get(self, basename):
+        """ Returns the index entry for a transcoded video, or None if it hasn't been transcoded. """
+        with self._lock:
+            return self._entries.get(basename)
+
+    def add(self, basename, entry):
+        """ Records a transcoded video, and saves the index.
+            :param entry: A dict of details, e.g. the sizes before and after transcoding.
+        """
+        with self._lock:
+            self._entries[basename] = entry
+            temp_fullpath = '%s.tmp' % self._index_fullpath
+            with open(temp_fullpath, 'w') as index_handle:
+                json.dump(self._entries, index_handle, indent=2)
+            os.replace(temp_fullpath, self._index_fullpath)
+
+    def remove_missing(self, basenames):
+        """ Forgets any videos not in basenames, e.g. once deleted by Cleanup. """
+        with self._lock:
+            for basename in [basename for basename in self._entries if basename not in basenames]:
+                del self._entries[basename]
+
+
+#
+# ##### TIERED STORAGE THREAD
+#
+class TieredStorage(AppThread):
+    """ Rather than only ever deleting old videos, TieredStorage re-encodes them at a lower resolution and quality once
+        they reach transcode_after_hours - so far more history fits within the same target_ratios budget, and Cleanup
+        then deletes the (much smaller) transcoded videos as before.  Videos are chosen by the same retention score
+        as Cleanup, i.e. age as modified by Library.modify_ages, so clips without any segments are transcoded first.
+        Clips archived as 'to_transcode' (see the archive no_segments setting) are transcoded first, whatever their age.
+        Only one video is transcoded at a time, and only while the CPU is idle, at the lowest priority.
+    """
+
+    def threaded_function(self, video_folder, index, get_clip_data, options):
+        """ :param video_folder: The video_done folder.
+            :param index: The VideoArchiveIndex in which transcoded videos are recorded.
+            :param get_clip_data: A function returning a list of every clip_data entry, used for the retention score.
+            :param options: A dict of tiered storage settings - see settings_Template.json.
+        """
+        while True:
+            if self.should_abort():
+                return
+
+            if (kd_timers.secs_elapsed_since_last(secs=options['check_interval_secs'], timer_id='tiered_storage')
+                    and helper.is_cpu_idle(options['idle_load_per_cpu'])):
+                for file in self._get_candidates(video_folder, index, get_clip_data, options):
+                    if self.should_abort() or not helper.is_cpu_idle(options['idle_load_per_cpu']):
+                        break
+                    self._transcode(file, index, options)
+            else:
+                kd_timers.sleep(secs=5)
+
+    @staticmethod
+    def _get_candidates(video_folder, index, get_clip_data, options):
+        """ PRIVATE: Returns a list of videos due to be transcoded, those with the highest retention score first. """
+        library = Library([('video_done', video_folder)])
+        library.determine_cleanup_folder({'video_done': 1})
+        library.get_file_ages()
+        clip_data = get_clip_data()
+        library.modify_ages(clip_data)
+        index.remove_missing(set(file['basename'] for file in library.library['video_done']))
+        to_transcode = set(entry['basename'] for entry in clip_data if entry.get('archived') == 'to_transcode')
+        # transcode_after_hours is None if only transcoding those archived as 'to_transcode'
+        candidates = [file for file in library.library['video_done']
+                      if file['fullpath'].endswith('.mp4') and not index.contains(file['basename'])
+                      and (file['basename'] in to_transcode
+                           or (options['transcode_after_hours'] is not None
+                               and file['file_age'] >= options['transcode_after_hours']))]
+        return sorted(candidates, key=lambda file: (file['basename'] in to_transcode, file['file_age']), reverse=True)
+
+    @staticmethod
+    def _transcode(file, index, options):
+        """ PRIVATE: Transcodes a single video, replacing the original only if the result is actually smaller. """
+        # Not ending .mp4 whilst incomplete, so that a partial file is never mistaken for a video
+        temp_fullpath = '%s.transcoding' % file['fullpath']
+        if not transcode_video(file['fullpath'], temp_fullpath, ffmpeg_path=options['ffmpeg_path'],
+                               scale_width=options['scale_width'], crf=options['crf'], threads=options['threads']):
+            ActivityLog.add_entry('ERROR - Unable to transcode %s' % file['basename'])
+            # Record it anyway, so that it isn't retried every time
+            index.add(file['basename'], {'size_original': file['filesize'], 'size': file['filesize'],
+                                         'transcoded': False, 'timestamp': kd_timers.timestamp()})
+            return
+        new_size = os.path.getsize(temp_fullpath)
+        if new_size < file['filesize']:
+            os.replace(temp_fullpath, file['fullpath'])
+        else:
+            os.remove(temp_fullpath)
+            new_size = file['filesize']
+        index.add(file['basename'], {'size_original': file['filesize'], 'size': new_size,
+                                     'transcoded': new_size < file['filesize'],
+                                     'scale_width': options['scale_width'], 'crf': options['crf'],
+                                     'timestamp': kd_timers.timestamp()})
+        ActivityLog.add_entry('Transcoded %s: %.1fMB to %.1fMB'
+                              % (file['basename'], file['filesize'] / (1024 * 1024), new_size / (1024 * 1024)))